@@ -0,0 +1,52 @@
+import re
+from typing import Dict, NamedTuple, Tuple
+
+from nio import MatrixRoom
+
+from bangalore_bot.chat_functions import make_pill
+
+
+class RoomAdmins(NamedTuple):
+    # The user IDs of the room's admins
+    user_ids: Tuple[str, ...]
+    # The admins as a comma-separated list of pills
+    pills: str
+
+
+class AdminRoster:
+    def __init__(self, min_power_level: int = 50, exclude_pattern: str = "whatsappbot"):
+        """A per-room cache of who the admins of each room are.
+
+        A room's admins are worked out from its power levels the first time they are
+        needed, and then kept until `invalidate` is called for that room, which
+        should happen whenever an `m.room.power_levels` event arrives for it.
+
+        Args:
+            min_power_level: The power level a user needs to count as an admin.
+
+            exclude_pattern: A regex. Users whose ID matches it are never counted as
+                admins, e.g. bridge bots. An empty pattern excludes nobody.
+        """
+        self.min_power_level = min_power_level
+        self.exclude_pattern = re.compile(exclude_pattern) if exclude_pattern else None
+        self._rooms = {}  # type: Dict[str, RoomAdmins]
+
+    def get(self, room: MatrixRoom) -> RoomAdmins:
+        """Get the admins of a room"""
+        admins = self._rooms.get(room.room_id)
+        if admins is None:
+            admins = self._rooms[room.room_id] = self._find_admins(room)
+        return admins
+
+    def invalidate(self, room_id: str) -> None:
+        """Forget the admins of a room, so that they are worked out again next time"""
+        self._rooms.pop(room_id, None)
+
+    def _find_admins(self, room: MatrixRoom) -> RoomAdmins:
+        user_ids = tuple(
+            user
+            for user, level in room.power_levels.users.items()
+            if level >= self.min_power_level
+            and not (self.exclude_pattern and self.exclude_pattern.search(user))
+        )
+        return RoomAdmins(user_ids, ", ".join(make_pill(user) for user in user_ids))
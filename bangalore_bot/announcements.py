@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from typing import Sequence, Tuple
+
+from nio import AsyncClient
+
+from bangalore_bot.chat_functions import make_pill, send_text_with_mentions
+
+logger = logging.getLogger(__name__)
+
+
+async def announce_birthdays(
+    client: AsyncClient, room_ids: Sequence[str], user_ids: Sequence[str]
+) -> None:
+    """Wish everyone with a birthday today in each room, with a single message per
+    room that mentions all of them. Rooms are sent to concurrently.
+
+    Args:
+        client: The client to communicate to matrix with.
+
+        room_ids: The rooms to announce the birthdays in.
+
+        user_ids: The users whose birthday it is.
+    """
+    if not user_ids or not room_ids:
+        return
+
+    message, formatted_message = birthday_message(user_ids)
+    results = await asyncio.gather(
+        *(
+            send_text_with_mentions(
+                client, room_id, message, formatted_message, user_ids
+            )
+            for room_id in room_ids
+        ),
+        return_exceptions=True,
+    )
+    for room_id, result in zip(room_ids, results):
+        if isinstance(result, Exception):
+            logger.error(
+                "Unable to announce birthdays in %s", room_id, exc_info=result
+            )
+
+
+def birthday_message(user_ids: Sequence[str]) -> Tuple[str, str]:
+    """The (plain text, HTML) message wishing the given users a happy birthday"""
+    if len(user_ids) == 1:
+        return (
+            f"{user_ids[0]}'s birthday is today🎉",
+            f"{make_pill(user_ids[0])}'s birthday is today🎉",
+        )
+    return (
+        f"{_join(user_ids)} have their birthday today🎉",
+        f"{_join([make_pill(user_id) for user_id in user_ids])} have their birthday "
+        f"today🎉",
+    )
+
+
+def _join(names: Sequence[str]) -> str:
+    """Join names into "a, b and c" """
+    return ", ".join(names[:-1]) + " and " + names[-1]
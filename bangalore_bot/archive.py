@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Optional
+
+from nio import RoomMessageText
+
+from bangalore_bot.metrics import Counter
+from bangalore_bot.storage import MessageRow, Storage
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_TOTAL = Counter(
+    "bot_archived_messages_total", "Messages written to the message archive"
+)
+DROPPED_TOTAL = Counter(
+    "bot_archive_dropped_messages_total",
+    "Messages that couldn't be archived, by reason",
+    ("reason",),
+)
+
+
+class MessageArchiver:
+    def __init__(
+        self,
+        store: Storage,
+        capacity: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1,
+    ):
+        """Keeps a history of the messages sent to the bot's rooms in the database.
+
+        Adding a message only appends it to an in-memory ring buffer. A background
+        task writes the buffer out in batches, each a single multi-row insert, once
+        `batch_size` messages are waiting or `flush_interval` seconds after the
+        last write, whichever comes first. If the database falls so far behind that
+        the buffer fills up, the oldest messages are dropped.
+
+        Args:
+            store: The database to write messages to.
+
+            capacity: The most messages to hold in memory.
+
+            batch_size: The most messages to write in one insert.
+
+            flush_interval: The longest a message waits to be written, in seconds.
+        """
+        self.store = store
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._buffer = deque(maxlen=capacity)  # type: Deque[MessageRow]
+        self._batch_ready = None  # type: Optional[asyncio.Event]
+        self._task = None  # type: Optional[asyncio.Future]
+
+    def __len__(self) -> int:
+        """The number of messages waiting to be written"""
+        return len(self._buffer)
+
+    def add(self, room_id: str, event: RoomMessageText) -> None:
+        """Queue a message to be archived"""
+        if len(self._buffer) == self.capacity:
+            DROPPED_TOTAL.inc("buffer_full")
+        self._buffer.append(
+            (event.event_id, room_id, event.sender, event.body, event.server_timestamp)
+        )
+        if len(self._buffer) >= self.batch_size and self._batch_ready is not None:
+            self._batch_ready.set()
+
+    def start(self) -> None:
+        """Start writing queued messages in the background"""
+        self._batch_ready = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        """Stop the background task and write the messages that are left"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Write every queued message, in batches"""
+        while self._buffer:
+            count = min(self.batch_size, len(self._buffer))
+            batch = [self._buffer.popleft() for _ in range(count)]
+            try:
+                await self.store.insert_messages(batch)
+            except Exception:
+                logger.exception(f"Unable to archive {count} messages")
+                DROPPED_TOTAL.inc("error", amount=count)
+            else:
+                ARCHIVED_TOTAL.inc(amount=count)
+
+    async def _run(self) -> None:
+        while True:
+            if len(self._buffer) < self.batch_size:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._batch_ready.wait(), self.flush_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
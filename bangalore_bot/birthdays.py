@@ -0,0 +1,53 @@
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+
+class BirthdayIndex:
+    def __init__(self, birthdays: Iterable[Tuple[str, int, int]] = ()):
+        """An in-memory calendar of birthdays, bucketed by month and day.
+
+        Listing a month or a day costs time proportional to the number of results.
+        The index is safe to update from another thread while being read.
+
+        Args:
+            birthdays: Initial (sender, birth_month, birth_day) tuples.
+        """
+        # 12 months of 31 days. Each bucket maps senders to None, as an
+        # insertion-ordered set
+        self._calendar = [
+            [{} for _ in range(31)] for _ in range(12)
+        ]  # type: List[List[Dict[str, None]]]
+        self._dates = {}  # type: Dict[str, Tuple[int, int]]
+        self._lock = threading.Lock()
+
+        for sender, birth_month, birth_day in birthdays:
+            self.set(sender, birth_month, birth_day)
+
+    def __len__(self) -> int:
+        return len(self._dates)
+
+    def set(self, sender: str, birth_month: int, birth_day: int) -> None:
+        """Add a user's birthday, moving it if they already had one"""
+        with self._lock:
+            old_date = self._dates.get(sender)
+            if old_date is not None:
+                old_month, old_day = old_date
+                del self._calendar[old_month - 1][old_day - 1][sender]
+
+            self._calendar[birth_month - 1][birth_day - 1][sender] = None
+            self._dates[sender] = (birth_month, birth_day)
+
+    def in_month(self, birth_month: int) -> List[Tuple[str, int]]:
+        """Get the (sender, birth_day) of everyone with a birthday in a month, ordered
+        by day"""
+        with self._lock:
+            return [
+                (sender, day)
+                for day, bucket in enumerate(self._calendar[birth_month - 1], 1)
+                for sender in bucket
+            ]
+
+    def on(self, birth_month: int, birth_day: int) -> List[str]:
+        """Get the users whose birthday falls on the given day"""
+        with self._lock:
+            return list(self._calendar[birth_month - 1][birth_day - 1])
@@ -1,13 +1,65 @@
+import aiohttp
 from nio import AsyncClient, MatrixRoom, RoomMessageText
 
-from bangalore_bot.chat_functions import react_to_event, send_text_to_room, find_admins_and_reply, make_pill
+from bangalore_bot import tracing
+from bangalore_bot.admin_roster import AdminRoster
+from bangalore_bot.chat_functions import react_to_event, send_text_to_room, find_admins_and_reply, make_event_link, make_pill
+from bangalore_bot.command_registry import CommandRegistry
 from bangalore_bot.config import Config
-from bangalore_bot.storage import Storage
+from bangalore_bot.errors import SpotifyError
+from bangalore_bot.metrics import Counter, Histogram
+from bangalore_bot.rate_limit import ALLOW, THROTTLE, RateLimiter
+from bangalore_bot.spotify import SpotifyClient
+from bangalore_bot.stats import RoomReport, RoomStats
+from bangalore_bot.storage import MessageRow, Storage
 from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+import asyncio
+import calendar
+import html
+import logging
 import random
-import aiohttp
-import base64
-from urllib.parse import urlencode
+import re
+
+logger = logging.getLogger(__name__)
+
+# All the commands that the bot responds to, filled in by the `Command` methods
+# decorated with `COMMANDS.command`
+COMMANDS = CommandRegistry()
+
+COMMANDS_TOTAL = Counter(
+    "bot_commands_total", "Commands received, by outcome", ("command", "outcome")
+)
+COMMAND_SECONDS = Histogram(
+    "bot_command_duration_seconds", "Time taken to handle commands", ("command",)
+)
+
+# How many messages the search command shows at a time
+SEARCH_PAGE_SIZE = 5
+# The longest part of a message to show in search results
+SEARCH_SNIPPET_LENGTH = 150
+
+# How many days the stats command reports on by default, and at most
+STATS_DEFAULT_DAYS = 30
+STATS_MAX_DAYS = 365
+# Shades for the stats heatmap, from the quietest hours to the busiest
+HEATMAP_SHADES = " ░▒▓█"
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+
+def static_responses(command_prefix: str) -> List[str]:
+    """All the responses that never change, so they can be rendered ahead of time.
+
+    The responses in the catalog are rendered when it's loaded, so aren't included.
+    """
+    responses = [help_commands_text()]
+    responses.extend(spec.help_text(command_prefix) for spec in COMMANDS)
+    return responses
+
+
+def help_commands_text() -> str:
+    """List the available commands"""
+    return "Available commands: " + ", ".join(spec.name for spec in COMMANDS)
 
 
 class Command:
@@ -19,6 +71,10 @@ class Command:
         command: str,
         room: MatrixRoom,
         event: RoomMessageText,
+        spotify: Optional[SpotifyClient] = None,
+        admin_roster: Optional[AdminRoster] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        stats: Optional[RoomStats] = None,
     ):
         """A command made by a user.
 
@@ -34,6 +90,16 @@ class Command:
             room: The room the command was sent in.
 
             event: The event describing the command.
+
+            spotify: The shared Spotify client, if Spotify is configured.
+
+            admin_roster: The shared cache of room admins. A new one with the
+                default settings is used if not provided.
+
+            rate_limiter: The shared limits on how often commands can be used.
+                Commands aren't limited if not provided.
+
+            stats: The counts of messages and joins in the bot's rooms, if kept.
         """
         self.client = client
         self.store = store
@@ -41,6 +107,10 @@ class Command:
         self.command = command
         self.room = room
         self.event = event
+        self.spotify = spotify
+        self.admin_roster = admin_roster or AdminRoster()
+        self.rate_limiter = rate_limiter
+        self.stats = stats
         self.args = self.command.split()[1:]
         self.day = ""
         self.month = ""
@@ -48,149 +118,146 @@ class Command:
 
     async def process(self):
         """Process the command"""
-        if self.command.startswith("help"):
-            await self._show_help()
-        elif self.command.startswith("birthday"):
-            await self._birthday_func()
-        elif self.command.startswith("rules"):
-            await self._rules_func()
-        elif self.command.startswith("admin"):
-            await self._tag_admins() 
-        elif self.command.startswith("8ball"):
-            await self._8ball()
-        elif self.command.startswith("spotify"):
-            await self._search_spotify()
-        else:
+        words = self.command.split(maxsplit=1)
+        spec = COMMANDS.get(words[0]) if words else None
+        if spec is None:
+            COMMANDS_TOTAL.inc("unknown", "unknown")
             await self._unknown_command()
-    
-    async def _get_access_token(self, session):
-        """Get an access token for Spotify API authentication."""
-        auth_str = f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}"
-        b64_auth_str = base64.b64encode(auth_str.encode()).decode()
-        
-        headers = {
-            'Authorization': f'Basic {b64_auth_str}',
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
-        data = {'grant_type': 'client_credentials'}
+            return
 
-        async with session.post("https://accounts.spotify.com/api/token", headers=headers, data=data) as response:
-            response_data = await response.json()
-            return response_data.get("access_token")
+        if self.rate_limiter is not None:
+            decision = self.rate_limiter.check(self.room.room_id, self.event.sender, spec)
+            if decision != ALLOW:
+                # Tell the user once, without sending a message that would add to
+                # the noise
+                if decision == THROTTLE:
+                    await react_to_event(self.client, self.room.room_id, self.event.event_id, "⏳")
+                COMMANDS_TOTAL.inc(spec.name, "throttled")
+                return
 
+        outcome = "error"
+        try:
+            with COMMAND_SECONDS.time(spec.name), tracing.span(f"command.{spec.name}"):
+                await spec.handler(self)
+            outcome = "ok"
+        finally:
+            COMMANDS_TOTAL.inc(spec.name, outcome)
+    
+    @COMMANDS.command(
+        "spotify",
+        help="Get Spotify song links in the chat",
+        usage=("<search terms> - Get a Spotify link for the best matching song",),
+        rate_limit=(5, 60),
+    )
     async def _search_spotify(self, type='track'):
         """Search Spotify for a given query and return Spotify URLs."""
-        query = " ".join(self.args)
-        async with aiohttp.ClientSession() as session:
-            access_token = await self._get_access_token(session)
-            
-            headers = {
-                'Authorization': f'Bearer {access_token}'
-            }
-            
-            search_params = {
-                'q': query,
-                'type': type,
-                'limit': 1  # Adjust this to get more results
-            }
-            
-            search_url = f"https://api.spotify.com/v1/search?{urlencode(search_params)}"
-            
-            async with session.get(search_url, headers=headers) as response:
-                search_results = await response.json()
-                try:
-                    uri = search_results['tracks']['items'][0]['uri']
-                    spotify_id = uri.split(":")[2]
-                    response = f"https://open.spotify.com/track/{spotify_id}"
-                except:
-                    response = "No song found for this search 🥹"
-                await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id)
-            
-
+        if self.spotify is None:
+            response = "Spotify search isn't set up on this bot 🥹"
+        elif not self.args:
+            response = COMMANDS.get("spotify").help_text(self.config.command_prefix)
+        else:
+            query = " ".join(self.args)
+            try:
+                url = await self.spotify.search(query, type)
+            except (SpotifyError, aiohttp.ClientError, asyncio.TimeoutError):
+                logger.exception(f"Unable to search Spotify for {query!r}")
+                response = "Spotify isn't answering right now, please try again later 🥹"
+            else:
+                response = url or "No song found for this search 🥹"
+        await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id)
 
+    @COMMANDS.command(
+        "admin",
+        aliases=("admins",),
+        help="Notify the admins. Use it while replying to a message to point them at it",
+        rate_limit=(2, 300),
+    )
     async def _tag_admins(self) -> None:
         """Send a message responding to this one, tagging admins"""
-        text = "Tagging all admins! "
-        all_users = self.room.power_levels.users
-        admins = [user for user, level in all_users.items() if level >= 50 and 'whatsappbot' not in user]
-        text += ", ".join([make_pill(admin) for admin in admins])
-        await find_admins_and_reply(self.client, self.room.room_id, self.event.event_id, text, admins)
+        admins = self.admin_roster.get(self.room)
+        text = "Tagging all admins! " + admins.pills
+        await find_admins_and_reply(self.client, self.room.room_id, self.event.event_id, text, list(admins.user_ids))
 
+    @COMMANDS.command("8ball", help="Ask the magic 8 ball!")
     async def _8ball(self):
-        responses = [
-          "It is certain.",
-          "It is decidedly so.",
-          "Without a doubt.",
-          "Yes - definitely.",
-          "You may rely on it.",
-          "As I see it, yes.",
-          "Most likely.",
-          "Outlook good.",
-          "Yes.",
-          "Signs point to yes.",
-          "Reply hazy, try again.",
-          "Ask again later.",
-          "Better not tell you now.",
-          "Cannot predict now.",
-          "Concentrate and ask again.",
-          "Don't count on it.",
-          "My reply is no.",
-          "My sources say no.",
-          "Outlook not so good.",
-          "Very doubtful."
-          ]
-        response = random.choice(responses) 
-        await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id)
+        response = random.choice(self.config.responses.current.eight_ball)
+        await send_text_to_room(self.client, self.room.room_id, response.plain, reply_to_event_id=self.event.event_id, formatted_body=response.html)
 
     async def _echo(self):
         """Echo back the command's arguments"""
         response = " ".join(self.args)
         await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id)
 
+    @COMMANDS.command(
+        "birthday",
+        aliases=("birthdays",),
+        help="Add or list birthdays",
+        usage=(
+            "DD-MM-YYYY - Add or update your birthday",
+            "list (1-12) - List of upcoming birthdays in this month",
+        ),
+    )
     async def _birthday_func(self):
         """Birthday provider aggregator"""
-        args = " ".join(self.args)
-        print("Sender:", self.event.sender)
+        logger.debug(f"Birthday command from {self.event.sender}: {self.args}")
         sender_name = ""
-        print("Args:", self.args)
-        response = "WIP function"
-        #await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id)
-        #return
-        valid_date = await self.is_valid_date_any_format(args)
 
         if self.args == []:
             response = "Please use !birthday list <month> to list birthdays"
             await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id)
+            return
 
         if self.args[0] == "list":
             if len(self.args) != 1:
-                self.store._execute(f"select sender, birth_day from birthdays where birth_month={self.args[1]} order by birth_day asc")
-                res = self.store.cursor.fetchall()
-                await self._display_names(res, self.args[1])
+                try:
+                    birth_month = int(self.args[1])
+                except ValueError:
+                    birth_month = 0
+                if not 1 <= birth_month <= 12:
+                    response = "Please use a month number between 1 and 12"
+                    await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id)
+                    return
+                res = self.store.birthdays.in_month(birth_month)
+                await self._display_names(res, birth_month)
             else:
                 response = "Please use a month to specify which month you want results for"
                 await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id)
-        
+            return
+
+        valid_date = await self.is_valid_date_any_format(" ".join(self.args))
         if valid_date:
-            res = self.store._execute("INSERT INTO birthdays (sender, sender_name, birth_month, birth_day, birth_year) VALUES (?, ?, ?, ?, ?)", (self.event.sender, sender_name, self.month, self.day, self.year))
-            response = f"Stored the birthday!"
-            await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id)
+            await self.store.set_birthday(self.event.sender, sender_name, self.month, self.day, self.year)
+            response = "Stored the birthday!"
+        elif valid_date is None:
+            response = "Please give your birthday as DD-MM-YYYY"
+        else:
+            # The date was rejected, and the user already told why
+            return
+        await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id)
 
     def _ordinal(self, n):
         return str(n)+("th" if 4<=n%100<=20 else {1:"st",2:"nd",3:"rd"}.get(n%10, "th"))
 
     async def _display_names(self, birthdays, birth_month):
-        counter = 1
         formatted_message = f"Birthdays for the month of {birth_month}"
+        message = formatted_message
         if len(birthdays) == 0:
-            formatted_message = "I don't know anyone's birthday for this month 😢"
+            formatted_message = message = "I don't know anyone's birthday for this month 😢"
         else:
             for row in birthdays:
                 formatted_message += f"<p>{make_pill(row[0])}'s birthday is on the {self._ordinal(row[1])}!</p>"
-        await send_text_to_room(self.client, self.room.room_id, formatted_message, reply_to_event_id=self.event.event_id) 
+                message += f"\n\n{row[0]}'s birthday is on the {self._ordinal(row[1])}!"
+        # The message is already HTML, so it doesn't need to be rendered
+        await send_text_to_room(self.client, self.room.room_id, message, reply_to_event_id=self.event.event_id, formatted_body=formatted_message)
+
+    async def is_valid_date_any_format(self, date_string: str) -> Optional[bool]:
+        """Parse a birthday into `self.day`, `self.month` and `self.year`.
 
-    async def is_valid_date_any_format(self, date_string):
+        Returns:
+            True if it's a plausible birthday, False if it's a date that was
+            rejected, in which case the user has already been told why, or None if
+            it isn't a date at all.
+        """
         date_formats = [
             "%Y-%m-%d",   # 2023-10-15
             "%m/%d/%Y",   # 10/15/2023
@@ -230,16 +297,158 @@ class Command:
             except ValueError:
                 # If the format doesn't match, continue trying with the next format
                 continue
-        return False
+        return None
     
-    async def _rules_func(self):
-        response = (f"The rules of this chat:\n\n"
-                f"- This group is a *safe space*. Add and invite people. Please don’t let the GC die.\n\n"
-f"- We’ll plan hangouta every weekend or do something fun. Let’s kill loneliness away.\n\n"
-f"- Pls post an intro once you’re in :)\n\n"
-f"- Please keep conversations in English or provide translations for other languages in view of the larger group."
+    @COMMANDS.command(
+        "search",
+        help="Search this room's history",
+        usage=(
+            "<search terms> - Find messages in this room with all of the words",
+            "<search terms> page <n> - Show more of the messages found",
+        ),
+        rate_limit=(5, 60),
+    )
+    async def _search_history(self) -> None:
+        """Reply with the archived messages of the room that best match the search"""
+        words = self.args
+        page = 1
+        if len(words) > 2 and words[-2].lower() == "page" and words[-1].isdigit():
+            page = max(1, int(words[-1]))
+            words = words[:-2]
+        # Only search for words, leaving out punctuation
+        words = re.findall(r"\w+", " ".join(words))
+
+        formatted_response = None
+        if not self.config.archive_enabled:
+            response = "This bot doesn't keep the room's history to search 🥹"
+        elif not words:
+            response = "Please give some words to search for"
+        else:
+            rows = await self.store.search_messages(
+                self.room.room_id,
+                words,
+                SEARCH_PAGE_SIZE + 1,
+                (page - 1) * SEARCH_PAGE_SIZE,
+            )
+            if not rows:
+                response = "No messages found 🥹" if page == 1 else "No more messages found"
+            else:
+                response, formatted_response = self._search_results(
+                    words, page, rows[:SEARCH_PAGE_SIZE], len(rows) > SEARCH_PAGE_SIZE
                 )
-        await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id)
+        await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id, formatted_body=formatted_response)
+
+    def _search_results(
+        self, words: Sequence[str], page: int, rows: Sequence[MessageRow], more: bool
+    ) -> Tuple[str, str]:
+        """Describe a page of search results, as (plain text, HTML)"""
+        first = (page - 1) * SEARCH_PAGE_SIZE + 1
+        lines = []
+        items = []
+        for number, (event_id, room_id, sender, message, timestamp) in enumerate(rows, first):
+            date = datetime.fromtimestamp(timestamp / 1000).strftime("%d %b %Y")
+            name = self.room.user_name(sender) or sender
+            snippet = " ".join(message.split())
+            if len(snippet) > SEARCH_SNIPPET_LENGTH:
+                snippet = snippet[:SEARCH_SNIPPET_LENGTH - 1] + "…"
+            link = make_event_link(room_id, event_id)
+            lines.append(f"{number}. {date} {name}: {snippet}\n{link}")
+            items.append(
+                f'<li><a href="{html.escape(link)}">{date}</a> '
+                f"<b>{html.escape(name)}</b>: {html.escape(snippet)}</li>"
+            )
+
+        message = "\n\n".join(lines)
+        formatted_message = f'<ol start="{first}">{"".join(items)}</ol>'
+        if more:
+            next_page = f"{self.config.command_prefix}search {' '.join(words)} page {page + 1}"
+            message += f"\n\nFor more, send: {next_page}"
+            formatted_message += f"<p>For more, send: <code>{html.escape(next_page)}</code></p>"
+        return message, formatted_message
+
+    @COMMANDS.command(
+        "stats",
+        help="Show how active this room is",
+        usage=(
+            f"[days] - Show the top posters, busiest times and how many new members "
+            f"stayed, over the last {STATS_DEFAULT_DAYS} days or the given number",
+        ),
+        rate_limit=(2, 300),
+    )
+    async def _room_stats(self) -> None:
+        """Reply with a report on the room's activity"""
+        formatted_response = None
+        if self.stats is None:
+            response = "This bot doesn't keep stats on the room 🥹"
+        elif self.args and not self.args[0].isdigit():
+            response = f"Please give a number of days, up to {STATS_MAX_DAYS}"
+        else:
+            days = int(self.args[0]) if self.args else STATS_DEFAULT_DAYS
+            days = min(max(days, 1), STATS_MAX_DAYS)
+            report = await self.stats.report(self.room.room_id, days)
+            response, formatted_response = self._stats_report(days, report)
+        await send_text_to_room(self.client, self.room.room_id, response, reply_to_event_id=self.event.event_id, formatted_body=formatted_response)
+
+    def _stats_report(self, days: int, report: RoomReport) -> Tuple[str, str]:
+        """Describe a room's activity, as (plain text, HTML)"""
+        period = "day" if days == 1 else f"{days} days"
+        if not report.messages:
+            message = f"No messages in the last {period}"
+            return message, html.escape(message)
+
+        lines = [f"{report.messages} messages in the last {period}"]
+        paragraphs = [f"<p><b>{html.escape(lines[0])}</b></p>"]
+
+        posters = []
+        for number, (user_id, count) in enumerate(report.top_posters, 1):
+            name = self.room.user_name(user_id) or user_id
+            posters.append((f"{number}. {name}: {count}", name, count))
+        lines.append("Top posters:\n" + "\n".join(line for line, _, _ in posters))
+        paragraphs.append(
+            "<p>Top posters:</p><ol>"
+            + "".join(
+                f"<li>{html.escape(name)}: {count}</li>" for _, name, count in posters
+            )
+            + "</ol>"
+        )
+
+        busiest = max(max(row) for row in report.heatmap)
+        day, hour = max(
+            ((day, hour) for day in range(7) for hour in range(24)),
+            key=lambda cell: report.heatmap[cell[0]][cell[1]],
+        )
+        rows = ["    " + "".join(str(hour)[-1] for hour in range(24))]
+        for name, row in zip(WEEKDAYS, report.heatmap):
+            # Any message at all shows, so quiet hours aren't mistaken for empty ones
+            shades = [
+                HEATMAP_SHADES[-(-count * (len(HEATMAP_SHADES) - 1) // busiest)]
+                for count in row
+            ]
+            rows.append(f"{name} " + "".join(shades))
+        busiest_time = f"Busiest on {calendar.day_name[day]}s around {hour:02}:00"
+        lines.append("\n".join(rows) + "\n" + busiest_time)
+        paragraphs.append(
+            f"<pre>{html.escape(chr(10).join(rows))}</pre>"
+            f"<p>{html.escape(busiest_time)}</p>"
+        )
+
+        retention = report.retention
+        if retention.joined:
+            joiners = (
+                f"{retention.joined} joined, {retention.posted} posted within a week "
+                f"of joining and {retention.active} posted in the last week"
+            )
+        else:
+            joiners = f"Nobody joined in the last {period}"
+        lines.append(joiners)
+        paragraphs.append(f"<p>{html.escape(joiners)}</p>")
+
+        return "\n\n".join(lines), "".join(paragraphs)
+
+    @COMMANDS.command("rules", help="Show the rules of this chat")
+    async def _rules_func(self):
+        response = self.config.responses.current.rules
+        await send_text_to_room(self.client, self.room.room_id, response.plain, reply_to_event_id=self.event.event_id, formatted_body=response.html)
 
     async def _react(self):
         """Make the bot react to the command message"""
@@ -255,34 +464,24 @@ f"- Please keep conversations in English or provide translations for other langu
             self.client, self.room.room_id, self.event.event_id, reaction
         )
 
+    @COMMANDS.command(
+        "help",
+        help="Show this help",
+        usage=("[command] - Show help about a command, or `commands` to list them",),
+    )
     async def _show_help(self):
         """Show the help text"""
         if not self.args:
-            text = (
-                    f"Hello, I am a bot made by {make_pill('@tlh:intothematrix.in')}, using `matrix-nio`!\n\n" 
-                    f"I run on the messaging protocol matrix, so expect problems if my maker didn't maintain me properly.\n\n"
-                    f"Use `!help commands` to view available commands."
-            )
-            await send_text_to_room(self.client, self.room.room_id, text, reply_to_event_id=self.event.event_id)
+            response = self.config.responses.current.help_intro
+            await send_text_to_room(self.client, self.room.room_id, response.plain, reply_to_event_id=self.event.event_id, formatted_body=response.html)
             return
 
         topic = self.args[0]
-        if topic == "rules":
-            text = "These are the rules: Don't ask me for commands!"
-        elif topic == "commands":
-            text = "Available commands: admins, birthday, rules, 8ball, spotify"
-        elif topic == "admins":
-            text = "Using !admin or !admins while writing to a message will notify the admins"
-        elif topic == "birthday":
-            text = """!birthday DD-MM-YYYY - Add or update your birthday\n
-!birthday list (1-12) - List of upcoming birthdays in this month"""
-        elif topic == "birthdays":
-            text = """!birthday DD-MM-YYY - Add or update your birthday\n
-            !birthday list (1-12) - List of upcoming birthdays in this month"""
-        elif topic == "spotify":
-            text = "!spotify - Get Spotify song links in the chat"
-        elif topic == "8ball":
-            text = "!8ball - Ask the magic 8 ball!"
+        spec = COMMANDS.get(topic)
+        if topic == "commands":
+            text = help_commands_text()
+        elif spec is not None:
+            text = spec.help_text(self.config.command_prefix)
         else:
             text = "Unknown help topic!"
         await send_text_to_room(self.client, self.room.room_id, text, reply_to_event_id=self.event.event_id)
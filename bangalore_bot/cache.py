@@ -0,0 +1,84 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Returned by `TTLCache.get` when a key isn't cached, as None is a valid value
+MISSING = object()
+
+
+class TTLCache:
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        clock: Callable[[], float] = time.time,
+    ):
+        """A bounded cache that evicts the least recently used entry when full, and
+        treats entries older than `ttl` seconds as missing.
+
+        Args:
+            max_size: The maximum number of entries to hold.
+
+            ttl: The number of seconds an entry stays valid for.
+
+            clock: Returns the current time in seconds. Wall clock time by default,
+                so that expiry times can be persisted.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # type: OrderedDict[Hashable, Tuple[Any, float]]
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        """Get a cached value, or `MISSING` if it isn't cached or has expired"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        self.misses += 1
+        return MISSING
+
+    def set(self, key: Hashable, value: Any, expires_at: Optional[float] = None) -> float:
+        """Cache a value, evicting the least recently used entry if full.
+
+        Args:
+            key: The key to cache the value under.
+
+            value: The value to cache.
+
+            expires_at: When the entry expires. Defaults to `ttl` seconds from now.
+
+        Returns:
+            The time at which the entry expires.
+        """
+        if expires_at is None:
+            expires_at = self.clock() + self.ttl
+
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return expires_at
+
+    def stats(self) -> Dict[str, int]:
+        """Counters describing how well the cache is doing"""
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,5 +1,7 @@
+import functools
 import logging
-import json
+import os
+from typing import Any, Awaitable, Callable, Optional
 
 from nio import (
     AsyncClient,
@@ -7,23 +9,66 @@ from nio import (
     JoinError,
     MatrixRoom,
     MegolmEvent,
+    PowerLevelsEvent,
     RoomGetEventError,
     RoomMessageText,
     UnknownEvent,
     RoomMemberEvent,
 )
 
+from bangalore_bot import tracing
+from bangalore_bot.admin_roster import AdminRoster
+from bangalore_bot.archive import MessageArchiver
 from bangalore_bot.bot_commands import Command
 from bangalore_bot.chat_functions import make_pill, react_to_event, send_text_to_room, send_text_with_mention
 from bangalore_bot.config import Config
+from bangalore_bot.executor import CommandExecutor
 from bangalore_bot.message_responses import Message
+from bangalore_bot.metrics import Histogram
+from bangalore_bot.rate_limit import RateLimiter
+from bangalore_bot.spotify import SpotifyClient
+from bangalore_bot.stats import RoomStats
 from bangalore_bot.storage import Storage
 
 logger = logging.getLogger(__name__)
 
+CALLBACK_SECONDS = Histogram(
+    "bot_callback_duration_seconds",
+    "Time taken by event callbacks, by event type",
+    ("event_type",),
+)
+
+
+def timed(
+    callback: Callable[[MatrixRoom, Any], Awaitable[None]]
+) -> Callable[[MatrixRoom, Any], Awaitable[None]]:
+    """Wrap an event callback to record how long it takes for each event type, and
+    to trace the events it handles"""
+
+    @functools.wraps(callback)
+    async def wrapper(room: MatrixRoom, event: Any) -> None:
+        event_id = getattr(event, "event_id", None)
+        with CALLBACK_SECONDS.time(type(event).__name__), tracing.trace(
+            callback.__name__, event_id, room.room_id
+        ):
+            await callback(room, event)
+
+    return wrapper
+
 
 class Callbacks:
-    def __init__(self, client: AsyncClient, store: Storage, config: Config):
+    def __init__(
+        self,
+        client: AsyncClient,
+        store: Storage,
+        config: Config,
+        spotify: Optional[SpotifyClient] = None,
+        admin_roster: Optional[AdminRoster] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        executor: Optional[CommandExecutor] = None,
+        archiver: Optional[MessageArchiver] = None,
+        stats: Optional[RoomStats] = None,
+    ):
         """
         Args:
             client: nio client used to interact with matrix.
@@ -31,10 +76,32 @@ class Callbacks:
             store: Bot storage.
 
             config: Bot configuration parameters.
+
+            spotify: The shared Spotify client, if Spotify is configured.
+
+            admin_roster: The shared cache of room admins. A new one with the
+                default settings is used if not provided.
+
+            rate_limiter: The shared limits on how often commands can be used.
+                Commands aren't limited if not provided.
+
+            executor: Runs commands in the background. Commands are run before
+                returning from the callback if not provided.
+
+            archiver: Keeps a history of the messages in the bot's rooms, if
+                provided.
+
+            stats: Counts the messages and joins in the bot's rooms, if provided.
         """
         self.client = client
         self.store = store
         self.config = config
+        self.spotify = spotify
+        self.admin_roster = admin_roster or AdminRoster()
+        self.rate_limiter = rate_limiter
+        self.executor = executor
+        self.archiver = archiver
+        self.stats = stats
         self.command_prefix = config.command_prefix
 
     async def message(self, room: MatrixRoom, event: RoomMessageText) -> None:
@@ -52,6 +119,13 @@ class Callbacks:
         if event.sender == self.client.user:
             return
 
+        if self.archiver is not None:
+            self.archiver.add(room.room_id, event)
+        if self.stats is not None:
+            self.stats.record_message(
+                room.room_id, event.sender, event.server_timestamp
+            )
+
         logger.debug(
             f"Bot message received for room {room.display_name} | "
             f"{room.user_name(event.sender)}: {msg}"
@@ -66,7 +140,9 @@ class Callbacks:
         # room.member_count <= 2 ... we assume a DM
         if not has_command_prefix and room.member_count > 2:
             # General message listener
-            message = Message(self.client, self.store, self.config, msg, room, event)
+            message = Message(
+                self.client, self.store, self.config, msg, room, event, self.admin_roster
+            )
             await message.process()
             return
 
@@ -76,52 +152,89 @@ class Callbacks:
             # Remove the command prefix
             msg = msg[len(self.command_prefix) :]
 
-        command = Command(self.client, self.store, self.config, msg, room, event)
-        await command.process()
+        command = Command(
+            self.client,
+            self.store,
+            self.config,
+            msg,
+            room,
+            event,
+            self.spotify,
+            self.admin_roster,
+            self.rate_limiter,
+            self.stats,
+        )
+        if self.executor is None:
+            await command.process()
+            return
+
+        job = tracing.carry(command.process)
+        if not self.executor.submit(room.room_id, job):
+            # Finish the trace now, as the job will never run to finish it
+            job.discard()
+            # Too many commands are waiting already, so let the user know this one
+            # was dropped without adding to the backlog with a message
+            logger.warning(f"Too busy to run command in {room.room_id}: {msg}")
+            await react_to_event(self.client, room.room_id, event.event_id, "🚧")
 
     async def user_invited(self, room: MatrixRoom, event: RoomMemberEvent) -> None:
         """ Callback for when user is invited in room"""
+        if self.stats is not None and event.membership == "join":
+            previous = (event.prev_content or {}).get("membership")
+            if previous != "join":
+                self.stats.record_join(
+                    room.room_id, event.state_key, event.server_timestamp
+                )
         if room.room_id != os.getenv("MAIN_ROOM"):
-            print("Not posting welcome message in non-main room:", room.room_id)
+            logger.debug(f"Not posting welcome message in non-main room: {room.room_id}")
             return
-        membership = event.membership
         # only care about joins
+        if event.membership != "join":
+            return
+        # directly inferred from https://spec.matrix.org/v1.8/client-server-api/#mroommember
+        try:
+            old_event = event.prev_content['membership']
+        except (KeyError, TypeError):
+            old_event = ""
+        if old_event != "invite":
+            return
         sender = event.state_key
-        visited = json.loads(open("visited.json", 'r').read())
+        if "bangalorebot" in sender or self.store.is_welcomed(room.room_id, sender):
+            return
+        logger.info(event)
         try:
             sender_name = event.content['displayname']
             if "(WhatsApp)" in sender_name:
                 sender_name = sender_name.replace("(WhatsApp)", "")
         except:
             sender_name = ""
-        # check if content avatar_url and prev_content avatar_url are the same
-        #try:
-        #    new_avatar = event.content['avatar_url']
-        #    logger.info(event.content)
-        #except KeyError:
-        #    new_avatar = ""
-        try:
-            old_event = event.prev_content['membership']
-            logger.info(event)
-        except (KeyError, TypeError):
-            old_event = ""
-        # directly inferred from https://spec.matrix.org/v1.8/client-server-api/#mroommember
-        if membership == "join" and old_event == "invite" and "bangalorebot" not in sender and sender not in visited:
-            # send invititation message
-            formatted_message = f"<p>Hi <a href=\"https://matrix.to/#/{sender.replace('@', '%40').replace(':', '%3A')}\">{sender_name}</a>, welcome to our community!</p>\n\n<p>Please introduce yourself :)</p>\n\n<p>Tell us about what you do, where you're from, what you like or where do you live so we can figure out your vibe:)</p>"
-            message = f"Hi {sender_name}, welcome to our community!\n\nPlease introduce yourself :)\n\nTell us about what you do, where you're from, what you like or where do you live so we can figure out your vibe:)"
-            await send_text_with_mention(
-                self.client,
-                room.room_id,
-                message,
-                formatted_message,
-                sender,
-            )
-            visited[sender] = True
-        with open("visited.json", 'w') as fp:
-            fp.write(json.dumps(visited))
+        # Record the welcome first so that a repeated join can't welcome them twice
+        await self.store.mark_welcomed(room.room_id, sender)
+        # send invititation message
+        welcome = self.config.responses.current.welcome
+        user_url = f"https://matrix.to/#/{sender.replace('@', '%40').replace(':', '%3A')}"
+        formatted_message = welcome.html.format(name=sender_name, user_url=user_url)
+        message = welcome.plain.format(name=sender_name, user_url=user_url)
+        await send_text_with_mention(
+            self.client,
+            room.room_id,
+            message,
+            formatted_message,
+            sender,
+        )
 
 
+    async def power_levels(self, room: MatrixRoom, event: PowerLevelsEvent) -> None:
+        """Callback for when the power levels of a room change. Forget the room's
+        cached admins, as they may have changed.
+
+        Args:
+            room: The room whose power levels changed.
+
+            event: The power levels event.
+        """
+        self.admin_roster.invalidate(room.room_id)
+
     async def invite(self, room: MatrixRoom, event: InviteMemberEvent) -> None:
         """Callback for when an invite is received. Join the room specified in the invite.
 
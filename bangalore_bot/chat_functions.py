@@ -1,9 +1,7 @@
 import logging
-from typing import Optional, Union
-import time
-import random
+from typing import Optional, Sequence, Union
+from urllib.parse import quote
 
-from markdown import markdown
 from nio import (
     AsyncClient,
     ErrorResponse,
@@ -14,9 +12,20 @@ from nio import (
     SendRetryError,
 )
 
+from bangalore_bot.metrics import Histogram
+from bangalore_bot.rendering import render_markdown
+from bangalore_bot.send_queue import get_send_queue
+from bangalore_bot.tracing import traced
+
 logger = logging.getLogger(__name__)
 
+SEND_SECONDS = Histogram(
+    "bot_send_text_duration_seconds",
+    "Time from asking to send a message until it was sent, including the typing delay",
+)
+
 
+@traced("send_text_to_room")
 async def send_text_to_room(
     client: AsyncClient,
     room_id: str,
@@ -24,6 +33,7 @@ async def send_text_to_room(
     notice: bool = False,
     markdown_convert: bool = True,
     reply_to_event_id: Optional[str] = None,
+    formatted_body: Optional[str] = None,
 ) -> Union[RoomSendResponse, ErrorResponse]:
     """Send text to a matrix room.
 
@@ -43,6 +53,9 @@ async def send_text_to_room(
         reply_to_event_id: Whether this message is a reply to another event. The event
             ID this is message is a reply to.
 
+        formatted_body: The message content as HTML, for messages that are already
+            formatted. Used instead of converting the message content.
+
     Returns:
         A RoomSendResponse if the request was successful, else an ErrorResponse.
     """
@@ -55,31 +68,21 @@ async def send_text_to_room(
         "body": message,
     }
 
-    if markdown_convert:
-        content["formatted_body"] = markdown(message)
+    if formatted_body is not None:
+        content["formatted_body"] = formatted_body
+    elif markdown_convert:
+        content["formatted_body"] = render_markdown(message)
 
     if reply_to_event_id:
         content["m.relates_to"] = {"m.in_reply_to": {"event_id": reply_to_event_id}}
 
     try:
-        await client.room_typing(
-                room_id,
-                typing_state=True
-                )
-        time.sleep(random.randint(1,5))
-        await client.room_send(
-            room_id,
-            "m.room.message",
-            content,
-            ignore_unverified_devices=True,
-        )
-        return await client.room_typing(
-                room_id,
-                typing_state=False
-                )
+        with SEND_SECONDS.time():
+            return await get_send_queue(client).send(room_id, content)
     except SendRetryError:
         logger.exception(f"Unable to send message response to {room_id}")
 
+@traced("send_text_with_mention")
 async def send_text_with_mention(
     client: AsyncClient,
     room_id: str,
@@ -99,39 +102,48 @@ async def send_text_with_mention(
     Returns:
         A RoomSendResponse if the request was successful, else an ErrorResponse.
     """
-    # Determine whether to ping room members or not
+    return await send_text_with_mentions(
+        client, room_id, message, formatted_body, [sender]
+    )
+
+
+@traced("send_text_with_mentions")
+async def send_text_with_mentions(
+    client: AsyncClient,
+    room_id: str,
+    message: str,
+    formatted_body: str,
+    user_ids: Sequence[str],
+) -> Union[RoomSendResponse, ErrorResponse]:
+    """Send text to a matrix room, notifying the given users.
+
+    Args:
+        client: The client to communicate to matrix with.
+
+        room_id: The ID of the room to send the message to.
+
+        message: The message content.
+
+        formatted_body: The message content as HTML.
+
+        user_ids: The users mentioned in the message.
+
+    Returns:
+        A RoomSendResponse if the request was successful, else an ErrorResponse.
+    """
     content = {
         "msgtype": "m.text",
         "format": "org.matrix.custom.html",
         "body": message,
         "formatted_body": formatted_body,
-        "m.mentions" : {
-            "user_ids": [
-                    sender
-                ]
-            },
+        "m.mentions": {"user_ids": list(user_ids)},
     }
     try:
-        await client.room_typing(
-                room_id,
-                typing_state=True
-                )
-        time.sleep(random.randint(1,5))
-        await client.room_send(
-            room_id,
-            "m.room.message",
-            content,
-            ignore_unverified_devices=True,
-        )
-        return await client.room_typing(
-                room_id,
-                typing_state=False
-                )
+        return await get_send_queue(client).send(room_id, content)
     except SendRetryError:
         logger.exception(f"Unable to send message response to {room_id}")
 
 
-
 def make_pill(user_id: str, displayname: str = None) -> str:
     """Convert a user ID (and optionally a display name) to a formatted user 'pill'
 
@@ -152,6 +164,12 @@ def make_pill(user_id: str, displayname: str = None) -> str:
     return f'<a href="https://matrix.to/#/{user_id}">{displayname}</a>'
 
 
+def make_event_link(room_id: str, event_id: str) -> str:
+    """A matrix.to link to an event in a room"""
+    return f"https://matrix.to/#/{quote(room_id, safe='')}/{quote(event_id, safe='')}"
+
+
+@traced("react_to_event")
 async def react_to_event(
     client: AsyncClient,
     room_id: str,
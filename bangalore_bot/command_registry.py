@@ -0,0 +1,91 @@
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+Handler = Callable[[Any], Awaitable[None]]
+
+
+class CommandSpec:
+    __slots__ = ("name", "handler", "aliases", "help", "usage", "rate_limit")
+
+    def __init__(
+        self,
+        name: str,
+        handler: Handler,
+        aliases: Sequence[str] = (),
+        help: str = "",
+        usage: Sequence[str] = (),
+        rate_limit: Optional[Tuple[int, float]] = None,
+    ):
+        """A command that the bot responds to.
+
+        Args:
+            name: The name of the command, i.e. the first word after the prefix.
+
+            handler: Called with the `Command` being processed.
+
+            aliases: Other names the command can be called by.
+
+            help: A short description of what the command does.
+
+            usage: Lines describing the arguments the command accepts, each starting
+                with the arguments followed by what they do.
+
+            rate_limit: The default (number of uses, per this many seconds) allowed
+                per user and room, or None for no limit.
+        """
+        self.name = name
+        self.handler = handler
+        self.aliases = tuple(aliases)
+        self.help = help
+        self.usage = tuple(usage)
+        self.rate_limit = rate_limit
+
+    def help_text(self, prefix: str) -> str:
+        """Describe how to use the command"""
+        if not self.usage:
+            return f"{prefix}{self.name} - {self.help}"
+        return "\n\n".join(f"{prefix}{self.name} {line}" for line in self.usage)
+
+
+class CommandRegistry:
+    def __init__(self):
+        """Maps command names and their aliases to the commands' handlers"""
+        self._commands = {}  # type: Dict[str, CommandSpec]
+        self._specs = []  # type: List[CommandSpec]
+
+    def __iter__(self) -> Iterator[CommandSpec]:
+        """Iterate over the registered commands in the order they were registered"""
+        return iter(self._specs)
+
+    def __len__(self) -> int:
+        return len(self._specs)
+
+    def get(self, name: str) -> Optional[CommandSpec]:
+        """Get the command with the given name or alias"""
+        return self._commands.get(name)
+
+    def add(self, spec: CommandSpec) -> None:
+        """Register a command under its name and aliases"""
+        for name in (spec.name,) + spec.aliases:
+            if name in self._commands:
+                raise ValueError(f"Command name '{name}' is already registered")
+            self._commands[name] = spec
+        self._specs.append(spec)
+
+    def command(
+        self,
+        name: str,
+        aliases: Sequence[str] = (),
+        help: str = "",
+        usage: Sequence[str] = (),
+        rate_limit: Optional[Tuple[int, float]] = None,
+    ) -> Callable[[Handler], Handler]:
+        """A decorator registering the decorated function as a command handler.
+
+        Takes the same arguments as `CommandSpec`.
+        """
+
+        def decorator(handler: Handler) -> Handler:
+            self.add(CommandSpec(name, handler, aliases, help, usage, rate_limit))
+            return handler
+
+        return decorator
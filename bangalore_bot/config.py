@@ -2,11 +2,14 @@ import logging
 import os
 import re
 import sys
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import yaml
 
 from bangalore_bot.errors import ConfigError
+from bangalore_bot.responses import DEFAULT_PATH, ResponseCatalog
+from bangalore_bot.scheduler import CronSchedule, get_timezone
+from bangalore_bot.triggers import TriggerEngine
 
 logger = logging.getLogger()
 logging.getLogger("peewee").setLevel(
@@ -83,7 +86,25 @@ class Config:
                 "connection_string": database_path[len(sqlite_scheme) :],
             }
         elif database_path.startswith(postgres_scheme):
-            self.database = {"type": "postgres", "connection_string": database_path}
+            self.database = {
+                "type": "postgres",
+                "connection_string": database_path,
+                "pool_min_size": self._get_cfg(
+                    ["storage", "pool", "min_size"], default=1, required=False
+                ),
+                "pool_max_size": self._get_cfg(
+                    ["storage", "pool", "max_size"], default=5, required=False
+                ),
+                "health_check_interval": self._get_cfg(
+                    ["storage", "pool", "health_check_interval"],
+                    default=30,
+                    required=False,
+                ),
+            }
+            if not 0 <= self.database["pool_min_size"] <= self.database["pool_max_size"]:
+                raise ConfigError(
+                    "storage.pool.min_size must be between 0 and storage.pool.max_size"
+                )
         else:
             raise ConfigError("Invalid connection string for storage.database")
 
@@ -105,6 +126,198 @@ class Config:
 
         self.command_prefix = self._get_cfg(["command_prefix"], default="!c")
 
+        # Sync setup
+        self.sync_lazy_load_members = self._get_cfg(
+            ["sync", "lazy_load_members"], default=True, required=False
+        )
+        self.sync_timeline_limit = self._get_cfg(
+            ["sync", "timeline_limit"], default=10, required=False
+        )
+        self.sync_full_state_on_startup = self._get_cfg(
+            ["sync", "full_state_on_startup"], default=False, required=False
+        )
+
+        # Delays between attempts to reconnect to the homeserver
+        self.reconnect_initial_delay = self._get_cfg(
+            ["reconnect", "initial_delay"], default=1, required=False
+        )
+        self.reconnect_max_delay = self._get_cfg(
+            ["reconnect", "max_delay"], default=300, required=False
+        )
+
+        # How many commands run at once, and how many can wait before new ones
+        # are turned away
+        self.command_concurrency = self._get_cfg(
+            ["commands", "concurrency"], default=4, required=False
+        )
+        self.command_max_queue = self._get_cfg(
+            ["commands", "max_queue"], default=100, required=False
+        )
+        if self.command_concurrency < 1 or self.command_max_queue < 1:
+            raise ConfigError(
+                "commands.concurrency and commands.max_queue must be at least 1"
+            )
+
+        # An HTTP endpoint exposing metrics for Prometheus to scrape
+        self.metrics_enabled = self._get_cfg(
+            ["metrics", "enabled"], default=False, required=False
+        )
+        self.metrics_host = self._get_cfg(
+            ["metrics", "host"], default="127.0.0.1", required=False
+        )
+        self.metrics_port = self._get_cfg(
+            ["metrics", "port"], default=9100, required=False
+        )
+
+        # Rooms that everyone with a birthday is wished in, at midnight
+        self.birthday_announce_rooms = self._get_cfg(
+            ["birthdays", "announce_rooms"], default=[], required=False
+        )
+        if not isinstance(self.birthday_announce_rooms, list):
+            raise ConfigError("birthdays.announce_rooms must be a list of room IDs")
+        try:
+            self.birthday_schedule = CronSchedule(
+                self._get_cfg(
+                    ["birthdays", "schedule"], default="0 0 * * *", required=False
+                ),
+                self._get_cfg(["birthdays", "timezone"], required=False),
+            )
+        except ValueError as e:
+            raise ConfigError(f"birthdays.schedule is invalid: {e}")
+        # Announcements missed while the bot was down are made up if they were
+        # missed by at most this many seconds
+        self.birthday_catch_up = self._get_cfg(
+            ["birthdays", "catch_up"], default=86400, required=False
+        )
+
+        # A history of the messages in the bot's rooms, written in batches
+        self.archive_enabled = self._get_cfg(
+            ["archive", "enabled"], default=False, required=False
+        )
+        self.archive_buffer_size = self._get_cfg(
+            ["archive", "buffer_size"], default=10000, required=False
+        )
+        self.archive_batch_size = self._get_cfg(
+            ["archive", "batch_size"], default=500, required=False
+        )
+        self.archive_flush_interval = self._get_cfg(
+            ["archive", "flush_interval"], default=1, required=False
+        )
+        if not 1 <= self.archive_batch_size <= self.archive_buffer_size:
+            raise ConfigError(
+                "archive.batch_size must be between 1 and archive.buffer_size"
+            )
+
+        # Rollups of how active each room is, for the stats command
+        self.stats_enabled = self._get_cfg(
+            ["stats", "enabled"], default=False, required=False
+        )
+        self.stats_flush_interval = self._get_cfg(
+            ["stats", "flush_interval"], default=10, required=False
+        )
+        try:
+            self.stats_timezone = get_timezone(
+                self._get_cfg(["stats", "timezone"], required=False)
+            )
+        except ValueError as e:
+            raise ConfigError(f"stats.timezone is invalid: {e}")
+
+        # Traces of how long each stage of handling an event takes
+        self.tracing_path = self._get_cfg(["tracing", "path"], required=False)
+        self.tracing_sample_rate = self._get_cfg(
+            ["tracing", "sample_rate"], default=0.01, required=False
+        )
+        if not 0 <= self.tracing_sample_rate <= 1:
+            raise ConfigError("tracing.sample_rate must be between 0 and 1")
+
+        # Outgoing message setup
+        typing_delay_min = self._get_cfg(
+            ["messages", "typing_delay_min"], default=1, required=False
+        )
+        typing_delay_max = self._get_cfg(
+            ["messages", "typing_delay_max"], default=5, required=False
+        )
+        if not 0 <= typing_delay_min <= typing_delay_max:
+            raise ConfigError(
+                "messages.typing_delay_min must be between 0 and "
+                "messages.typing_delay_max"
+            )
+        self.typing_delay = (typing_delay_min, typing_delay_max)
+
+        # Who to notify when someone asks for the admins
+        self.admin_power_level = self._get_cfg(
+            ["admins", "min_power_level"], default=50, required=False
+        )
+        self.admin_exclude_pattern = self._get_cfg(
+            ["admins", "exclude_pattern"], default="whatsappbot", required=False
+        )
+        try:
+            re.compile(self.admin_exclude_pattern)
+        except re.error as e:
+            raise ConfigError(f"admins.exclude_pattern is invalid: {e}")
+
+        # Canned responses, such as the rules and the welcome message
+        self.responses = ResponseCatalog(
+            self._get_cfg(["responses", "path"], default=DEFAULT_PATH, required=False),
+            self._get_cfg(
+                ["responses", "reload_interval"], default=5, required=False
+            ),
+        )
+
+        # How often each user can use each command in a room, overriding the
+        # commands' defaults
+        self.rate_limits = self._parse_rate_limits(
+            self._get_cfg(["rate_limits"], default={}, required=False)
+        )
+
+        # Automatic responses to messages, compiled once here
+        self.triggers = TriggerEngine.from_config(
+            self._get_cfg(["triggers"], default=[], required=False)
+        )
+
+        # Spotify API setup. Searching is disabled unless both are provided
+        self.spotify_client_id = self._get_cfg(
+            ["spotify", "client_id"], required=False
+        )
+        self.spotify_client_secret = self._get_cfg(
+            ["spotify", "client_secret"], required=False
+        )
+        self.spotify_cache_size = self._get_cfg(
+            ["spotify", "cache", "size"], default=256, required=False
+        )
+        self.spotify_cache_ttl = self._get_cfg(
+            ["spotify", "cache", "ttl"], default=86400, required=False
+        )
+        self.spotify_cache_persist = self._get_cfg(
+            ["spotify", "cache", "persist"], default=False, required=False
+        )
+
+    def _parse_rate_limits(
+        self, rate_limits: Any
+    ) -> Dict[str, Optional[Tuple[int, float]]]:
+        """Turn the rate_limits option into (uses, period) tuples by command name,
+        with None for commands that aren't limited"""
+        if not isinstance(rate_limits, dict):
+            raise ConfigError("rate_limits must be a mapping of command names to limits")
+
+        limits = {}  # type: Dict[str, Optional[Tuple[int, float]]]
+        for command, limit in rate_limits.items():
+            if limit is None:
+                limits[command] = None
+                continue
+            try:
+                uses = int(limit["uses"])
+                period = float(limit["per"])
+            except (KeyError, TypeError, ValueError):
+                raise ConfigError(
+                    f"rate_limits.{command} must have a number of 'uses' 'per' a "
+                    f"number of seconds, or be null"
+                )
+            if uses < 1 or period <= 0:
+                raise ConfigError(f"rate_limits.{command} must allow at least one use")
+            limits[command] = (uses, period)
+        return limits
+
     def _get_cfg(
         self,
         path: List[str],
@@ -10,3 +10,14 @@ class ConfigError(RuntimeError):
 
     def __init__(self, msg: str):
         super(ConfigError, self).__init__("%s" % (msg,))
+
+
+class SpotifyError(RuntimeError):
+    """A request to the Spotify API failed, so its result isn't known.
+
+    Args:
+        msg: A description of what failed.
+    """
+
+    def __init__(self, msg: str):
+        super(SpotifyError, self).__init__("%s" % (msg,))
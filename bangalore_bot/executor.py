@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class CommandExecutor:
+    def __init__(
+        self,
+        concurrency: int = 4,
+        max_queue: int = 100,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Runs commands in the background on a fixed number of worker tasks, so
+        that a slow command doesn't hold up the rest of a sync.
+
+        Commands from the same room run one at a time, in the order they were
+        submitted, while commands from different rooms run concurrently.
+
+        Args:
+            concurrency: The number of commands that can run at once.
+
+            max_queue: The number of commands that can wait to run. Commands
+                submitted beyond this are refused.
+
+            clock: Returns the current time in seconds.
+        """
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.clock = clock
+
+        # Commands waiting to run, with the time they were submitted, by room. A
+        # room is in here for as long as it has a command waiting or running
+        self._rooms = {}  # type: Dict[str, Deque[Tuple[Job, float]]]
+        # Rooms with a command waiting and none running, in the order they
+        # became ready
+        self._ready = None  # type: asyncio.Queue
+        self._workers = []  # type: List[asyncio.Task]
+
+        # The number of commands waiting to run
+        self.depth = 0
+        self.max_depth = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        # Seconds spent waiting to run by commands that have started
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, room_id: str, job: Job) -> bool:
+        """Queue a command to run after the ones already submitted for its room.
+
+        Args:
+            room_id: The room the command was sent in.
+
+            job: Called with no arguments to run the command.
+
+        Returns:
+            Whether the command was accepted, which it isn't if too many are already
+            waiting.
+        """
+        if self.depth >= self.max_queue:
+            self.rejected += 1
+            return False
+
+        self._start_workers()
+
+        queue = self._rooms.get(room_id)
+        if queue is None:
+            queue = self._rooms[room_id] = deque()
+            self._ready.put_nowait(room_id)
+        queue.append((job, self.clock()))
+
+        self.submitted += 1
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        return True
+
+    async def close(self) -> None:
+        """Stop the workers, abandoning any commands that haven't finished"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._rooms.clear()
+        self.depth = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Counters describing how busy the executor is"""
+        started = self.completed + self.failed
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "average_wait": self.total_wait / started if started else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+    def _start_workers(self) -> None:
+        if self._workers:
+            return
+        self._ready = asyncio.Queue()
+        loop = asyncio.get_event_loop()
+        self._workers = [
+            loop.create_task(self._worker()) for _ in range(self.concurrency)
+        ]
+
+    async def _worker(self) -> None:
+        while True:
+            room_id = await self._ready.get()
+            queue = self._rooms[room_id]
+            job, submitted_at = queue.popleft()
+            self.depth -= 1
+
+            wait = self.clock() - submitted_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+            try:
+                await job()
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                logger.exception(f"Error running command in {room_id}")
+
+            # Let the room's next command run, behind rooms that are already waiting
+            if queue:
+                self._ready.put_nowait(room_id)
+            else:
+                del self._rooms[room_id]
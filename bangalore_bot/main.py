@@ -2,10 +2,10 @@
 import asyncio
 import logging
 import sys
-from time import sleep
-from datetime import datetime, timedelta
+import time
+from typing import Optional, TextIO
 
-from aiohttp import ClientConnectionError, ServerDisconnectedError
+from aiohttp import ClientConnectionError, ClientSession, ServerDisconnectedError
 from nio import (
     AsyncClient,
     AsyncClientConfig,
@@ -13,50 +13,64 @@ from nio import (
     LocalProtocolError,
     LoginError,
     MegolmEvent,
+    PowerLevelsEvent,
     RoomMessageText,
     UnknownEvent,
     RoomMemberEvent,
+    SyncResponse,
 )
 
-from bangalore_bot.callbacks import Callbacks
+from bangalore_bot import tracing
+from bangalore_bot.admin_roster import AdminRoster
+from bangalore_bot.announcements import announce_birthdays
+from bangalore_bot.archive import MessageArchiver
+from bangalore_bot.cache import TTLCache
+from bangalore_bot.bot_commands import static_responses
+from bangalore_bot.callbacks import Callbacks, timed
 from bangalore_bot.config import Config
+from bangalore_bot.executor import CommandExecutor
 from bangalore_bot.storage import Storage
-from bangalore_bot.chat_functions import make_pill, send_text_to_room
+from bangalore_bot.metrics import Counter, Gauge, Histogram, MetricsServer
+from bangalore_bot.rate_limit import RateLimiter
+from bangalore_bot.reconnect import Backoff, ReconnectSupervisor
+from bangalore_bot.scheduler import Scheduler
+from bangalore_bot.stats import RoomStats
+from bangalore_bot.rendering import prerender
+from bangalore_bot.send_queue import SendQueue, set_send_queue
+from bangalore_bot.spotify import SpotifyClient
+from bangalore_bot.sync_filter import build_sync_filter
 
 logger = logging.getLogger(__name__)
 
-async def daily_task(client, store):
-    """The function to run at 12 a.m. each day."""
-    logger.info("Running daily task at midnight")
-    current_date = datetime.now()
-    room_id = "<insert_room_here>"
-
-    # Extract the day and month
-    day = current_date.day
-    month = current_date.month
-    store._execute(f"select sender from birthdays where birth_month={month} and birth_day={day}")
-    res = store.cursor.fetchall()
+SYNCS_TOTAL = Counter("bot_syncs_total", "Sync responses received")
+SYNC_SECONDS = Histogram(
+    "bot_sync_interval_seconds", "Time between consecutive sync responses"
+)
+EXECUTOR_STATS = Gauge(
+    "bot_command_executor", "Command executor queue statistics", ("stat",)
+)
+SPOTIFY_CACHE_STATS = Gauge(
+    "bot_spotify_cache", "Spotify search cache statistics", ("stat",)
+)
+ARCHIVE_BUFFERED = Gauge(
+    "bot_archive_buffered_messages", "Messages waiting to be written to the archive"
+)
+RECONNECT_STATS = Gauge(
+    "bot_reconnect", "Homeserver connection loss statistics", ("stat",)
+)
+
+
+async def daily_task(client, store, room_ids, when):
+    """Wish everyone whose birthday falls on the day of `when`."""
+    logger.info(f"Announcing birthdays for {when:%d %B}")
+
+    res = store.birthdays.on(when.month, when.day)
     if len(res) == 0:
         logger.info("Nobody to wish today")
+    elif not room_ids:
+        logger.info("No rooms configured to announce birthdays in")
     else:
-        for row in res:
-            formatted_message = f"{make_pill(row[0])}'s birthday is today🎉"
-            await send_text_to_room(client, room_id, formatted_message)
-
-async def schedule_daily_task(client, store):
-    """Calculate the time until next 12 a.m. and sleep until then, repeating every day."""
-    while True:
-        now = datetime.now()
-        # Calculate the time until the next 12 a.m.
-        next_midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        seconds_until_midnight = (next_midnight - now).total_seconds()
-        print("seconds left:", seconds_until_midnight)
-        
-        # Sleep until 12 a.m.
-        await asyncio.sleep(seconds_until_midnight)
-        
-        # Run the daily task
-        await daily_task(client, store)
+        await announce_birthdays(client, room_ids, res)
 
 
 async def main():
@@ -92,22 +106,167 @@ async def main():
         config=client_config,
     )
 
+    # Render the bot's static responses once, rather than on every send
+    prerender(static_responses(config.command_prefix))
+
+    # Send outgoing messages through per-room queues
+    set_send_queue(client, SendQueue(client, config.typing_delay))
+
     if config.user_token:
         client.access_token = config.user_token
         client.user_id = config.user_id
 
-    # Set up event callbacks
-    callbacks = Callbacks(client, store, config)
-    client.add_event_callback(callbacks.message, (RoomMessageText,))
-    # add callback on roommember
-    client.add_event_callback(callbacks.user_invited, (RoomMemberEvent,))
-    client.add_event_callback(
-        callbacks.invite_event_filtered_callback, (InviteMemberEvent,)
-    )
-    client.add_event_callback(callbacks.decryption_failure, (MegolmEvent,))
-    client.add_event_callback(callbacks.unknown, (UnknownEvent,))
+    # A single HTTP session for third-party APIs, so connections are reused
+    http_session = ClientSession()
+
+    # Anything started from here on is stopped again in the `finally`, even if
+    # starting up fails part way through
+    executor = None  # type: Optional[CommandExecutor]
+    archiver = None  # type: Optional[MessageArchiver]
+    stats = None  # type: Optional[RoomStats]
+    scheduler = None  # type: Optional[Scheduler]
+    metrics_server = None  # type: Optional[MetricsServer]
+    trace_file = None  # type: Optional[TextIO]
+    try:
+        spotify = None
+        if config.spotify_client_id and config.spotify_client_secret:
+            spotify_cache = None
+            if config.spotify_cache_size > 0:
+                spotify_cache = TTLCache(
+                    config.spotify_cache_size, config.spotify_cache_ttl
+                )
+            spotify = SpotifyClient(
+                http_session,
+                config.spotify_client_id,
+                config.spotify_client_secret,
+                cache=spotify_cache,
+                store=store if config.spotify_cache_persist else None,
+            )
+            await spotify.load()
 
-    asyncio.create_task(schedule_daily_task(client, store))
+        # Set up event callbacks
+        admin_roster = AdminRoster(
+            config.admin_power_level, config.admin_exclude_pattern
+        )
+        rate_limiter = RateLimiter(config.rate_limits)
+        executor = CommandExecutor(config.command_concurrency, config.command_max_queue)
+        if config.archive_enabled:
+            archiver = MessageArchiver(
+                store,
+                config.archive_buffer_size,
+                config.archive_batch_size,
+                config.archive_flush_interval,
+            )
+            archiver.start()
+        if config.stats_enabled:
+            stats = RoomStats(store, config.stats_flush_interval, config.stats_timezone)
+            stats.start()
+        callbacks = Callbacks(
+            client,
+            store,
+            config,
+            spotify,
+            admin_roster,
+            rate_limiter,
+            executor,
+            archiver,
+            stats,
+        )
+        client.add_event_callback(timed(callbacks.message), (RoomMessageText,))
+        # add callback on roommember
+        client.add_event_callback(timed(callbacks.user_invited), (RoomMemberEvent,))
+        client.add_event_callback(
+            timed(callbacks.invite_event_filtered_callback), (InviteMemberEvent,)
+        )
+        client.add_event_callback(timed(callbacks.power_levels), (PowerLevelsEvent,))
+        client.add_event_callback(timed(callbacks.decryption_failure), (MegolmEvent,))
+        client.add_event_callback(timed(callbacks.unknown), (UnknownEvent,))
+
+        # Periodic jobs, which are caught up on if the bot was down when they were due
+        scheduler = Scheduler(store)
+        await scheduler.add(
+            "birthdays",
+            config.birthday_schedule,
+            lambda when: daily_task(
+                client, store, config.birthday_announce_rooms, when
+            ),
+            catch_up=config.birthday_catch_up,
+        )
+        scheduler.start()
+
+        supervisor = ReconnectSupervisor(
+            Backoff(config.reconnect_initial_delay, config.reconnect_max_delay)
+        )
+
+        last_sync = None
+
+        # Every successful sync means the connection is healthy again
+        async def on_sync(response: SyncResponse):
+            nonlocal last_sync
+            supervisor.connected()
+
+            now = time.perf_counter()
+            SYNCS_TOTAL.inc()
+            if last_sync is not None:
+                SYNC_SECONDS.observe(now - last_sync)
+            last_sync = now
+
+        client.add_response_callback(on_sync, (SyncResponse,))
+
+        # Expose what other parts of the bot already keep count of
+        for stat in executor.stats():
+            EXECUTOR_STATS.set_function(lambda stat=stat: executor.stats()[stat], stat)
+        if spotify is not None and spotify.cache is not None:
+            for stat in spotify.cache.stats():
+                SPOTIFY_CACHE_STATS.set_function(
+                    lambda stat=stat: spotify.cache.stats()[stat], stat
+                )
+        if archiver is not None:
+            ARCHIVE_BUFFERED.set_function(lambda: len(archiver))
+        RECONNECT_STATS.set_function(lambda: supervisor.disconnects, "disconnects")
+        RECONNECT_STATS.set_function(lambda: supervisor.reconnect_attempts, "attempts")
+        RECONNECT_STATS.set_function(supervisor.current_downtime, "downtime_seconds")
+
+        if config.tracing_path:
+            trace_file = open(config.tracing_path, "a")
+            tracing.configure(tracing.Tracer(trace_file, config.tracing_sample_rate))
+
+        if config.metrics_enabled:
+            metrics_server = MetricsServer(
+                host=config.metrics_host, port=config.metrics_port
+            )
+            await metrics_server.start()
+
+        return await _sync_until_stopped(client, config, supervisor)
+    finally:
+        # Make sure to close the client connection on shutdown
+        if metrics_server is not None:
+            await metrics_server.close()
+        if scheduler is not None:
+            await scheduler.close()
+        if executor is not None:
+            await executor.close()
+        if archiver is not None:
+            await archiver.close()
+        if stats is not None:
+            await stats.close()
+        await client.close()
+        await http_session.close()
+        store.close()
+        if trace_file is not None:
+            tracing.configure(None)
+            trace_file.close()
+
+
+async def _sync_until_stopped(
+    client: AsyncClient, config: Config, supervisor: ReconnectSupervisor
+):
+    """Log in and sync with the homeserver, reconnecting on failure"""
+    sync_filter = build_sync_filter(
+        config.sync_lazy_load_members, config.sync_timeline_limit
+    )
+    # Full state is only ever requested on the first sync after starting up
+    full_state = config.sync_full_state_on_startup
 
     # Keep trying to reconnect on failure (with some time in-between)
     while True:
@@ -145,17 +304,18 @@ async def main():
                 # Login succeeded!
 
             logger.info(f"Logged in as {config.user_id}")
-            await client.sync_forever(timeout=30000, full_state=True)
-
-        except (ClientConnectionError, ServerDisconnectedError):
-            logger.warning("Unable to connect to homeserver, retrying in 15s...")
+            use_full_state, full_state = full_state, False
+            await client.sync_forever(
+                timeout=30000, sync_filter=sync_filter, full_state=use_full_state
+            )
 
-            # Sleep so we don't bombard the server with login requests
-            sleep(15)
-        finally:
-            # Make sure to close the client connection on disconnect
+        except (ClientConnectionError, ServerDisconnectedError, asyncio.TimeoutError):
+            # Drop the broken connection, then wait so we don't bombard the server
+            # with login requests
             await client.close()
+            await supervisor.disconnected()
 
 
 # Run the main function in an asyncio event loop
-asyncio.get_event_loop().run_until_complete(main())
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
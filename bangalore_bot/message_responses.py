@@ -2,6 +2,9 @@ import logging
 
 from nio import AsyncClient, MatrixRoom, RoomMessageText
 
+from typing import Optional
+
+from bangalore_bot.admin_roster import AdminRoster
 from bangalore_bot.chat_functions import send_text_to_room, find_admins_and_reply
 from bangalore_bot.config import Config
 from bangalore_bot.storage import Storage
@@ -18,6 +21,7 @@ class Message:
         message_content: str,
         room: MatrixRoom,
         event: RoomMessageText,
+        admin_roster: Optional[AdminRoster] = None,
     ):
         """Initialize a new Message
 
@@ -33,6 +37,9 @@ class Message:
             room: The room the event came from.
 
             event: The event defining the message.
+
+            admin_roster: The shared cache of room admins. A new one with the
+                default settings is used if not provided.
         """
         self.client = client
         self.store = store
@@ -40,11 +47,24 @@ class Message:
         self.message_content = message_content
         self.room = room
         self.event = event
+        self.admin_roster = admin_roster or AdminRoster()
 
     async def process(self) -> None:
         """Process and possibly respond to the message"""
         if self.message_content.lower() == "hello world":
             await self._hello_world()
+            return
+
+        for trigger in self.config.triggers.match(self.message_content):
+            if trigger.action == "tag_admins":
+                await self.tag_admins()
+            else:
+                await send_text_to_room(
+                    self.client,
+                    self.room.room_id,
+                    trigger.response,
+                    reply_to_event_id=self.event.event_id,
+                )
 
     async def _hello_world(self) -> None:
         """Say hello"""
@@ -54,6 +74,5 @@ class Message:
     async def tag_admins(self) -> None:
         """Send a message responding to this one, tagging admins"""
         text = "Tagging all admins"
-        all_users = self.room.power_levels.users
-        admins = [user for user, level in all_users.items() if level >= 50 and 'whatsappbot' not in user]
-        await find_admins_and_reply(self.client, self.room.room_id, self.event.event_id, text, admins)
+        admins = self.admin_roster.get(self.room)
+        await find_admins_and_reply(self.client, self.room.room_id, self.event.event_id, text, list(admins.user_ids))
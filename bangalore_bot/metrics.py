@@ -0,0 +1,235 @@
+import logging
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets suited to timing things that take between a millisecond and
+# a minute, in seconds
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+
+Labels = Tuple[str, ...]
+
+
+class Registry:
+    def __init__(self):
+        """A collection of metrics, rendered together in the Prometheus text format"""
+        self._metrics = {}  # type: Dict[str, _Metric]
+
+    def register(self, metric: "_Metric") -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Describe the current value of every metric"""
+        lines = []  # type: List[str]
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            metric.render(lines)
+        lines.append("")
+        return "\n".join(lines)
+
+
+# The registry metrics belong to unless given another one
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = ""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        registry: Optional[Registry] = REGISTRY,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        if registry is not None:
+            registry.register(self)
+
+    def _format_labels(self, values: Labels, extra: str = "") -> str:
+        pairs = [
+            f'{label}="{_escape(value)}"' for label, value in zip(self.labels, values)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self, lines: List[str]) -> None:
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        """A count of things that have happened, such as commands run.
+
+        Takes a name, a description, and optionally the names of labels that split
+        the count up, e.g. by command. Values of the labels are given when
+        incrementing.
+        """
+        super().__init__(*args, **kwargs)
+        self._values = {}  # type: Dict[Labels, float]
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self, lines: List[str]) -> None:
+        for values, count in self._values.items():
+            lines.append(f"{self.name}{self._format_labels(values)} {_number(count)}")
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        """A value that can go up and down, such as a queue's length.
+
+        Values are either set directly, or read from a function whenever the metrics
+        are rendered, which suits values that another object already keeps track of.
+        """
+        super().__init__(*args, **kwargs)
+        self._values = {}  # type: Dict[Labels, float]
+        self._functions = {}  # type: Dict[Labels, Callable[[], float]]
+
+    def set(self, value: float, *label_values: str) -> None:
+        self._values[label_values] = value
+
+    def set_function(self, function: Callable[[], float], *label_values: str) -> None:
+        self._functions[label_values] = function
+
+    def get(self, *label_values: str) -> float:
+        function = self._functions.get(label_values)
+        if function is not None:
+            return function()
+        return self._values.get(label_values, 0)
+
+    def render(self, lines: List[str]) -> None:
+        for values in list(self._values) + list(self._functions):
+            lines.append(
+                f"{self.name}{self._format_labels(values)} {_number(self.get(*values))}"
+            )
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        """The distribution of observed values, such as how long commands take.
+
+        Observations are counted in buckets by the smallest upper bound they fit
+        under, and summed.
+
+        Args:
+            buckets: The upper bounds of the buckets, in increasing order.
+        """
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # For each set of label values, the count in each bucket with one more for
+        # values above the last bound, then the sum of all values
+        self._values = {}  # type: Dict[Labels, List[float]]
+
+    def observe(self, value: float, *label_values: str) -> None:
+        counts = self._values.get(label_values)
+        if counts is None:
+            counts = self._values[label_values] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, *label_values: str) -> "_Timer":
+        """Observe how long a `with` block takes, in seconds"""
+        return _Timer(self, label_values)
+
+    def count(self, *label_values: str) -> int:
+        counts = self._values.get(label_values)
+        return int(sum(counts[:-1])) if counts else 0
+
+    def render(self, lines: List[str]) -> None:
+        for values, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = self._format_labels(values, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = self._format_labels(values)
+            lines.append(f"{self.name}_sum{labels} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram: Histogram, label_values: Labels):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class MetricsServer:
+    def __init__(
+        self, registry: Registry = REGISTRY, host: str = "127.0.0.1", port: int = 9100
+    ):
+        """An HTTP server exposing metrics at /metrics for Prometheus to scrape.
+
+        Args:
+            registry: The metrics to expose.
+
+            host: The address to listen on.
+
+            port: The port to listen on.
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner = None  # type: Optional[web.AppRunner]
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.registry.render(), content_type="text/plain", charset="utf-8"
+        )
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bangalore_bot.command_registry import CommandSpec
+
+# What to do with a command, as decided by `RateLimiter.check`
+ALLOW = "allow"
+# The command is over its limit, and the user should be told so
+THROTTLE = "throttle"
+# The command is over its limit, and the user was already told so
+IGNORE = "ignore"
+
+# (room ID, user ID, command name)
+Key = Tuple[str, str, str]
+# (number of uses, per this many seconds)
+Limit = Tuple[int, float]
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Optional[Limit]]] = None,
+        max_keys: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Limits how often each user can use each command in each room, using a
+        token bucket per (room, user, command).
+
+        A bucket holds as many tokens as the number of uses allowed, and refills
+        steadily over the limit's period. Buckets that have refilled completely are
+        indistinguishable from new ones, so they are dropped, keeping memory
+        proportional to the number of recently active users.
+
+        Args:
+            limits: Limits by command name, overriding the command's default. None
+                removes a command's limit.
+
+            max_keys: The most buckets to keep. The least recently used are dropped
+                beyond this.
+
+            clock: Returns the current time in seconds.
+        """
+        self.limits = dict(limits or {})
+        self.max_keys = max_keys
+        self.clock = clock
+
+        # Buckets ordered from least to most recently used. Each is
+        # [tokens, last updated, whether the user was told they're throttled]
+        self._buckets = OrderedDict()  # type: OrderedDict[Key, List]
+        # The longest period of any bucket, after which every bucket is full
+        self._max_period = 0.0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def limit_for(self, spec: CommandSpec) -> Optional[Limit]:
+        """The limit that applies to a command"""
+        return self.limits.get(spec.name, spec.rate_limit)
+
+    def check(self, room_id: str, user_id: str, spec: CommandSpec) -> str:
+        """Use a command, if its limit allows.
+
+        Returns:
+            ALLOW if the command can run. THROTTLE the first time it's refused
+            since it was last allowed, and IGNORE every following time.
+        """
+        limit = self.limit_for(spec)
+        if limit is None:
+            return ALLOW
+        uses, period = limit
+
+        now = self.clock()
+        self._evict(now)
+
+        key = (room_id, user_id, spec.name)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(uses), now, False]
+            self._max_period = max(self._max_period, period)
+        else:
+            self._buckets.move_to_end(key)
+            tokens, updated, _ = bucket
+            bucket[0] = min(uses, tokens + (now - updated) * uses / period)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return ALLOW
+
+        if bucket[2]:
+            return IGNORE
+        bucket[2] = True
+        return THROTTLE
+
+    def _evict(self, now: float) -> None:
+        """Drop buckets that have been idle long enough to be full again, and the
+        least recently used ones beyond `max_keys`"""
+        buckets = self._buckets
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if now - bucket[1] < self._max_period and len(buckets) < self.max_keys:
+                break
+            del buckets[key]
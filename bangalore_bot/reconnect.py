@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Backoff:
+    def __init__(
+        self,
+        initial_delay: float = 1,
+        max_delay: float = 300,
+        factor: float = 2,
+        jitter: float = 0.5,
+        rng: Callable[[], float] = random.random,
+    ):
+        """Exponentially growing delays between retries, with jitter.
+
+        Args:
+            initial_delay: The delay before the first retry, in seconds.
+
+            max_delay: The longest delay, in seconds.
+
+            factor: How much the delay grows by after each retry.
+
+            jitter: The fraction of each delay that is randomised, so that many
+                clients don't retry in lockstep. 0 disables it.
+
+            rng: Returns a random float in [0, 1).
+        """
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.rng = rng
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        """Get the delay before the next retry, and count the retry"""
+        delay = min(self.max_delay, self.initial_delay * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay * (1 - self.jitter * self.rng())
+
+    def reset(self) -> None:
+        """Start again from the initial delay"""
+        self.attempts = 0
+
+
+class ReconnectSupervisor:
+    def __init__(self, backoff: Backoff, clock: Callable[[], float] = time.monotonic):
+        """Decides how long to wait between attempts to reach the homeserver, and
+        keeps track of how often and for how long the connection was lost.
+
+        Call `disconnected` whenever an attempt fails, and `connected` after every
+        successful sync.
+
+        Args:
+            backoff: The delays to wait between attempts.
+
+            clock: Returns the current time in seconds.
+        """
+        self.backoff = backoff
+        self.clock = clock
+
+        # The number of times the connection was lost
+        self.disconnects = 0
+        # The number of attempts made to reconnect
+        self.reconnect_attempts = 0
+        # The total number of seconds spent without a connection
+        self.downtime = 0.0
+        self.down_since = None  # type: Optional[float]
+
+    def connected(self) -> None:
+        """Record a successful sync, resetting the backoff if we were disconnected"""
+        if self.down_since is None:
+            return
+
+        outage = self.clock() - self.down_since
+        self.downtime += outage
+        self.down_since = None
+        self.backoff.reset()
+        logger.info(
+            "Reconnected to homeserver after %.1fs (%d disconnects, %.1fs downtime total)",
+            outage,
+            self.disconnects,
+            self.downtime,
+        )
+
+    async def disconnected(self) -> None:
+        """Record a failed attempt and wait before the next one"""
+        if self.down_since is None:
+            self.down_since = self.clock()
+            self.disconnects += 1
+
+        delay = self.backoff.next_delay()
+        self.reconnect_attempts += 1
+        logger.warning(
+            "Unable to connect to homeserver, retrying in %.1fs (attempt %d)...",
+            delay,
+            self.backoff.attempts,
+        )
+        await asyncio.sleep(delay)
+
+    def current_downtime(self) -> float:
+        """The total downtime, including the current outage if there is one"""
+        if self.down_since is None:
+            return self.downtime
+        return self.downtime + self.clock() - self.down_since
@@ -0,0 +1,63 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterable
+
+from markdown import Markdown
+
+# Characters that may change how a single line of text is rendered. Besides
+# markdown syntax, markdown expands tabs, turns carriage returns into newlines and
+# strips the STX and ETX characters it uses as placeholders
+_INLINE_SYNTAX = re.compile(r"[\\`*_\[\]<>&\t\r\x02\x03]")
+# Things that may change how a line is rendered when they start it, such as
+# headers, quotes, lists and indented code
+_BLOCK_SYNTAX = re.compile(r"\s|[#>+\-*=]|\d+[.)]")
+
+# Rendered bodies of static responses, filled in at startup by `prerender`
+_prerendered = {}  # type: Dict[str, str]
+
+# Creating a Markdown instance is expensive, so one is reused for every message
+_markdown = Markdown()
+
+
+def render_markdown(text: str) -> str:
+    """Render a message body to HTML, giving the same result as
+    `markdown.markdown(text)`.
+
+    Static responses are looked up in the table filled in by `prerender`. Text
+    without any markdown syntax, which is most of what the bot sends, is wrapped in
+    a paragraph without invoking the markdown parser. Anything else is rendered by
+    the parser, with results memoised so repeated messages are rendered once.
+    """
+    html = _prerendered.get(text)
+    if html is not None:
+        return html
+
+    if is_plain_text(text):
+        return f"<p>{text}</p>"
+
+    return _render(text)
+
+
+def is_plain_text(text: str) -> bool:
+    """Whether `text` is a single line that markdown would render as-is"""
+    return (
+        bool(text)
+        and "\n" not in text
+        and not _INLINE_SYNTAX.search(text)
+        and not _BLOCK_SYNTAX.match(text)
+        and not text[-1].isspace()
+    )
+
+
+def prerender(texts: Iterable[str]) -> None:
+    """Render static responses ahead of time, so sending them costs a lookup"""
+    for text in texts:
+        _prerendered[text] = _render.__wrapped__(text)
+
+
+@lru_cache(maxsize=1024)
+def _render(text: str) -> str:
+    try:
+        return _markdown.convert(text)
+    finally:
+        _markdown.reset()
@@ -0,0 +1,153 @@
+import logging
+import os
+import time
+from typing import Any, Callable, NamedTuple, Optional, Tuple
+
+import yaml
+
+from bangalore_bot.errors import ConfigError
+from bangalore_bot.rendering import render_markdown
+
+logger = logging.getLogger(__name__)
+
+# The catalog shipped with the bot
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "responses.yaml")
+
+
+class Response(NamedTuple):
+    # The response as plain text, used as the message body
+    plain: str
+    # The response as HTML, used as the message's formatted body
+    html: str
+
+
+class Catalog(NamedTuple):
+    help_intro: Response
+    rules: Response
+    # A template with {name} and {user_url} placeholders
+    welcome: Response
+    eight_ball: Tuple[Response, ...]
+
+
+class ResponseCatalog:
+    def __init__(
+        self,
+        path: str = DEFAULT_PATH,
+        check_interval: float = 5,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """The bot's canned responses, loaded from a YAML file.
+
+        The file is loaded once, with every response rendered to HTML up front. It's
+        reloaded when it changes on disk, checked at most once every `check_interval`
+        seconds when the responses are accessed.
+
+        Args:
+            path: The path of the YAML file.
+
+            check_interval: How often to check the file for changes, in seconds. 0
+                disables reloading.
+
+            clock: Returns the current time in seconds.
+
+        Raises:
+            ConfigError: If the file can't be loaded.
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.clock = clock
+
+        self._mtime = self._get_mtime()
+        self._catalog = load_catalog(path)
+        self._next_check = self.clock() + check_interval
+
+    @property
+    def current(self) -> Catalog:
+        """The current responses, reloading them first if the file has changed"""
+        if self.check_interval and self.clock() >= self._next_check:
+            self._next_check = self.clock() + self.check_interval
+            self._reload_if_changed()
+        return self._catalog
+
+    def _reload_if_changed(self) -> None:
+        mtime = self._get_mtime()
+        if mtime == self._mtime:
+            return
+
+        self._mtime = mtime
+        try:
+            self._catalog = load_catalog(self.path)
+        except ConfigError as e:
+            logger.error("Keeping the previous responses: %s", e)
+            return
+        logger.info(f"Reloaded responses from {self.path}")
+
+    def _get_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+
+def load_catalog(path: str) -> Catalog:
+    """Load and render the responses in a YAML file.
+
+    Raises:
+        ConfigError: If the file can't be read or is missing responses.
+    """
+    try:
+        with open(path) as file_stream:
+            data = yaml.safe_load(file_stream.read())
+    except (OSError, yaml.YAMLError) as e:
+        raise ConfigError(f"Unable to load responses from '{path}': {e}")
+
+    if not isinstance(data, dict):
+        raise ConfigError(f"Responses file '{path}' must contain a mapping")
+
+    def get(name: str) -> Any:
+        if name not in data:
+            raise ConfigError(f"Responses file '{path}' is missing '{name}'")
+        return data[name]
+
+    eight_ball = get("eight_ball")
+    if not isinstance(eight_ball, list) or not eight_ball:
+        raise ConfigError(f"'eight_ball' in '{path}' must be a non-empty list")
+
+    welcome = _to_response(get("welcome"), "welcome")
+    _check_template(welcome, "welcome", name="", user_url="")
+
+    return Catalog(
+        help_intro=_to_response(get("help_intro"), "help_intro"),
+        rules=_to_response(get("rules"), "rules"),
+        welcome=welcome,
+        eight_ball=tuple(_to_response(answer, "eight_ball") for answer in eight_ball),
+    )
+
+
+def _check_template(response: Response, entry: str, **fields: str) -> None:
+    """Check that a template response can be filled in with the given fields, so
+    a mistake in it is found when it's loaded rather than when it's sent.
+
+    Raises:
+        ConfigError: If either form of the response can't be formatted.
+    """
+    for form in response:
+        try:
+            form.format(**fields)
+        except (KeyError, IndexError, ValueError, AttributeError, TypeError) as e:
+            raise ConfigError(
+                f"Response '{entry}' can only use the placeholders "
+                f"{', '.join('{' + field + '}' for field in fields)}, and literal "
+                f"braces must be doubled: {e!r}"
+            )
+
+
+def _to_response(value: Any, name: str) -> Response:
+    """Turn a catalog entry into a Response, rendering markdown entries to HTML"""
+    if isinstance(value, str):
+        return Response(value, render_markdown(value))
+    if isinstance(value, dict) and "plain" in value and "html" in value:
+        return Response(str(value["plain"]), str(value["html"]))
+    raise ConfigError(
+        f"Response '{name}' must be text, or a mapping with 'plain' and 'html'"
+    )
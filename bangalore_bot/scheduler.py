@@ -0,0 +1,354 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import Awaitable, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from bangalore_bot.metrics import Counter
+from bangalore_bot.storage import Storage
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # Python < 3.9
+    try:
+        from backports.zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    except ImportError:
+        ZoneInfo = None
+
+logger = logging.getLogger(__name__)
+
+JOB_RUNS_TOTAL = Counter(
+    "bot_scheduled_job_runs_total",
+    "Runs of scheduled jobs, by whether they ran, failed or were skipped",
+    ("job", "outcome"),
+)
+
+# The (lowest, highest) values of each field of a schedule
+_FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day of month", 1, 31),
+    ("month", 1, 12),
+    ("day of week", 0, 7),
+)
+
+# The most days in each month, for rejecting schedules that can never run
+_MONTH_DAYS = (31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# How far ahead to look for the next run. Long enough for a schedule of the 29th of
+# February that must also fall on a particular weekday
+_SEARCH_DAYS = 366 * 28
+
+Job = Callable[[datetime], Awaitable[None]]
+
+
+class CronSchedule:
+    def __init__(self, expression: str, timezone: Optional[str] = None):
+        """A cron-style schedule of the form "minute hour day-of-month month
+        day-of-week".
+
+        Each field is `*`, a number, a range `a-b`, a step `*/n` or `a-b/n`, or a
+        comma separated list of those. Days of the week run from 0 (Sunday) to 7
+        (also Sunday). As with cron, when both day fields are restricted, days that
+        match either of them match.
+
+        Times that are skipped when the clocks go forward run as soon as the clocks
+        have changed, and times that repeat when they go back run once.
+
+        Args:
+            expression: The schedule, e.g. "0 0 * * *" for every midnight.
+
+            timezone: The IANA name of the timezone the schedule is in, such as
+                "Asia/Kolkata". The system's local timezone is used if None.
+
+        Raises:
+            ValueError: If the expression or timezone is invalid.
+        """
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != len(_FIELDS):
+            raise ValueError(
+                f"Schedule {expression!r} must have {len(_FIELDS)} fields: "
+                "minute hour day-of-month month day-of-week"
+            )
+
+        minutes, hours, days, months, weekdays = (
+            _parse_field(field, *spec) for field, spec in zip(fields, _FIELDS)
+        )
+        self.minutes = sorted(minutes)
+        self.hours = sorted(hours)
+        self.days = days
+        self.months = months
+        # Sunday is 0 in cron but 6 in `date.weekday`
+        self.weekdays = frozenset((day - 1) % 7 for day in weekdays)
+        self._days_restricted = not fields[2].startswith("*")
+        self._weekdays_restricted = not fields[4].startswith("*")
+
+        if self._days_restricted and not self._weekdays_restricted:
+            if not any(
+                day <= _MONTH_DAYS[month - 1] for day in days for month in months
+            ):
+                raise ValueError(f"Schedule {expression!r} never runs")
+
+        self.tz = get_timezone(timezone)
+
+    def next_after(self, after: datetime) -> datetime:
+        """The first time the schedule runs after a given time.
+
+        Args:
+            after: A timezone-aware time.
+
+        Returns:
+            A time in the schedule's timezone.
+        """
+        start = self._to_local(after).replace(second=0, microsecond=0)
+        day = start.date()
+        for _ in range(_SEARCH_DAYS):
+            if self._matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        local = datetime(day.year, day.month, day.day, hour, minute)
+                        if local < start:
+                            continue
+                        when = self._from_local(local)
+                        if when > after:
+                            return when
+            day += timedelta(days=1)
+        raise ValueError(f"Schedule {self.expression!r} never runs")
+
+    def at(self, timestamp: float) -> datetime:
+        """A time in seconds since the epoch, in the schedule's timezone"""
+        if self.tz is None:
+            return datetime.fromtimestamp(timestamp).astimezone()
+        return datetime.fromtimestamp(timestamp, self.tz)
+
+    def _matches(self, day: date) -> bool:
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        in_weekdays = day.weekday() in self.weekdays
+        if self._days_restricted and self._weekdays_restricted:
+            return in_days or in_weekdays
+        return in_days and in_weekdays
+
+    def _to_local(self, when: datetime) -> datetime:
+        """Convert an aware time to a naive one in the schedule's timezone"""
+        return when.astimezone(self.tz).replace(tzinfo=None)
+
+    def _from_local(self, local: datetime) -> datetime:
+        """Convert a naive time in the schedule's timezone to an aware one. Times
+        that don't exist, as the clocks went forward past them, become the time
+        that far after the change"""
+        if self.tz is None:
+            # Naive times are taken to be in the system's timezone
+            return local.astimezone()
+        utc = local.replace(tzinfo=self.tz).astimezone(timezone.utc)
+        return utc.astimezone(self.tz)
+
+
+def get_timezone(name: Optional[str]) -> Optional[tzinfo]:
+    """Look up a timezone by its IANA name, such as "Asia/Kolkata". None stands for
+    the system's local timezone, and is returned as is.
+
+    Before Python 3.9, timezones can only be looked up if backports.zoneinfo is
+    installed. Without it, only "UTC" is known, and any other timezone is replaced
+    by the system's local timezone.
+
+    Raises:
+        ValueError: If there's no such timezone.
+    """
+    if name is None:
+        return None
+    if ZoneInfo is None:
+        if name == "UTC":
+            return timezone.utc
+        logger.warning(
+            f"Can't look up timezone {name!r} before Python 3.9 without "
+            "backports.zoneinfo installed, using the system's timezone instead"
+        )
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone {name!r}")
+
+
+def _parse_field(field: str, name: str, low: int, high: int) -> FrozenSet[int]:
+    """Parse one field of a schedule into the values it matches"""
+    values = set()
+    for part in field.split(","):
+        spec, _, step_str = part.partition("/")
+        try:
+            step = int(step_str) if step_str else 1
+            if spec == "*":
+                start, end = low, high
+            elif "-" in spec:
+                start_str, end_str = spec.split("-", 1)
+                start, end = int(start_str), int(end_str)
+            else:
+                start = end = int(spec)
+                if step_str:
+                    end = high
+        except ValueError:
+            raise ValueError(f"Invalid {name} {part!r}")
+
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f"Invalid {name} {part!r}, must be from {low} to {high}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class _ScheduledJob:
+    __slots__ = ("name", "schedule", "func", "catch_up", "running")
+
+    def __init__(self, name: str, schedule: CronSchedule, func: Job, catch_up: float):
+        self.name = name
+        self.schedule = schedule
+        self.func = func
+        self.catch_up = catch_up
+        self.running = None  # type: Optional[asyncio.Future]
+
+
+class Scheduler:
+    def __init__(
+        self,
+        store: Storage,
+        max_sleep: float = 60,
+        clock: Callable[[], float] = time.time,
+    ):
+        """Runs jobs on schedules, keeping when each is next due in the database so
+        that runs missed while the bot was down are made up once it restarts.
+
+        Due times are kept on a heap, and a single task sleeps until the earliest
+        one. It wakes up at least every `max_sleep` seconds to read the clock
+        again, so a suspended machine or a changed clock doesn't make jobs late.
+
+        Each run is recorded as done before the job is called, so a run is never
+        repeated, even if the bot stops part way through it. A run that can't be
+        recorded is skipped.
+
+        Args:
+            store: Where the next run of each job is kept.
+
+            max_sleep: The longest to sleep for before checking the clock again, in
+                seconds.
+
+            clock: Returns the current time, in seconds since the epoch.
+        """
+        self.store = store
+        self.max_sleep = max_sleep
+        self.clock = clock
+
+        self._jobs = {}  # type: Dict[str, _ScheduledJob]
+        # (due, sequence number, job name). The sequence number keeps jobs due at
+        # the same time in the order they were added
+        self._heap = []  # type: List[Tuple[float, int, str]]
+        self._added = 0
+        # When each job is next due, as kept in the database. Loaded by the first
+        # `add`
+        self._next_runs = None  # type: Optional[Dict[str, float]]
+        self._wakeup = None  # type: Optional[asyncio.Event]
+        self._task = None  # type: Optional[asyncio.Future]
+
+    async def add(
+        self, name: str, schedule: CronSchedule, func: Job, catch_up: float = 86400
+    ) -> None:
+        """Run a job on a schedule.
+
+        Args:
+            name: Identifies the job in the database, so must stay the same across
+                restarts.
+
+            schedule: When to run the job.
+
+            func: The job. Called with the time the run was scheduled for, in the
+                schedule's timezone, which is in the past if a missed run is being
+                made up.
+
+            catch_up: Runs missed by up to this many seconds are made up. Older
+                ones are skipped.
+        """
+        if name in self._jobs:
+            raise ValueError(f"Job {name!r} has already been added")
+        self._jobs[name] = _ScheduledJob(name, schedule, func, catch_up)
+
+        if self._next_runs is None:
+            self._next_runs = await self.store.get_job_runs()
+        due = self._next_runs.get(name)
+        if due is None:
+            due = schedule.next_after(schedule.at(self.clock())).timestamp()
+            await self.store.set_job_next_run(name, due)
+        self._push(name, due)
+
+    def start(self) -> None:
+        """Start running jobs as they become due"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        """Stop scheduling jobs, waiting for any that are running to finish"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        running = [job.running for job in self._jobs.values() if job.running]
+        await asyncio.gather(*running, return_exceptions=True)
+
+    def _push(self, name: str, due: float) -> None:
+        self._added += 1
+        heapq.heappush(self._heap, (due, self._added, name))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            now = self.clock()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, name = heapq.heappop(self._heap)
+                try:
+                    await self._run_due(self._jobs[name], due, now)
+                except Exception:
+                    # Don't let one job stop the others from running
+                    logger.exception(f"Unable to run {name}")
+                    JOB_RUNS_TOTAL.inc(name, "failed")
+
+            delay = self.max_sleep
+            if self._heap:
+                delay = min(delay, self._heap[0][0] - now)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_due(self, job: _ScheduledJob, due: float, now: float) -> None:
+        """Start a run of a job that has become due, and schedule its next run"""
+        schedule = job.schedule
+        scheduled_for = schedule.at(due)
+        next_run = schedule.next_after(scheduled_for).timestamp()
+        # Scheduled before it's kept, so the job stays scheduled if that fails
+        self._push(job.name, next_run)
+        await self.store.set_job_next_run(job.name, next_run)
+
+        if now - due > job.catch_up:
+            logger.warning(f"Skipping run of {job.name} missed at {scheduled_for}")
+            JOB_RUNS_TOTAL.inc(job.name, "skipped")
+        elif job.running is not None and not job.running.done():
+            logger.warning(
+                f"Skipping run of {job.name} at {scheduled_for}, as the previous "
+                "run is still going"
+            )
+            JOB_RUNS_TOTAL.inc(job.name, "skipped")
+        else:
+            if now - due > self.max_sleep:
+                logger.info(f"Making up run of {job.name} missed at {scheduled_for}")
+            job.running = asyncio.ensure_future(self._call(job, scheduled_for))
+
+    async def _call(self, job: _ScheduledJob, scheduled_for: datetime) -> None:
+        try:
+            await job.func(scheduled_for)
+        except Exception:
+            logger.exception(f"Scheduled job {job.name} failed")
+            JOB_RUNS_TOTAL.inc(job.name, "failed")
+        else:
+            JOB_RUNS_TOTAL.inc(job.name, "ran")
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import random
+import time
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+from nio import AsyncClient, ErrorResponse
+
+from bangalore_bot import tracing
+from bangalore_bot.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Registry of the send queue belonging to each client. Weak so that throwaway
+# clients (e.g. in tests) don't keep their queues alive.
+_queues = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+
+ROOM_SEND_SECONDS = Histogram(
+    "bot_room_send_duration_seconds", "Round trip time of sending events to rooms"
+)
+ROOM_SEND_ERRORS = Counter(
+    "bot_room_send_errors_total", "Events that failed to send to rooms"
+)
+
+
+class SendQueue:
+    def __init__(
+        self,
+        client: AsyncClient,
+        typing_delay: Tuple[float, float] = (1, 5),
+    ):
+        """An outbound message pipeline with one queue and worker task per room.
+
+        Each message is given a "typing" delay when it is queued. The room's worker
+        waits until that delay has passed using `asyncio.sleep`, so the delay of one
+        room never holds up another room, nor incoming syncs. Messages queued at the
+        same time in the same room share their delay rather than adding them up,
+        while still being sent in the order they were queued.
+
+        Args:
+            client: The client to send messages with.
+
+            typing_delay: The (minimum, maximum) number of seconds to show the
+                typing notification for before sending. (0, 0) disables the delay.
+        """
+        self.client = client
+        self.min_delay, self.max_delay = typing_delay
+        self._queues = {}  # type: Dict[str, asyncio.Queue]
+        self._workers = {}  # type: Dict[str, asyncio.Task]
+
+    async def send(
+        self,
+        room_id: str,
+        content: Dict[str, Any],
+        message_type: str = "m.room.message",
+        ignore_unverified_devices: bool = True,
+    ) -> Any:
+        """Queue a message for a room and wait until it has been sent.
+
+        Args:
+            room_id: The ID of the room to send the message to.
+
+            content: The content of the event to send.
+
+            message_type: The type of the event to send.
+
+            ignore_unverified_devices: Passed through to `AsyncClient.room_send`.
+
+        Returns:
+            The response of `AsyncClient.room_send`.
+
+        Raises:
+            SendRetryError: If the message was unable to be sent.
+        """
+        loop = asyncio.get_event_loop()
+        due = loop.time() + self._pick_delay()
+        result = loop.create_future()
+        # Filled in by the worker with when it started and finished sending
+        timing = []  # type: List[float]
+        queued_at = time.perf_counter()
+
+        queue = self._queues.get(room_id)
+        if queue is None:
+            queue = self._queues[room_id] = asyncio.Queue()
+        queue.put_nowait(
+            (due, message_type, content, ignore_unverified_devices, timing, result)
+        )
+
+        if room_id not in self._workers:
+            self._workers[room_id] = loop.create_task(self._worker(room_id))
+
+        response = await result
+        # Split the time spent into waiting (for the typing delay and earlier
+        # messages) and the request to the homeserver
+        if timing:
+            tracing.record("send.waiting", queued_at, timing[0])
+            tracing.record("send.room_send", timing[0], timing[1])
+        return response
+
+    async def close(self) -> None:
+        """Cancel all room workers, failing any messages that are still queued"""
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        for queue in self._queues.values():
+            while not queue.empty():
+                *_, result = queue.get_nowait()
+                if not result.done():
+                    result.cancel()
+        self._queues.clear()
+
+    def _pick_delay(self) -> float:
+        if self.max_delay <= 0:
+            return 0
+        return random.uniform(self.min_delay, self.max_delay)
+
+    async def _worker(self, room_id: str) -> None:
+        """Send the queued messages of a room in order, exiting once it is empty"""
+        loop = asyncio.get_event_loop()
+        queue = self._queues[room_id]
+        typing = False
+        result = None  # type: Optional[asyncio.Future]
+        try:
+            while not queue.empty():
+                due, message_type, content, ignore_unverified, timing, result = (
+                    queue.get_nowait()
+                )
+                if result.cancelled():
+                    continue
+
+                delay = due - loop.time()
+                if delay > 0:
+                    if not typing:
+                        # Typing notifications are only cosmetic, so failing to
+                        # send one mustn't hold up the message
+                        try:
+                            await self.client.room_typing(room_id, typing_state=True)
+                            typing = True
+                        except Exception:
+                            logger.exception(f"Unable to start typing in {room_id}")
+                    await asyncio.sleep(delay)
+
+                timing.append(time.perf_counter())
+                try:
+                    with ROOM_SEND_SECONDS.time():
+                        response = await self.client.room_send(
+                            room_id,
+                            message_type,
+                            content,
+                            ignore_unverified_devices=ignore_unverified,
+                        )
+                except Exception as e:
+                    timing.append(time.perf_counter())
+                    ROOM_SEND_ERRORS.inc()
+                    if not result.done():
+                        result.set_exception(e)
+                else:
+                    timing.append(time.perf_counter())
+                    if isinstance(response, ErrorResponse):
+                        ROOM_SEND_ERRORS.inc()
+                    if not result.done():
+                        result.set_result(response)
+        except asyncio.CancelledError:
+            # The rest of the queue is cancelled by `close`
+            if result is not None and not result.done():
+                result.cancel()
+            raise
+        except Exception as e:
+            # Fail the message being sent and the ones waiting behind it, rather
+            # than leaving their senders waiting forever
+            logger.exception(f"Unable to send messages in {room_id}")
+            if result is not None and not result.done():
+                result.set_exception(e)
+            while not queue.empty():
+                *_, waiting = queue.get_nowait()
+                if not waiting.done():
+                    waiting.set_exception(e)
+        finally:
+            del self._workers[room_id]
+            if queue.empty():
+                self._queues.pop(room_id, None)
+            if typing:
+                try:
+                    await self.client.room_typing(room_id, typing_state=False)
+                except Exception:
+                    logger.exception(f"Unable to stop typing in {room_id}")
+
+
+def get_send_queue(client: AsyncClient) -> SendQueue:
+    """Get the send queue of a client, creating one with the defaults if needed"""
+    queue = _queues.get(client)
+    if queue is None:
+        queue = _queues[client] = SendQueue(client)
+    return queue
+
+
+def set_send_queue(client: AsyncClient, queue: Optional[SendQueue]) -> None:
+    """Set the send queue used for messages sent by a client"""
+    if queue is None:
+        _queues.pop(client, None)
+    else:
+        _queues[client] = queue
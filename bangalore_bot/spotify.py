@@ -0,0 +1,213 @@
+import asyncio
+import base64
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+from bangalore_bot.cache import MISSING, TTLCache
+from bangalore_bot.errors import SpotifyError
+from bangalore_bot.tracing import traced
+from bangalore_bot.metrics import Counter, Histogram
+from bangalore_bot.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+SEARCH_URL = "https://api.spotify.com/v1/search"
+
+# Refresh the access token this many seconds before Spotify says it expires
+TOKEN_EXPIRY_MARGIN = 60
+
+REQUESTS_TOTAL = Counter(
+    "bot_spotify_requests_total",
+    "Requests made to the Spotify API, by HTTP status",
+    ("endpoint", "status"),
+)
+REQUEST_SECONDS = Histogram(
+    "bot_spotify_request_duration_seconds",
+    "Time taken by requests to the Spotify API",
+    ("endpoint",),
+)
+
+
+class SpotifyClient:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        client_id: str,
+        client_secret: str,
+        cache: Optional[TTLCache] = None,
+        store: Optional[Storage] = None,
+    ):
+        """A Spotify Web API client using the client credentials flow.
+
+        The access token is cached until shortly before it expires, and concurrent
+        callers share a single refresh, so a search with a warm token costs one
+        HTTP round trip over the shared session's pooled connections.
+
+        Args:
+            session: The long-lived HTTP session to make requests with.
+
+            client_id: The Spotify application's client ID.
+
+            client_secret: The Spotify application's client secret.
+
+            cache: Caches search results by normalized query and search type, if
+                provided. Identical searches that are already in progress are
+                always shared rather than sent again.
+
+            store: If provided, cached search results are also persisted to the
+                database, and can be loaded back into the cache with `load`.
+        """
+        self.session = session
+        auth_str = f"{client_id}:{client_secret}"
+        self._basic_auth = base64.b64encode(auth_str.encode()).decode()
+
+        self._access_token = None  # type: Optional[str]
+        self._expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+
+        self.cache = cache
+        self.store = store
+        self._in_flight = {}  # type: Dict[Tuple[str, str], asyncio.Future]
+
+    async def load(self) -> None:
+        """Load the persisted search results that haven't expired into the cache"""
+        if self.cache is None or self.store is None:
+            return
+        rows = await self.store.get_spotify_results(self.cache.clock())
+        for query, search_type, url, expires_at in rows:
+            self.cache.set((query, search_type), url, expires_at)
+
+    @traced("spotify.token")
+    async def get_access_token(self) -> str:
+        """Get a valid access token, requesting a new one only if needed.
+
+        Raises:
+            SpotifyError: If Spotify didn't give a token.
+        """
+        if self._access_token and time.monotonic() < self._expires_at:
+            return self._access_token
+
+        async with self._token_lock:
+            # Another caller may have refreshed the token while we waited
+            if self._access_token and time.monotonic() < self._expires_at:
+                return self._access_token
+
+            headers = {
+                "Authorization": f"Basic {self._basic_auth}",
+                "Content-Type": "application/x-www-form-urlencoded",
+            }
+            data = {"grant_type": "client_credentials"}
+
+            with REQUEST_SECONDS.time("token"):
+                async with self.session.post(
+                    TOKEN_URL, headers=headers, data=data
+                ) as response:
+                    REQUESTS_TOTAL.inc("token", str(response.status))
+                    if response.status != 200:
+                        raise SpotifyError(
+                            f"Spotify token request failed with HTTP {response.status}"
+                        )
+                    response_data = await response.json()
+
+            if not response_data.get("access_token"):
+                raise SpotifyError("Spotify didn't return an access token")
+            self._access_token = response_data["access_token"]
+            expires_in = response_data.get("expires_in", 3600)
+            self._expires_at = time.monotonic() + max(
+                expires_in - TOKEN_EXPIRY_MARGIN, 0
+            )
+            return self._access_token
+
+    def invalidate_token(self) -> None:
+        """Forget the cached access token, e.g. after it was rejected"""
+        self._access_token = None
+        self._expires_at = 0.0
+
+    async def search(self, query: str, search_type: str = "track") -> Optional[str]:
+        """Search Spotify and return the URL of the best match.
+
+        Args:
+            query: The search terms.
+
+            search_type: The type of item to search for, e.g. "track" or "album".
+
+        Returns:
+            An open.spotify.com URL, or None if nothing was found.
+
+        Raises:
+            SpotifyError: If Spotify couldn't be searched. Failed searches aren't
+                cached.
+        """
+        key = (" ".join(query.lower().split()), search_type)
+
+        if self.cache is not None:
+            url = self.cache.get(key)
+            if url is not MISSING:
+                return url
+            logger.debug("Spotify search cache miss: %s", self.cache.stats())
+
+        # Share the result of an identical search that's already in progress
+        search = self._in_flight.get(key)
+        if search is None:
+            search = asyncio.ensure_future(self._search_and_cache(*key))
+            self._in_flight[key] = search
+            search.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # Shield the shared search so one caller being cancelled doesn't cancel it
+        # for everyone else
+        return await asyncio.shield(search)
+
+    async def _search_and_cache(self, query: str, search_type: str) -> Optional[str]:
+        # Raises if the search failed, so only real answers are cached
+        url = await self._search(query, search_type)
+
+        if self.cache is not None:
+            expires_at = self.cache.set((query, search_type), url)
+            if self.store is not None:
+                # The search still succeeded, it just won't outlast a restart
+                try:
+                    await self.store.store_spotify_result(
+                        query, search_type, url, expires_at
+                    )
+                except Exception:
+                    logger.exception(f"Unable to store Spotify result for {query!r}")
+
+        return url
+
+    @traced("spotify.search")
+    async def _search(self, query: str, search_type: str) -> Optional[str]:
+        search_params = {"q": query, "type": search_type, "limit": 1}
+
+        # Retry once with a fresh token if Spotify revoked the cached one early
+        for attempt in range(2):
+            access_token = await self.get_access_token()
+            headers = {"Authorization": f"Bearer {access_token}"}
+            with REQUEST_SECONDS.time("search"):
+                async with self.session.get(
+                    SEARCH_URL, params=search_params, headers=headers
+                ) as response:
+                    REQUESTS_TOTAL.inc("search", str(response.status))
+                    if response.status == 401 and attempt == 0:
+                        self.invalidate_token()
+                        continue
+                    if response.status != 200:
+                        raise SpotifyError(
+                            f"Spotify search failed with HTTP {response.status}"
+                        )
+                    search_results = await response.json()
+            break
+
+        return self._first_url(search_results, search_type)
+
+    @staticmethod
+    def _first_url(search_results: Dict[str, Any], search_type: str) -> Optional[str]:
+        try:
+            uri = search_results[f"{search_type}s"]["items"][0]["uri"]
+        except (KeyError, IndexError, TypeError):
+            return None
+        spotify_id = uri.split(":")[2]
+        return f"https://open.spotify.com/{search_type}/{spotify_id}"
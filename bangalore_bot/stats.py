@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, tzinfo
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from bangalore_bot.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+# Joiners that post within this long of joining count as having stayed
+RETENTION_PERIOD_MS = 7 * DAY_MS
+# Joiners that posted within this long ago count as still active
+ACTIVE_PERIOD_MS = 7 * DAY_MS
+
+
+# What became of the users that joined a room
+class Retention(NamedTuple):
+    joined: int
+    # Posted within RETENTION_PERIOD_MS of joining
+    posted: int
+    # Posted within the last ACTIVE_PERIOD_MS
+    active: int
+
+
+class RoomReport(NamedTuple):
+    messages: int
+    # (user_id, message count), most messages first
+    top_posters: List[Tuple[str, int]]
+    # Messages by day of the week (Monday first) and hour of the day
+    heatmap: List[List[int]]
+    retention: Retention
+
+
+class RoomStats:
+    def __init__(
+        self,
+        store: Storage,
+        flush_interval: float = 10,
+        timezone: Optional[tzinfo] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """Keeps rollups of how active each room is: how many messages each user sent
+        to it in each hour, and what became of users that joined it.
+
+        Messages and joins are counted in memory and added to the rollups in the
+        database by a background task, so the event loop never waits on the
+        database for them. Reports are made from the rollups alone, never from
+        message history.
+
+        Args:
+            store: Where the rollups are kept.
+
+            flush_interval: How often to write the counts out, in seconds.
+
+            timezone: The timezone to report the busiest times of the day in. The
+                system's local timezone if None.
+
+            clock: Returns the current time, in seconds since the epoch.
+        """
+        self.store = store
+        self.flush_interval = flush_interval
+        self.timezone = timezone
+        self.clock = clock
+
+        # Counts not yet written to the database
+        self._message_counts = {}  # type: Dict[Tuple[str, str, int], int]
+        self._joins = {}  # type: Dict[Tuple[str, str], int]
+        # (first, last) time each user posted, by (room_id, user_id). Whether they
+        # are a tracked joiner is left to the database, so that every join ever
+        # seen needn't be kept in memory
+        self._activity = {}  # type: Dict[Tuple[str, str], Tuple[int, int]]
+
+        self._task = None  # type: Optional[asyncio.Future]
+
+    def record_message(self, room_id: str, user_id: str, timestamp: int) -> None:
+        """Count a message, sent at a time in milliseconds since the epoch"""
+        key = (room_id, user_id, timestamp // HOUR_MS)
+        self._message_counts[key] = self._message_counts.get(key, 0) + 1
+
+        first, last = self._activity.get((room_id, user_id), (timestamp, timestamp))
+        self._activity[(room_id, user_id)] = (
+            min(first, timestamp),
+            max(last, timestamp),
+        )
+
+    def record_join(self, room_id: str, user_id: str, timestamp: int) -> None:
+        """Start tracking a user that joined a room at a time in milliseconds since
+        the epoch. Only their first join is kept"""
+        joined_at = self._joins.get((room_id, user_id), timestamp)
+        self._joins[(room_id, user_id)] = min(joined_at, timestamp)
+
+    def start(self) -> None:
+        """Start writing the counts out in the background"""
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        """Stop the background task and write out what's left"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Add the counts so far to the rollups in the database"""
+        message_counts, self._message_counts = self._message_counts, {}
+        joins, self._joins = self._joins, {}
+        activity, self._activity = self._activity, {}
+        if not (message_counts or joins or activity):
+            return
+
+        try:
+            await self.store.add_activity(
+                [key + (count,) for key, count in message_counts.items()],
+                [key + (joined_at,) for key, joined_at in joins.items()],
+                [times + key for key, times in activity.items()],
+            )
+        except Exception:
+            logger.exception("Unable to write room activity, will retry")
+            self._restore(message_counts, joins, activity)
+
+    def _restore(
+        self,
+        message_counts: Dict[Tuple[str, str, int], int],
+        joins: Dict[Tuple[str, str], int],
+        activity: Dict[Tuple[str, str], Tuple[int, int]],
+    ) -> None:
+        """Put counts that couldn't be written back with the ones since"""
+        for key, count in message_counts.items():
+            self._message_counts[key] = self._message_counts.get(key, 0) + count
+        for key, joined_at in joins.items():
+            self._joins[key] = min(joined_at, self._joins.get(key, joined_at))
+        for key, (first, last) in activity.items():
+            newer_first, newer_last = self._activity.get(key, (first, last))
+            self._activity[key] = (
+                min(first, newer_first),
+                max(last, newer_last),
+            )
+
+    async def report(self, room_id: str, days: int, top: int = 5) -> RoomReport:
+        """Describe a room's activity over a number of days.
+
+        Args:
+            room_id: The room to report on.
+
+            days: How many days back to report on.
+
+            top: How many of the most active users to include.
+        """
+        # Include what hasn't been written yet
+        await self.flush()
+
+        now = int(self.clock() * 1000)
+        since = now - days * DAY_MS
+        since_hour = since // HOUR_MS
+
+        top_posters = await self.store.get_top_posters(room_id, since_hour, top)
+
+        heatmap = [[0] * 24 for _ in range(7)]
+        messages = 0
+        for hour, count in await self.store.get_hourly_message_counts(
+            room_id, since_hour
+        ):
+            # Hours are counted in UTC, so in timezones that are offset by part of
+            # an hour each one is put under the local hour it starts in
+            start = self._local_time(hour * 3600)
+            heatmap[start.weekday()][start.hour] += count
+            messages += count
+
+        joined = posted = active = 0
+        for _, joined_at, first_message_at, last_message_at in (
+            await self.store.get_joins(room_id, since)
+        ):
+            joined += 1
+            if (
+                first_message_at is not None
+                and first_message_at - joined_at <= RETENTION_PERIOD_MS
+            ):
+                posted += 1
+            if (
+                last_message_at is not None
+                and now - last_message_at <= ACTIVE_PERIOD_MS
+            ):
+                active += 1
+
+        return RoomReport(
+            messages, top_posters, heatmap, Retention(joined, posted, active)
+        )
+
+    def _local_time(self, timestamp: float) -> datetime:
+        if self.timezone is None:
+            return datetime.fromtimestamp(timestamp)
+        return datetime.fromtimestamp(timestamp, self.timezone)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
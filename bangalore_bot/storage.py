@@ -1,5 +1,17 @@
+import asyncio
+import json
 import logging
-from typing import Any, Dict
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from bangalore_bot import tracing
+from bangalore_bot.birthdays import BirthdayIndex
+from bangalore_bot.metrics import Histogram
 
 # The latest migration version of the database.
 #
@@ -8,13 +20,134 @@ from typing import Any, Dict
 # the version specified here.
 #
 # When a migration is performed, the `migration_version` table should be incremented.
-latest_migration_version = 0
+latest_migration_version = 8
 
 logger = logging.getLogger(__name__)
 
+# Where users welcomed to the main room were recorded before they were kept in the
+# database, as a JSON object keyed by user ID
+VISITED_PATH = "visited.json"
+
+QUERY_SECONDS = Histogram(
+    "bot_storage_query_duration_seconds",
+    "Time taken by database queries, including waiting for a connection",
+    ("operation",),
+)
+
+# Birthday statements, kept as constants so every call uses the same statement text
+SET_BIRTHDAY = """
+    INSERT INTO birthdays (sender, sender_name, birth_month, birth_day, birth_year)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (sender) DO UPDATE SET
+        sender_name = excluded.sender_name,
+        birth_month = excluded.birth_month,
+        birth_day = excluded.birth_day,
+        birth_year = excluded.birth_year
+"""
+GET_BIRTHDAYS_IN_MONTH = """
+    SELECT sender, birth_day FROM birthdays
+    WHERE birth_month = ?
+    ORDER BY birth_day ASC
+"""
+GET_BIRTHDAYS_ON = """
+    SELECT sender FROM birthdays
+    WHERE birth_month = ? AND birth_day = ?
+"""
+
+# An archived message: (event_id, room_id, sender, message, timestamp), with the
+# timestamp in milliseconds since the epoch
+MessageRow = Tuple[str, str, str, str, int]
+
+# Archived messages are written in batches. Events seen again, such as after a
+# restart, are skipped
+INSERT_MESSAGE = """
+    INSERT INTO messages (event_id, room_id, sender, message, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (event_id) DO NOTHING
+"""
+# The same for postgres, where all of a batch's rows go in a single statement
+INSERT_MESSAGES_VALUES = """
+    INSERT INTO messages (event_id, room_id, sender, message, timestamp)
+    VALUES %s
+    ON CONFLICT (event_id) DO NOTHING
+"""
+
+# Full-text search of a room's archived messages. The newest matches, up to a
+# limit, are ranked and the best returned. sqlite takes an FTS5 query, which it
+# matches newest first so that it can stop at the limit, and postgres takes the
+# words to search for
+SEARCH_MESSAGES_SQLITE = """
+    WITH recent AS (
+        SELECT m.event_id, m.room_id, m.sender, m.message, m.timestamp,
+            messages_fts.rank AS rank
+        FROM messages_fts
+        JOIN messages AS m ON m.id = messages_fts.rowid
+        WHERE messages_fts MATCH ? AND m.room_id = ?
+        ORDER BY messages_fts.rowid DESC
+        LIMIT ?
+    )
+    SELECT event_id, room_id, sender, message, timestamp
+    FROM recent
+    ORDER BY rank, timestamp DESC
+    LIMIT ? OFFSET ?
+"""
+SEARCH_MESSAGES_POSTGRES = """
+    WITH recent AS (
+        SELECT event_id, room_id, sender, message, timestamp, message_tsv
+        FROM messages
+        WHERE message_tsv @@ plainto_tsquery('english', ?) AND room_id = ?
+        ORDER BY timestamp DESC
+        LIMIT ?
+    )
+    SELECT event_id, room_id, sender, message, timestamp
+    FROM recent
+    ORDER BY ts_rank(message_tsv, plainto_tsquery('english', ?)) DESC,
+        timestamp DESC
+    LIMIT ? OFFSET ?
+"""
+
+# Rollups of room activity, added to as messages and joins are seen
+ADD_MESSAGE_COUNT = """
+    INSERT INTO message_counts (room_id, user_id, hour, count) VALUES (?, ?, ?, ?)
+    ON CONFLICT (room_id, hour, user_id)
+    DO UPDATE SET count = message_counts.count + excluded.count
+"""
+ADD_JOIN = """
+    INSERT INTO room_joins (room_id, user_id, joined_at) VALUES (?, ?, ?)
+    ON CONFLICT (room_id, user_id) DO NOTHING
+"""
+UPDATE_JOINER_ACTIVITY = """
+    UPDATE room_joins SET
+        first_message_at = CASE
+            WHEN first_message_at IS NULL OR first_message_at > ? THEN ?
+            ELSE first_message_at
+        END,
+        last_message_at = CASE
+            WHEN last_message_at IS NULL OR last_message_at < ? THEN ?
+            ELSE last_message_at
+        END
+    WHERE room_id = ? AND user_id = ?
+"""
+GET_TOP_POSTERS = """
+    SELECT user_id, SUM(count) AS total FROM message_counts
+    WHERE room_id = ? AND hour >= ?
+    GROUP BY user_id
+    ORDER BY total DESC, user_id
+    LIMIT ?
+"""
+GET_HOURLY_MESSAGE_COUNTS = """
+    SELECT hour, SUM(count) FROM message_counts
+    WHERE room_id = ? AND hour >= ?
+    GROUP BY hour
+"""
+GET_JOINS = """
+    SELECT user_id, joined_at, first_message_at, last_message_at FROM room_joins
+    WHERE room_id = ? AND joined_at >= ?
+"""
+
 
 class Storage:
-    def __init__(self, database_config: Dict[str, str]):
+    def __init__(self, database_config: Dict[str, Any]):
         """Setup the database.
 
         Runs an initial setup or migrations depending on whether a database file has already
@@ -25,6 +158,11 @@ class Storage:
                 * type: A string, one of "sqlite" or "postgres".
                 * connection_string: A string, featuring a connection string that
                     be fed to each respective db library's `connect` method.
+                * pool_min_size, pool_max_size: Optional. For postgres, the number of
+                    pooled connections to keep open and the most to open at once.
+                * health_check_interval: Optional. For postgres, pooled connections
+                    that have been idle for longer than this many seconds are checked
+                    before being used.
         """
         self.conn = self._get_database_connection(
             database_config["type"], database_config["connection_string"]
@@ -32,6 +170,23 @@ class Storage:
         self.cursor = self.conn.cursor()
         self.db_type = database_config["type"]
 
+        # Queries made from the event loop run on dedicated threads, so that a slow
+        # disk or a locked database doesn't block syncing. sqlite shares a single
+        # connection and thread, while postgres gets a thread per pooled connection
+        self._pool = None
+        max_workers = 1
+        if self.db_type == "postgres":
+            self._pool = self._get_connection_pool(
+                database_config["connection_string"],
+                database_config.get("pool_min_size", 1),
+                database_config.get("pool_max_size", 5),
+            )
+            max_workers = self._pool.maxconn
+        self.health_check_interval = database_config.get("health_check_interval", 30)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="storage"
+        )
+
         # Try to check the current migration version
         migration_level = 0
         try:
@@ -44,6 +199,16 @@ class Storage:
             if migration_level < latest_migration_version:
                 self._run_migrations(migration_level)
 
+        # Load the users that have already been welcomed into memory, so that
+        # membership events can be checked against it without touching the database
+        self._execute("SELECT room_id, user_id FROM welcomed_users")
+        self.welcomed = set(self.cursor.fetchall())  # type: Set[Tuple[str, str]]
+
+        # Keep an in-memory calendar of birthdays, updated as they are written
+        self._execute("SELECT sender, birth_month, birth_day FROM birthdays")
+        self.birthdays = BirthdayIndex(self.cursor.fetchall())
+        self._birthdays_lock = threading.Lock()
+
         logger.info(f"Database initialization of type '{self.db_type}' complete")
 
     def _get_database_connection(
@@ -53,8 +218,11 @@ class Storage:
         if database_type == "sqlite":
             import sqlite3
 
-            # Initialize a connection to the database, with autocommit on
-            return sqlite3.connect(connection_string, isolation_level=None)
+            # Initialize a connection to the database, with autocommit on. The
+            # connection is created here but used from the storage thread
+            return sqlite3.connect(
+                connection_string, isolation_level=None, check_same_thread=False
+            )
         elif database_type == "postgres":
             import psycopg2
 
@@ -65,6 +233,78 @@ class Storage:
 
             return conn
 
+    def _get_connection_pool(
+        self, connection_string: str, min_size: int, max_size: int
+    ) -> Any:
+        """Creates and returns a pool of postgres connections, which may be used from
+        multiple threads."""
+        from psycopg2.extensions import connection
+        from psycopg2.pool import ThreadedConnectionPool
+
+        class PooledConnection(connection):
+            def __init__(self, *args: Any, **kwargs: Any):
+                super().__init__(*args, **kwargs)
+
+                # Autocommit on
+                self.autocommit = True
+
+                # When it was last returned to the pool, by `time.monotonic`. Only
+                # touched by the thread that has it checked out
+                self.last_used = None  # type: Optional[float]
+
+        return ThreadedConnectionPool(
+            min_size, max_size, connection_string, connection_factory=PooledConnection
+        )
+
+    @contextmanager
+    def _connection(self):
+        """Check out a database connection for use on the current thread.
+
+        For sqlite this is the shared connection. For postgres a connection is taken
+        from the pool, replacing it first if it was closed or has been idle for a
+        while and no longer responds. It's returned to the pool afterwards, or thrown
+        away if the database raised an error about the connection itself.
+        """
+        if self._pool is None:
+            yield self.conn
+            return
+
+        import psycopg2
+
+        conn = self._pool.getconn()
+        for _ in range(self._pool.maxconn + 1):
+            if not conn.closed and self._is_healthy(conn):
+                break
+            self._pool.putconn(conn, close=True)
+            conn = self._pool.getconn()
+
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            conn.last_used = time.monotonic()
+            self._pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def _is_healthy(self, conn: Any) -> bool:
+        """Ping a pooled connection if it's been idle for longer than the health check
+        interval"""
+        if (
+            conn.last_used is not None
+            and time.monotonic() - conn.last_used < self.health_check_interval
+        ):
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            logger.warning("Discarding broken database connection")
+            return False
+
     def _initial_setup(self) -> None:
         """Initial setup of the database"""
         logger.info("Performing initial database setup...")
@@ -88,61 +328,659 @@ class Storage:
             (0,),
         )
 
-        self._execute(
+        # Set up any other necessary database tables here
+
+        logger.info("Database setup complete")
+
+    def _run_migrations(self, current_migration_version: int) -> None:
+        """Execute database migrations. Migrates the database to the
+        `latest_migration_version`.
+
+        Args:
+            current_migration_version: The migration version that the database is
+                currently at.
+        """
+        logger.debug("Checking for necessary database migrations...")
+
+        if current_migration_version < 1:
+            logger.info("Migrating the database from v0 to v1...")
+
+            # Track which users have been welcomed to which rooms
+            self._execute(
+                """
+                CREATE TABLE welcomed_users (
+                    room_id VARCHAR NOT NULL,
+                    user_id VARCHAR NOT NULL,
+                    PRIMARY KEY (room_id, user_id)
+                )
+                """
+            )
+
+            self._execute("UPDATE migration_version SET version = 1")
+
+            logger.info("Database migrated to v1")
+
+        if current_migration_version < 2:
+            logger.info("Migrating the database from v1 to v2...")
+
+            # Persisted Spotify search results. A NULL url means nothing was found
+            self._execute(
+                """
+                CREATE TABLE spotify_cache (
+                    query VARCHAR NOT NULL,
+                    search_type VARCHAR NOT NULL,
+                    url VARCHAR,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (query, search_type)
+                )
+                """
+            )
+
+            self._execute("UPDATE migration_version SET version = 2")
+
+            logger.info("Database migrated to v2")
+
+        if current_migration_version < 3:
+            logger.info("Migrating the database from v2 to v3...")
+
+            # The original birthdays table was missing the commas between its
+            # columns. Create it properly, keeping any rows an older version of
+            # the table might hold
+            self._execute(
+                """
+                CREATE TABLE birthdays_v3 (
+                    sender VARCHAR PRIMARY KEY,
+                    sender_name VARCHAR,
+                    birth_month INTEGER NOT NULL,
+                    birth_day INTEGER NOT NULL,
+                    birth_year INTEGER
+                )
+                """
+            )
+            try:
+                self._execute(
+                    """
+                    INSERT INTO birthdays_v3
+                        (sender, sender_name, birth_month, birth_day, birth_year)
+                    SELECT sender, sender_name, birth_month, birth_day, birth_year
+                    FROM birthdays
+                    WHERE birth_month IS NOT NULL AND birth_day IS NOT NULL
+                    ON CONFLICT (sender) DO NOTHING
+                    """
+                )
+                self._execute("DROP TABLE birthdays")
+            except Exception:
+                logger.info("No existing birthdays to migrate")
+            self._execute("ALTER TABLE birthdays_v3 RENAME TO birthdays")
+            self._execute(
+                """
+                CREATE INDEX birthdays_month_day
+                ON birthdays (birth_month, birth_day)
+                """
+            )
+
+            self._execute("UPDATE migration_version SET version = 3")
+
+            logger.info("Database migrated to v3")
+
+        if current_migration_version < 4:
+            logger.info("Migrating the database from v3 to v4...")
+
+            # When each scheduled job is next due, in seconds since the epoch
+            self._execute(
+                """
+                CREATE TABLE scheduled_jobs (
+                    name VARCHAR PRIMARY KEY,
+                    next_run DOUBLE PRECISION NOT NULL
+                )
+                """
+            )
+
+            self._execute("UPDATE migration_version SET version = 4")
+
+            logger.info("Database migrated to v4")
+
+        if current_migration_version < 5:
+            logger.info("Migrating the database from v4 to v5...")
+
+            # The archive of messages sent to the bot's rooms. This replaces the
+            # messages table the initial setup used to try, and fail, to create
+            self._execute(
                 """
                 CREATE TABLE messages (
-                    id INTEGER PRIMARY KEY
-                    room_id VARCHAR
-                    sender VARCHAR
-                    message VARCHAR
-                    timestamp INTEGER
+                    event_id VARCHAR PRIMARY KEY,
+                    room_id VARCHAR NOT NULL,
+                    sender VARCHAR NOT NULL,
+                    message TEXT NOT NULL,
+                    timestamp BIGINT NOT NULL
                 )
                 """
+            )
+            self._execute(
+                """
+                CREATE INDEX messages_room_timestamp
+                ON messages (room_id, timestamp)
+                """
+            )
+
+            self._execute("UPDATE migration_version SET version = 5")
+
+            logger.info("Database migrated to v5")
+
+        if current_migration_version < 6:
+            logger.info("Migrating the database from v5 to v6...")
+
+            # A full-text index of archived messages, kept up to date as they're
+            # written
+            if self.db_type == "postgres":
+                self._execute(
+                    """
+                    ALTER TABLE messages ADD COLUMN message_tsv tsvector
+                    GENERATED ALWAYS AS (to_tsvector('english', message)) STORED
+                    """
                 )
-        self._execute(
+                self._execute(
+                    "CREATE INDEX messages_tsv ON messages USING GIN (message_tsv)"
+                )
+            else:
+                self._create_message_index_sqlite()
+
+            self._execute("UPDATE migration_version SET version = 6")
+
+            logger.info("Database migrated to v6")
+
+        if current_migration_version < 7:
+            logger.info("Migrating the database from v6 to v7...")
+
+            # How many messages each user sent to each room in each hour, with
+            # hours counted since the epoch
+            self._execute(
                 """
-                CREATE TABLE birthdays (
-                sender VARCHAR PRIMARY KEY
-                birth_month INTEGER
-                birth_day INTEGER
-                birth_year INTEGER
+                CREATE TABLE message_counts (
+                    room_id VARCHAR NOT NULL,
+                    user_id VARCHAR NOT NULL,
+                    hour BIGINT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (room_id, hour, user_id)
                 )
                 """
+            )
+            # When users joined rooms, and when they first and last posted since,
+            # in milliseconds since the epoch
+            self._execute(
+                """
+                CREATE TABLE room_joins (
+                    room_id VARCHAR NOT NULL,
+                    user_id VARCHAR NOT NULL,
+                    joined_at BIGINT NOT NULL,
+                    first_message_at BIGINT,
+                    last_message_at BIGINT,
+                    PRIMARY KEY (room_id, user_id)
                 )
+                """
+            )
+            self._execute(
+                "CREATE INDEX room_joins_joined_at ON room_joins (room_id, joined_at)"
+            )
 
-        # Set up any other necessary database tables here
+            self._execute("UPDATE migration_version SET version = 7")
 
-        logger.info("Database setup complete")
+            logger.info("Database migrated to v7")
 
-    def _run_migrations(self, current_migration_version: int) -> None:
-        """Execute database migrations. Migrates the database to the
-        `latest_migration_version`.
+        if current_migration_version < 8:
+            logger.info("Migrating the database from v7 to v8...")
+
+            self._import_visited_json()
+
+            self._execute("UPDATE migration_version SET version = 8")
+
+            logger.info("Database migrated to v8")
+
+    def _import_visited_json(self) -> None:
+        """Import the users welcomed before welcomes were kept in the database, so
+        they aren't welcomed again. Only the main room welcomed users then"""
+        if not os.path.exists(VISITED_PATH):
+            return
+        room_id = os.getenv("MAIN_ROOM")
+        if not room_id:
+            logger.warning(
+                f"Not importing the welcomed users in {VISITED_PATH}, as MAIN_ROOM "
+                f"isn't set"
+            )
+            return
+
+        with open(VISITED_PATH) as f:
+            visited = json.load(f)
+        for user_id in visited:
+            self._execute(
+                """
+                INSERT INTO welcomed_users (room_id, user_id) VALUES (?, ?)
+                ON CONFLICT (room_id, user_id) DO NOTHING
+                """,
+                (room_id, user_id),
+            )
+        logger.info(f"Imported {len(visited)} welcomed users from {VISITED_PATH}")
+
+    def _create_message_index_sqlite(self) -> None:
+        """Index archived messages with FTS5, using triggers to keep the index up
+        to date"""
+        # The index refers to messages by rowid, which a VACUUM may renumber
+        # unless it's an INTEGER PRIMARY KEY, so rebuild the table with one
+        self._execute(
+            """
+            CREATE TABLE messages_v6 (
+                id INTEGER PRIMARY KEY,
+                event_id VARCHAR NOT NULL UNIQUE,
+                room_id VARCHAR NOT NULL,
+                sender VARCHAR NOT NULL,
+                message TEXT NOT NULL,
+                timestamp BIGINT NOT NULL
+            )
+            """
+        )
+        self._execute(
+            """
+            INSERT INTO messages_v6 (event_id, room_id, sender, message, timestamp)
+            SELECT event_id, room_id, sender, message, timestamp FROM messages
+            """
+        )
+        self._execute("DROP TABLE messages")
+        self._execute("ALTER TABLE messages_v6 RENAME TO messages")
+        self._execute(
+            "CREATE INDEX messages_room_timestamp ON messages (room_id, timestamp)"
+        )
+
+        self._execute(
+            """
+            CREATE VIRTUAL TABLE messages_fts USING fts5(
+                message,
+                content='messages',
+                content_rowid='id',
+                tokenize='porter unicode61'
+            )
+            """
+        )
+        self._execute(
+            """
+            CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message);
+            END
+            """
+        )
+        self._execute(
+            """
+            CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, message)
+                VALUES ('delete', old.id, old.message);
+            END
+            """
+        )
+        self._execute(
+            """
+            CREATE TRIGGER messages_fts_update AFTER UPDATE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, message)
+                VALUES ('delete', old.id, old.message);
+                INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message);
+            END
+            """
+        )
+        # Index the messages that were archived before
+        self._execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+    def is_welcomed(self, room_id: str, user_id: str) -> bool:
+        """Check whether a user has already been welcomed to a room"""
+        return (room_id, user_id) in self.welcomed
+
+    async def mark_welcomed(self, room_id: str, user_id: str) -> None:
+        """Record that a user has been welcomed to a room"""
+        if (room_id, user_id) in self.welcomed:
+            return
+
+        self.welcomed.add((room_id, user_id))
+        await self.execute(
+            "INSERT INTO welcomed_users (room_id, user_id) VALUES (?, ?)",
+            (room_id, user_id),
+        )
+
+    async def get_spotify_results(
+        self, now: float
+    ) -> List[Tuple[str, str, Optional[str], float]]:
+        """Get the persisted Spotify search results that haven't expired yet.
+
+        Expired results are deleted.
 
         Args:
-            current_migration_version: The migration version that the database is
-                currently at.
+            now: The current time, in seconds since the epoch.
+
+        Returns:
+            A list of (query, search_type, url, expires_at) tuples.
         """
-        logger.debug("Checking for necessary database migrations...")
+        await self.execute("DELETE FROM spotify_cache WHERE expires_at <= ?", (now,))
+        return await self.fetchall(
+            "SELECT query, search_type, url, expires_at FROM spotify_cache"
+        )
+
+    async def store_spotify_result(
+        self, query: str, search_type: str, url: Optional[str], expires_at: float
+    ) -> None:
+        """Persist a Spotify search result, replacing any older one"""
+        await self.execute(
+            """
+            INSERT INTO spotify_cache (query, search_type, url, expires_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (query, search_type)
+            DO UPDATE SET url = excluded.url, expires_at = excluded.expires_at
+            """,
+            (query, search_type, url, expires_at),
+        )
+
+    async def get_job_runs(self) -> Dict[str, float]:
+        """Get when each scheduled job is next due to run, in seconds since the
+        epoch, by job name"""
+        return dict(await self.fetchall("SELECT name, next_run FROM scheduled_jobs"))
+
+    async def set_job_next_run(self, name: str, next_run: float) -> None:
+        """Record when a scheduled job is next due to run"""
+        await self.execute(
+            """
+            INSERT INTO scheduled_jobs (name, next_run) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET next_run = excluded.next_run
+            """,
+            (name, next_run),
+        )
+
+    async def set_birthday(
+        self,
+        sender: str,
+        sender_name: str,
+        birth_month: int,
+        birth_day: int,
+        birth_year: int,
+    ) -> None:
+        """Add a user's birthday, or update it if they already have one.
+
+        The birthday is written to the database and then to `self.birthdays`, with
+        both steps done together so that concurrent writes land in the same order in
+        each.
+        """
+
+        def run(cursor):
+            with self._birthdays_lock:
+                cursor.execute(
+                    _translate(SET_BIRTHDAY, self.db_type),
+                    (sender, sender_name, birth_month, birth_day, birth_year),
+                )
+                self.birthdays.set(sender, birth_month, birth_day)
+
+        await self._run(run, "set_birthday")
+
+    async def get_birthdays_in_month(self, birth_month: int) -> List[Tuple[str, int]]:
+        """Get the (sender, birth_day) of everyone with a birthday in a month, ordered
+        by day, from the database. `self.birthdays` answers this from memory."""
+        return await self.fetchall(GET_BIRTHDAYS_IN_MONTH, (birth_month,))
+
+    async def get_birthdays_on(self, birth_month: int, birth_day: int) -> List[str]:
+        """Get the users whose birthday falls on the given day, from the database.
+        `self.birthdays` answers this from memory."""
+        rows = await self.fetchall(GET_BIRTHDAYS_ON, (birth_month, birth_day))
+        return [row[0] for row in rows]
+
+    async def insert_messages(self, rows: Sequence[MessageRow]) -> None:
+        """Archive a batch of messages, skipping any that already are.
+
+        The batch is written in one transaction. For sqlite it's a prepared
+        statement run once per row, and for postgres a single multi-row insert.
+
+        Args:
+            rows: The messages to archive.
+        """
+        if not rows:
+            return
+
+        def run(cursor):
+            if self.db_type == "postgres":
+                from psycopg2.extras import execute_values
+
+                execute_values(
+                    cursor, INSERT_MESSAGES_VALUES, rows, page_size=len(rows)
+                )
+                return
+
+            _executemany_in_transaction(cursor, [(INSERT_MESSAGE, rows)])
 
-        # if current_migration_version < 1:
-        #    logger.info("Migrating the database from v0 to v1...")
-        #
-        #    # Add new table, delete old ones, etc.
-        #
-        #    # Update the stored migration version
-        #    self._execute("UPDATE migration_version SET version = 1")
-        #
-        #    logger.info("Database migrated to v1")
+        await self._run(run, "insert_messages")
+
+    async def search_messages(
+        self,
+        room_id: str,
+        words: Sequence[str],
+        limit: int,
+        offset: int = 0,
+        window: int = 1000,
+    ) -> List[MessageRow]:
+        """Search a room's archived messages for ones containing all of the given
+        words, best matches first.
+
+        Only the newest `window` matches are ranked, which keeps searching for
+        common words fast. Older matches are left out.
+
+        Args:
+            room_id: The room to search the messages of.
+
+            words: The words to search for.
+
+            limit: The most messages to return.
+
+            offset: How many of the best matches to skip, for paging through them.
+
+            window: How many of the newest matches to rank.
+        """
+        if self.db_type == "postgres":
+            query = " ".join(words)
+            sql = SEARCH_MESSAGES_POSTGRES
+            params = (query, room_id, window, query, limit, offset)
+        else:
+            # Quote each word, so that none are taken as FTS5 operators
+            query = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+            sql = SEARCH_MESSAGES_SQLITE
+            params = (query, room_id, window, limit, offset)
+        return await self._run_query(
+            sql, params, lambda cursor: cursor.fetchall(), "search_messages"
+        )
+
+    async def add_activity(
+        self,
+        message_counts: Sequence[Tuple[str, str, int, int]],
+        joins: Sequence[Tuple[str, str, int]],
+        joiner_activity: Sequence[Tuple[int, int, str, str]],
+    ) -> None:
+        """Add to the rollups of room activity, in one transaction.
+
+        Args:
+            message_counts: (room_id, user_id, hour, count) tuples, adding to the
+                number of messages a user sent in an hour.
+
+            joins: (room_id, user_id, joined_at) tuples of users that joined rooms.
+                Users that joined a room before keep their first join.
+
+            joiner_activity: (first_message_at, last_message_at, room_id,
+                user_id) tuples of when users posted in a room. Only users with a
+                join recorded, here or before, are updated.
+        """
+
+        # Messages may be seen out of order, so only ever move the first message
+        # earlier and the last one later
+        activity = [
+            (first, first, last, last, room_id, user_id)
+            for first, last, room_id, user_id in joiner_activity
+        ]
+
+        def run(cursor):
+            statements = (
+                (ADD_MESSAGE_COUNT, message_counts),
+                (ADD_JOIN, joins),
+                (UPDATE_JOINER_ACTIVITY, activity),
+            )
+            _executemany_in_transaction(
+                cursor,
+                [(_translate(sql, self.db_type), rows) for sql, rows in statements],
+            )
+
+        await self._run(run, "add_activity")
+
+    async def get_top_posters(
+        self, room_id: str, since_hour: int, limit: int
+    ) -> List[Tuple[str, int]]:
+        """Get the (user_id, message count) of the users that sent the most messages
+        to a room, from the given hour since the epoch onwards"""
+        return await self.fetchall(GET_TOP_POSTERS, (room_id, since_hour, limit))
+
+    async def get_hourly_message_counts(
+        self, room_id: str, since_hour: int
+    ) -> List[Tuple[int, int]]:
+        """Get the (hour, message count) of each hour that messages were sent to a
+        room in, from the given hour since the epoch onwards"""
+        return await self.fetchall(GET_HOURLY_MESSAGE_COUNTS, (room_id, since_hour))
+
+    async def get_joins(
+        self, room_id: str, since: int
+    ) -> List[Tuple[str, int, Optional[int], Optional[int]]]:
+        """Get the (user_id, joined_at, first_message_at, last_message_at) of the
+        users that joined a room from the given time onwards, in milliseconds since
+        the epoch"""
+        return await self.fetchall(GET_JOINS, (room_id, since))
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """Run a statement on the storage thread.
+
+        Args:
+            sql: The statement to run, using ? placeholders.
+
+            params: The values of the placeholders.
+
+        Returns:
+            The number of rows affected by the statement.
+        """
+        return await self._run_query(
+            sql, params, lambda cursor: cursor.rowcount, "execute"
+        )
+
+    async def executemany(self, sql: str, seq_of_params: Sequence[Sequence[Any]]) -> None:
+        """Run a statement once per set of parameters on the storage thread"""
+
+        def run(cursor):
+            cursor.executemany(_translate(sql, self.db_type), seq_of_params)
+
+        await self._run(run, "executemany")
+
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[Tuple]:
+        """Run a query on the storage thread and return its first row, if any"""
+        return await self._run_query(
+            sql, params, lambda cursor: cursor.fetchone(), "fetchone"
+        )
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[Tuple]:
+        """Run a query on the storage thread and return all of its rows"""
+        return await self._run_query(
+            sql, params, lambda cursor: cursor.fetchall(), "fetchall"
+        )
+
+    async def _run_query(
+        self,
+        sql: str,
+        params: Sequence[Any],
+        read: Callable[[Any], Any],
+        operation: str = "query",
+    ) -> Any:
+        """Run a query on the storage thread, and return the result of calling `read`
+        with its cursor."""
+
+        def run(cursor):
+            cursor.execute(_translate(sql, self.db_type), params)
+            return read(cursor)
+
+        return await self._run(run, operation)
+
+    async def _run(self, func: Callable[[Any], Any], operation: str = "query") -> Any:
+        """Call `func` with a new cursor on the storage thread, timing it as
+        `operation`.
+
+        For postgres, the call is retried once on a fresh connection if the
+        connection it was given turned out to be broken.
+        """
+
+        def run():
+            attempts = 2 if self._pool is not None else 1
+            for attempt in range(attempts):
+                try:
+                    with self._connection() as conn:
+                        cursor = conn.cursor()
+                        try:
+                            return func(cursor)
+                        finally:
+                            cursor.close()
+                except Exception as e:
+                    if attempt + 1 < attempts and _is_connection_error(e):
+                        logger.warning("Lost database connection, reconnecting: %s", e)
+                        continue
+                    raise
+
+        loop = asyncio.get_event_loop()
+        with QUERY_SECONDS.time(operation), tracing.span(f"storage.{operation}"):
+            return await loop.run_in_executor(self._executor, run)
+
+    def close(self) -> None:
+        """Wait for queued queries to finish and close the database connections"""
+        self._executor.shutdown(wait=True)
+        if self._pool is not None:
+            self._pool.closeall()
+        self.conn.close()
 
     def _execute(self, *args) -> None:
         """A wrapper around cursor.execute that transforms placeholder ?'s to %s for postgres.
 
         This allows for the support of queries that are compatible with both postgres and sqlite.
 
+        This runs on the calling thread using the shared cursor, and is meant for
+        database setup. Use the async methods from the event loop.
+
         Args:
             args: Arguments passed to cursor.execute.
         """
-        if self.db_type == "postgres":
-            self.cursor.execute(args[0].replace("?", "%s"), *args[1:])
-        else:
-            self.cursor.execute(*args)
+        self.cursor.execute(_translate(args[0], self.db_type), *args[1:])
+
+
+@lru_cache(maxsize=512)
+def _translate(sql: str, db_type: str) -> str:
+    """Transform placeholder ?'s to %s for postgres.
+
+    Statements are cached, so each one is only rewritten the first time it's used.
+    """
+    if db_type == "postgres":
+        return sql.replace("?", "%s")
+    return sql
+
+
+def _executemany_in_transaction(
+    cursor: Any, statements: Sequence[Tuple[str, Sequence[Sequence[Any]]]]
+) -> None:
+    """Run each (statement, rows) pair's statement once per row, all in a single
+    transaction rather than one each"""
+    cursor.execute("BEGIN")
+    try:
+        for sql, rows in statements:
+            if rows:
+                cursor.executemany(sql, rows)
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    cursor.execute("COMMIT")
+
+
+def _is_connection_error(e: Exception) -> bool:
+    """Whether an exception means the postgres connection itself is unusable"""
+    try:
+        import psycopg2
+    except ImportError:
+        return False
+    return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
@@ -0,0 +1,51 @@
+from typing import Any, Dict
+
+# Event types the bot acts on, or that nio needs to keep its room state correct
+# (e.g. whether a room is encrypted, and its name for display purposes)
+ROOM_EVENT_TYPES = (
+    "m.room.create",
+    "m.room.encrypted",
+    "m.room.encryption",
+    "m.room.member",
+    "m.room.message",
+    "m.room.name",
+    "m.room.canonical_alias",
+    "m.room.power_levels",
+    "m.room.join_rules",
+    "m.room.history_visibility",
+    "m.room.tombstone",
+    "m.reaction",
+)
+
+
+def build_sync_filter(lazy_load_members: bool, timeline_limit: int) -> Dict[str, Any]:
+    """Build a filter for /sync requests that only asks for what the bot uses.
+
+    Args:
+        lazy_load_members: Whether to only receive the membership events of users
+            that sent events in the timeline, rather than of every room member.
+
+        timeline_limit: The maximum number of timeline events to receive per room.
+
+    Returns:
+        A filter, as described in
+        https://spec.matrix.org/v1.8/client-server-api/#filtering
+    """
+    return {
+        # The bot has no use for presence, account data or typing notifications
+        "presence": {"not_types": ["*"]},
+        "account_data": {"not_types": ["*"]},
+        "room": {
+            "state": {
+                "types": list(ROOM_EVENT_TYPES),
+                "lazy_load_members": lazy_load_members,
+            },
+            "timeline": {
+                "types": list(ROOM_EVENT_TYPES),
+                "limit": timeline_limit,
+                "lazy_load_members": lazy_load_members,
+            },
+            "ephemeral": {"not_types": ["*"]},
+            "account_data": {"not_types": ["*"]},
+        },
+    }
@@ -0,0 +1,84 @@
+"""Summarise a file of traces into how long each stage of handling events takes.
+
+Usage: python -m bangalore_bot.trace_summary traces.jsonl [traces.jsonl ...]
+"""
+import argparse
+import json
+import logging
+import math
+import sys
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, TextIO
+
+logger = logging.getLogger(__name__)
+
+
+def stage_durations(lines: Iterable[str]) -> Dict[str, List[float]]:
+    """Collect the durations of every stage in traces, by stage name.
+
+    Each trace's handler is a stage, as is every span within it. Lines that aren't
+    valid traces are skipped.
+    """
+    durations = defaultdict(list)  # type: Dict[str, List[float]]
+
+    def add_spans(spans: List[Dict[str, Any]]) -> None:
+        for span in spans:
+            durations[span["name"]].append(span["duration"])
+            add_spans(span.get("spans", []))
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            trace = json.loads(line)
+            durations[trace["handler"]].append(trace["duration"])
+            add_spans(trace.get("spans", []))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Skipping invalid trace on line %d: %s", number, e)
+
+    return durations
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """The nearest-rank percentile of sorted values"""
+    rank = max(math.ceil(fraction * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarise(durations: Dict[str, List[float]], output: TextIO) -> None:
+    """Print the count and p50/p95/p99 durations of each stage, in milliseconds,
+    with the stages taking the most time in total first"""
+    stages = sorted(durations.items(), key=lambda item: -sum(item[1]))
+    width = max([len(name) for name in durations] + [len("stage")])
+
+    output.write(
+        f"{'stage':<{width}} {'count':>8} {'p50 ms':>10} {'p95 ms':>10} "
+        f"{'p99 ms':>10}\n"
+    )
+    for name, values in stages:
+        values = sorted(values)
+        p50, p95, p99 = (percentile(values, f) * 1000 for f in (0.5, 0.95, 0.99))
+        output.write(
+            f"{name:<{width}} {len(values):>8} {p50:>10.1f} {p95:>10.1f} {p99:>10.1f}\n"
+        )
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="Files of traces written by the bot")
+    args = parser.parse_args(argv)
+
+    durations = defaultdict(list)  # type: Dict[str, List[float]]
+    for path in args.paths:
+        with open(path) as f:
+            for name, values in stage_durations(f).items():
+                durations[name].extend(values)
+
+    if not durations:
+        print("No traces found", file=sys.stderr)
+        sys.exit(1)
+    summarise(durations, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import functools
+import json
+import logging
+import random
+import time
+import uuid
+from typing import IO, Any, Awaitable, Callable, Dict, List, Optional
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    # Python 3.6, where tracing isn't supported
+    ContextVar = None
+
+logger = logging.getLogger(__name__)
+
+
+class _NoContextVar:
+    """Stands in for the current span's ContextVar where there is none, as if no
+    event were ever being traced"""
+
+    def get(self) -> None:
+        return None
+
+    def set(self, value: Any) -> None:
+        return None
+
+    def reset(self, token: Any) -> None:
+        pass
+
+
+# The span that new spans are nested under, if the current event is being traced
+if ContextVar is not None:
+    _current = ContextVar("current_span", default=None)  # type: Any
+else:
+    _current = _NoContextVar()
+
+# Where finished traces are written, set up by `configure`
+_tracer = None  # type: Optional[Tracer]
+
+
+class Tracer:
+    def __init__(
+        self,
+        output: IO[str],
+        sample_rate: float = 1.0,
+        rng: Callable[[], float] = random.random,
+    ):
+        """Writes finished traces to a file, one JSON object per line.
+
+        Args:
+            output: The file to write to.
+
+            sample_rate: The fraction of events to trace, between 0 and 1.
+
+            rng: Returns a random float in [0, 1).
+        """
+        self.output = output
+        self.sample_rate = sample_rate
+        self.rng = rng
+
+    def sample(self) -> bool:
+        """Decide whether to trace an event"""
+        return self.rng() < self.sample_rate
+
+    def write(self, trace: "Trace") -> None:
+        self.output.write(json.dumps(trace.to_dict()) + "\n")
+        self.output.flush()
+
+
+class Span:
+    __slots__ = ("trace", "name", "start", "duration", "children")
+
+    def __init__(
+        self, trace: "Trace", name: str, start: float, duration: float = 0.0
+    ):
+        """A timed stage of handling an event, with the stages it's made up of"""
+        self.trace = trace
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.children = []  # type: List[Span]
+
+    def to_dict(self, trace_start: float) -> Dict[str, Any]:
+        result = {
+            "name": self.name,
+            "start": round(self.start - trace_start, 6),
+            "duration": round(self.duration, 6),
+        }  # type: Dict[str, Any]
+        if self.children:
+            result["spans"] = [child.to_dict(trace_start) for child in self.children]
+        return result
+
+
+class Trace:
+    def __init__(
+        self,
+        tracer: Tracer,
+        handler: str,
+        event_id: Optional[str],
+        room_id: Optional[str],
+    ):
+        """The spans of handling one event.
+
+        The trace is written once its root span has finished and all the work
+        carried on from it with `carry` has finished too.
+        """
+        self.tracer = tracer
+        self.trace_id = uuid.uuid4().hex
+        self.timestamp = time.time()
+        self.handler = handler
+        self.event_id = event_id
+        self.room_id = room_id
+        self.root = Span(self, handler, time.perf_counter())
+        self._pending = 1
+
+    def hold(self) -> None:
+        """Keep the trace open until a matching `release`"""
+        self._pending += 1
+
+    def release(self) -> None:
+        self._pending -= 1
+        if self._pending == 0:
+            try:
+                self.tracer.write(self)
+            except (OSError, ValueError) as e:
+                logger.warning("Unable to write trace: %s", e)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "timestamp": self.timestamp,
+            "event_id": self.event_id,
+            "room_id": self.room_id,
+            "handler": self.handler,
+            "duration": round(self.root.duration, 6),
+            "spans": [child.to_dict(self.root.start) for child in self.root.children],
+        }
+
+
+def configure(tracer: Optional[Tracer]) -> None:
+    """Set where traces are written, or stop tracing with None.
+
+    Tracing needs Python 3.7 or above, and stays off on older versions.
+    """
+    global _tracer
+    if tracer is not None and ContextVar is None:
+        logger.warning("Tracing needs Python 3.7 or above, so is turned off")
+        return
+    _tracer = tracer
+
+
+def trace(
+    handler: str, event_id: Optional[str] = None, room_id: Optional[str] = None
+) -> Any:
+    """A context manager tracing the handling of an event, if it's sampled.
+
+    Inside an event that's already being traced, this is the same as `span`.
+
+    Args:
+        handler: What is handling the event, e.g. the name of the callback.
+
+        event_id: The ID of the event being handled.
+
+        room_id: The ID of the room the event was sent in.
+    """
+    if _current.get() is not None:
+        return span(handler)
+    if _tracer is None or not _tracer.sample():
+        return _NO_SPAN
+    return _RootSpan(Trace(_tracer, handler, event_id, room_id))
+
+
+def span(name: str) -> Any:
+    """A context manager timing a stage of handling the current event, if it's
+    being traced. Otherwise it does nothing."""
+    parent = _current.get()
+    if parent is None:
+        return _NO_SPAN
+    return _ChildSpan(parent, name)
+
+
+def record(name: str, start: float, end: float) -> None:
+    """Add a stage that has already finished to the current span.
+
+    Args:
+        name: The name of the stage.
+
+        start: When the stage started, from `time.perf_counter`.
+
+        end: When the stage finished, from `time.perf_counter`.
+    """
+    parent = _current.get()
+    if parent is not None:
+        parent.children.append(Span(parent.trace, name, start, end - start))
+
+
+def traced(name: str) -> Callable:
+    """A decorator wrapping every call of an async function in a span"""
+
+    def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def carry(job: Callable[[], Awaitable[Any]]) -> "CarriedJob":
+    """Wrap a job that will be run later, e.g. by a worker task, so that it's traced
+    as part of the current event. How long it waited is recorded as "queued".
+
+    The current event's trace is kept open until the job has run, so if the job
+    ends up never being run, `CarriedJob.discard` must be called instead.
+
+    The job is always run outside of whatever the worker was tracing before.
+    """
+    return CarriedJob(job, _current.get())
+
+
+class CarriedJob:
+    __slots__ = ("job", "parent", "queued_at", "finished")
+
+    def __init__(self, job: Callable[[], Awaitable[Any]], parent: Optional[Span]):
+        """A job carrying on the trace of the event it was created for. Made by
+        `carry`"""
+        self.job = job
+        self.parent = parent
+        self.queued_at = time.perf_counter()
+        self.finished = False
+        if parent is not None:
+            parent.trace.hold()
+
+    async def __call__(self) -> Any:
+        token = _current.set(self.parent)
+        try:
+            if self.parent is not None:
+                record("queued", self.queued_at, time.perf_counter())
+            return await self.job()
+        finally:
+            _current.reset(token)
+            self._finish()
+
+    def discard(self) -> None:
+        """Give up on running the job, such as when a queue rejected it. This is
+        recorded in the trace as "discarded", after how long it was queued for"""
+        if self.parent is not None and not self.finished:
+            now = time.perf_counter()
+            trace = self.parent.trace
+            self.parent.children.append(
+                Span(trace, "discarded", self.queued_at, now - self.queued_at)
+            )
+        self._finish()
+
+    def _finish(self) -> None:
+        if self.parent is not None and not self.finished:
+            self.finished = True
+            self.parent.trace.release()
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _ChildSpan:
+    __slots__ = ("parent", "span", "token")
+
+    def __init__(self, parent: Span, name: str):
+        self.parent = parent
+        self.span = Span(parent.trace, name, 0.0)
+
+    def __enter__(self) -> Span:
+        self.parent.children.append(self.span)
+        self.token = _current.set(self.span)
+        self.span.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, *exc_info) -> None:
+        self.span.duration = time.perf_counter() - self.span.start
+        _current.reset(self.token)
+
+
+class _RootSpan:
+    __slots__ = ("trace", "token")
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+
+    def __enter__(self) -> Span:
+        root = self.trace.root
+        self.token = _current.set(root)
+        root.start = time.perf_counter()
+        return root
+
+    def __exit__(self, *exc_info) -> None:
+        root = self.trace.root
+        root.duration = time.perf_counter() - root.start
+        _current.reset(self.token)
+        self.trace.release()
@@ -0,0 +1,186 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Sequence, Set, Tuple
+
+from bangalore_bot.errors import ConfigError
+
+# Actions that a trigger can perform instead of replying with text
+ACTIONS = ("tag_admins",)
+
+
+class Trigger:
+    __slots__ = ("keyword", "pattern", "response", "action")
+
+    def __init__(
+        self,
+        keyword: Optional[str] = None,
+        pattern: Optional[str] = None,
+        response: Optional[str] = None,
+        action: Optional[str] = None,
+    ):
+        """An automatic response to messages containing a keyword or matching a
+        pattern.
+
+        Args:
+            keyword: Text matched literally, case-insensitively and as whole words.
+
+            pattern: A regular expression, matched case-insensitively. Used if no
+                keyword is given.
+
+            response: The text to reply with.
+
+            action: The name of an action to perform instead, one of `ACTIONS`.
+        """
+        self.keyword = keyword
+        self.pattern = pattern
+        self.response = response
+        self.action = action
+
+
+class TriggerEngine:
+    def __init__(self, triggers: Sequence[Trigger]):
+        """Matches messages against many triggers at once.
+
+        Keywords are merged into a trie and compiled into a single regex, so a
+        message is scanned once for all of them and their cost doesn't grow with
+        their number. Regex triggers are each searched for separately, so that a
+        greedy one can't hide a keyword or another regex inside the text it
+        matches.
+
+        Keywords are found left to right without overlapping, so where several
+        keywords match at the same position only the longest one counts there.
+
+        Args:
+            triggers: The triggers to match. Their regexes must be valid.
+        """
+        self.triggers = tuple(triggers)
+        # Where each trigger is in the config, by id
+        self._order = {id(trigger): i for i, trigger in enumerate(self.triggers)}
+
+        # Keyed by the casefolded keyword, which is what matched text is looked up
+        # by
+        self._keywords = {}  # type: Dict[str, Trigger]
+        for trigger in self.triggers:
+            if trigger.keyword is not None:
+                self._keywords.setdefault(trigger.keyword.casefold(), trigger)
+        self._keyword_regex = None  # type: Optional[Pattern[str]]
+        if self._keywords:
+            words = (trigger.keyword.lower() for trigger in self._keywords.values())
+            self._keyword_regex = re.compile(
+                r"(?<!\w)" + _trie_regex(words) + r"(?!\w)", re.IGNORECASE
+            )
+
+        self._patterns = [
+            (re.compile(trigger.pattern, re.IGNORECASE), trigger)
+            for trigger in self.triggers
+            if trigger.keyword is None
+        ]  # type: List[Tuple[Pattern[str], Trigger]]
+
+    @classmethod
+    def from_config(cls, config: Optional[List[Dict[str, Any]]]) -> "TriggerEngine":
+        """Build the engine from the `triggers` config option.
+
+        Each entry has either a `keyword` or a `regex`, plus either a `response` or
+        an `action`.
+
+        Raises:
+            ConfigError: If an entry is invalid.
+        """
+        triggers = []
+        for i, entry in enumerate(config or []):
+            if not isinstance(entry, dict):
+                raise ConfigError(f"triggers[{i}] must be a mapping")
+
+            keyword = pattern = None
+            if "keyword" in entry:
+                keyword = str(entry["keyword"])
+            elif "regex" in entry:
+                pattern = entry["regex"]
+                try:
+                    re.compile(pattern, re.IGNORECASE)
+                except (re.error, TypeError) as e:
+                    raise ConfigError(
+                        f"triggers[{i}].regex {pattern!r} is invalid: {e}"
+                    )
+            else:
+                raise ConfigError(f"triggers[{i}] needs a keyword or a regex")
+
+            response = entry.get("response")
+            action = entry.get("action")
+            if (response is None) == (action is None):
+                raise ConfigError(f"triggers[{i}] needs either a response or an action")
+            if action is not None and action not in ACTIONS:
+                raise ConfigError(
+                    f"triggers[{i}].action must be one of: {', '.join(ACTIONS)}"
+                )
+
+            triggers.append(Trigger(keyword, pattern, response, action))
+
+        return cls(triggers)
+
+    def match(self, text: str) -> List[Trigger]:
+        """Find the triggers matching a message, in the order they first appear in
+        it.
+
+        Each trigger is returned at most once.
+        """
+        # (position, trigger number, trigger), so that triggers matching at the
+        # same position keep their order in the config
+        found = []  # type: List[Tuple[int, int, Trigger]]
+        seen = set()  # type: Set[int]
+        order = self._order
+
+        if self._keyword_regex is not None:
+            for match in self._keyword_regex.finditer(text):
+                trigger = self._find_keyword(match.group())
+                if trigger is not None and id(trigger) not in seen:
+                    seen.add(id(trigger))
+                    found.append((match.start(), order[id(trigger)], trigger))
+
+        for regex, trigger in self._patterns:
+            match = regex.search(text)
+            if match is not None:
+                found.append((match.start(), order[id(trigger)], trigger))
+
+        found.sort(key=lambda item: item[:2])
+        return [trigger for _, _, trigger in found]
+
+    def _find_keyword(self, matched: str) -> Optional[Trigger]:
+        """Get the keyword trigger that matched some text"""
+        trigger = self._keywords.get(matched.casefold())
+        if trigger is None:
+            # Case-insensitive matching and casefolding can disagree for a few
+            # characters, so fall back to matching each keyword the same way the
+            # trie did
+            for keyword_trigger in self._keywords.values():
+                if re.fullmatch(
+                    re.escape(keyword_trigger.keyword.lower()), matched, re.IGNORECASE
+                ):
+                    return keyword_trigger
+        return trigger
+
+
+def _trie_regex(words: Iterable[str]) -> str:
+    """Build a regex matching any of the given words, factored into a trie so that
+    shared prefixes are only matched once. Longer words are preferred."""
+    trie = {}  # type: Dict[str, Any]
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def to_regex(node: Dict[str, Any]) -> str:
+        branches = [
+            re.escape(char) + to_regex(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        ends_here = "" in node
+        if len(branches) == 1 and not ends_here:
+            return branches[0]
+        regex = "(?:" + "|".join(branches) + ")"
+        return regex + "?" if ends_here else regex
+
+    return to_regex(trie)
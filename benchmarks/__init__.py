@@ -0,0 +1,2 @@
+# Benchmarks for the bot's hot paths. Run each one from the repository root with
+# `python -m benchmarks.<name>`.
@@ -0,0 +1,128 @@
+"""Measure archiving messages at high message rates.
+
+Feeds messages at fixed rates into a temporary sqlite database, either inserting
+each one as it arrives or through `MessageArchiver`'s batched writes, then reports
+how many messages a second were written and how late the event loop woke up while
+they were.
+
+Usage: python -m benchmarks.archive [--duration 5] [--rates 1000 5000 20000]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from typing import List
+
+from nio import RoomMessageText
+
+from bangalore_bot.archive import MessageArchiver
+from bangalore_bot.storage import INSERT_MESSAGE, Storage
+
+from benchmarks.load_test import describe, measure_loop_lag
+
+# How often messages are fed in, in seconds. Each tick adds a rate's worth
+TICK = 0.01
+
+
+def make_messages(count: int) -> List[RoomMessageText]:
+    return [
+        RoomMessageText.from_dict(
+            {
+                "type": "m.room.message",
+                "event_id": f"$event{i}",
+                "sender": f"@user{i % 100}:example.com",
+                "origin_server_ts": 1700000000000 + i,
+                "content": {"msgtype": "m.text", "body": f"Message number {i}"},
+            }
+        )
+        for i in range(count)
+    ]
+
+
+class PerMessage:
+    """Insert each message as it arrives, as a query of its own"""
+
+    def __init__(self, store: Storage):
+        self.store = store
+        self.pending = set()
+
+    def start(self):
+        pass
+
+    def add(self, room_id: str, event: RoomMessageText) -> None:
+        task = asyncio.ensure_future(
+            self.store.execute(
+                INSERT_MESSAGE,
+                (
+                    event.event_id,
+                    room_id,
+                    event.sender,
+                    event.body,
+                    event.server_timestamp,
+                ),
+            )
+        )
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def close(self):
+        await asyncio.gather(*self.pending)
+
+
+async def feed(archiver, messages: List[RoomMessageText], rate: int) -> None:
+    """Add messages to the archiver at a rate, catching up if the loop falls
+    behind"""
+    start = time.perf_counter()
+    added = 0
+    while added < len(messages):
+        due = min(len(messages), int((time.perf_counter() - start) * rate) + 1)
+        for event in messages[added:due]:
+            archiver.add(f"!room{added % 20}:example.com", event)
+            added += 1
+        await asyncio.sleep(TICK)
+
+
+async def run(name: str, rate: int, duration: float) -> None:
+    directory = tempfile.mkdtemp()
+    store = Storage(
+        {"type": "sqlite", "connection_string": os.path.join(directory, "bot.db")}
+    )
+    messages = make_messages(int(rate * duration))
+    archiver = MessageArchiver(store) if name == "batched" else PerMessage(store)
+
+    lags = []  # type: List[float]
+    lag_task = asyncio.ensure_future(measure_loop_lag(lags))
+    archiver.start()
+
+    start = time.perf_counter()
+    await feed(archiver, messages, rate)
+    await archiver.close()
+    elapsed = time.perf_counter() - start
+
+    lag_task.cancel()
+    await asyncio.gather(lag_task, return_exceptions=True)
+    (written,) = await store.fetchone("SELECT COUNT(*) FROM messages")
+    store.close()
+    shutil.rmtree(directory)
+
+    print(
+        f"{rate:>6}/s {name:>11}: {written / elapsed:8.0f} messages/s written, "
+        f"loop lag {describe(lags)}, max {max(lags or [0]) * 1000:.1f} ms"
+    )
+
+
+async def main(args) -> None:
+    for rate in args.rates:
+        for name in ("per-message", "batched"):
+            await run(name, rate, args.duration)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5, help="Seconds")
+    parser.add_argument(
+        "--rates", type=int, nargs="+", default=[1000, 5000, 20000], help="Per second"
+    )
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
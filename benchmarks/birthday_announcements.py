@@ -0,0 +1,83 @@
+"""Compare the time taken to announce the day's birthdays.
+
+Sends the announcements for 1, 10 and 100 birthdays across several rooms to the
+fake homeserver from `benchmarks.homeserver`, the way `daily_task` used to (one
+message per person, each room in turn) and with `announce_birthdays` (one message
+per room, rooms at once). Every message goes through the send queue with its
+typing delay, which is shortened so the old way finishes in reasonable time; both
+times scale with it.
+
+Usage: python -m benchmarks.birthday_announcements [--rooms 5] [--typing-delay 0.05]
+"""
+import argparse
+import asyncio
+import time
+
+from nio import AsyncClient, AsyncClientConfig
+
+from bangalore_bot.announcements import announce_birthdays
+from bangalore_bot.chat_functions import make_pill, send_text_to_room
+from bangalore_bot.send_queue import SendQueue, set_send_queue
+
+from benchmarks.homeserver import BOT_USER, FakeHomeserver
+
+
+async def announce_sequentially(client, room_ids, user_ids):
+    """How birthdays were announced before: a message per person, one at a time"""
+    for room_id in room_ids:
+        for user_id in user_ids:
+            await send_text_to_room(
+                client, room_id, f"{make_pill(user_id)}'s birthday is today🎉"
+            )
+
+
+async def time_announcement(announce, rooms: int, birthdays: int, delay: float):
+    server = FakeHomeserver(echo=False)
+    await server.start()
+    client = AsyncClient(
+        server.url,
+        BOT_USER,
+        config=AsyncClientConfig(encryption_enabled=False, store_sync_tokens=False),
+    )
+    client.access_token = "token"
+    client.user_id = BOT_USER
+    queue = SendQueue(client, (delay, delay))
+    set_send_queue(client, queue)
+
+    room_ids = [f"!room{i}:example.com" for i in range(rooms)]
+    user_ids = [f"@user{i}:example.com" for i in range(birthdays)]
+
+    start = time.perf_counter()
+    await announce(client, room_ids, user_ids)
+    elapsed = time.perf_counter() - start
+
+    # The send queue stops typing after the last message in a room has been sent
+    while server.typing:
+        await asyncio.sleep(0.01)
+    await queue.close()
+    await client.close()
+    await server.close()
+    return elapsed, len(server.sent)
+
+
+async def main(args):
+    print(f"{args.rooms} rooms, {args.typing_delay}s typing delay per message")
+    for birthdays in (1, 10, 100):
+        for name, announce in (
+            ("sequential", announce_sequentially),
+            ("batched", announce_birthdays),
+        ):
+            elapsed, sent = await time_announcement(
+                announce, args.rooms, birthdays, args.typing_delay
+            )
+            print(
+                f"{birthdays:>4} birthdays, {name:>10}: {elapsed:7.2f} s, "
+                f"{sent:>4} messages"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--typing-delay", type=float, default=0.05, help="Seconds")
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,52 @@
+"""Measure the cost of finding a command's handler as the number of commands grows.
+
+Compares a chain of `str.startswith` checks, as Command.process used to do, with a
+lookup in a CommandRegistry. The command looked up is the last one registered,
+which is the worst case for the chain.
+
+Usage: python -m benchmarks.command_dispatch
+"""
+import timeit
+
+from bangalore_bot.command_registry import CommandRegistry, CommandSpec
+
+
+async def handler(command):
+    pass
+
+
+def startswith_chain(names, command):
+    for name in names:
+        if command.startswith(name):
+            return name
+    return None
+
+
+def registry_lookup(registry, command):
+    words = command.split(maxsplit=1)
+    return registry.get(words[0]) if words else None
+
+
+def main():
+    print(f"{'commands':>8} {'startswith':>14} {'registry':>14}")
+    for count in (5, 10, 50, 100, 500):
+        names = [f"command{i:04d}" for i in range(count)]
+        registry = CommandRegistry()
+        for name in names:
+            registry.add(CommandSpec(name, handler))
+        command = f"{names[-1]} some arguments here"
+
+        number = 100000
+        chain = timeit.timeit(
+            lambda: startswith_chain(names, command), number=number
+        )
+        lookup = timeit.timeit(
+            lambda: registry_lookup(registry, command), number=number
+        )
+        print(
+            f"{count:>8} {chain / number * 1e9:>11.0f} ns {lookup / number * 1e9:>11.0f} ns"
+        )
+
+
+if __name__ == "__main__":
+    main()
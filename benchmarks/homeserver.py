@@ -0,0 +1,291 @@
+"""An in-process fake Matrix homeserver for benchmarks.
+
+Serves just enough of the client-server API for the bot to run against it: /sync
+(long polling), sending events, typing notifications and fetching events. Events
+are injected by the benchmark, and everything the bot sends is recorded along with
+how long after the event it replied to was injected.
+"""
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+
+BOT_USER = "@bot:example.com"
+
+
+class SentEvent:
+    __slots__ = ("time", "room_id", "type", "content")
+
+    def __init__(
+        self, time: float, room_id: str, type: str, content: Dict[str, Any]
+    ):
+        self.time = time
+        self.room_id = room_id
+        self.type = type
+        self.content = content
+
+
+class FakeHomeserver:
+    def __init__(self, bot_user: str = BOT_USER, echo: bool = True):
+        """
+        Args:
+            bot_user: The user ID the bot logs in as.
+
+            echo: Whether events the bot sends are returned in its next sync, as a
+                real homeserver does.
+        """
+        self.bot_user = bot_user
+        self.echo = echo
+        self.url = ""
+
+        # Rooms and their members, sent in the initial sync
+        self._rooms = {}  # type: Dict[str, List[str]]
+        # Every timeline event, in order. A sync token is an index into this
+        self._timeline = []  # type: List[Tuple[str, Dict[str, Any]]]
+        self._new_events = asyncio.Condition()
+        self._events = {}  # type: Dict[str, Dict[str, Any]]
+        self._next_id = 0
+        # The IDs of the messages the bot sent, by room
+        self._bot_messages = defaultdict(list)  # type: Dict[str, List[str]]
+
+        # When each event was injected, to match up with replies to it
+        self._injected_at = {}  # type: Dict[str, float]
+        # When users joined, to match up with the messages welcoming them
+        self._joined_at = {}  # type: Dict[str, float]
+        # When reactions to each bot event were injected, oldest first
+        self._reacted_at = defaultdict(deque)  # type: Dict[str, Deque[float]]
+
+        self.sent = []  # type: List[SentEvent]
+        # Seconds from injecting an event until the bot replied to it, by kind
+        self.latencies = defaultdict(list)  # type: Dict[str, List[float]]
+        self.syncs = 0
+        # The rooms the bot is currently shown as typing in
+        self.typing = set()  # type: Set[str]
+
+        self._runner = None  # type: Optional[web.AppRunner]
+
+    async def start(self) -> None:
+        """Start listening on a free local port, setting `url`"""
+        app = web.Application()
+        prefix = "/_matrix/client/{version}"
+        app.router.add_get("/_matrix/client/versions", self._versions)
+        app.router.add_get(prefix + "/sync", self._sync)
+        app.router.add_put(
+            prefix + "/rooms/{room_id}/send/{event_type}/{txn_id}", self._send
+        )
+        app.router.add_put(prefix + "/rooms/{room_id}/typing/{user_id}", self._typing)
+        app.router.add_get(prefix + "/rooms/{room_id}/event/{event_id}", self._event)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def add_room(self, room_id: str, members: List[str]) -> None:
+        """Add a room the bot is in, before the bot first syncs"""
+        self._rooms[room_id] = [self.bot_user] + list(members)
+
+    async def inject_message(self, room_id: str, sender: str, body: str) -> str:
+        """Send a text message to a room as a user, returning its event ID"""
+        return await self._inject(
+            room_id,
+            {
+                "type": "m.room.message",
+                "sender": sender,
+                "content": {"msgtype": "m.text", "body": body},
+            },
+        )
+
+    async def inject_join(self, room_id: str, user_id: str) -> str:
+        """Make a user that was invited to a room join it"""
+        self._joined_at[user_id] = time.perf_counter()
+        return await self._inject(
+            room_id,
+            {
+                "type": "m.room.member",
+                "sender": user_id,
+                "state_key": user_id,
+                "content": {"membership": "join", "displayname": user_id[1:8]},
+                "unsigned": {"prev_content": {"membership": "invite"}},
+            },
+        )
+
+    async def inject_reaction(
+        self, room_id: str, sender: str, event_id: str, key: str
+    ) -> str:
+        """React to an event as a user"""
+        self._reacted_at[event_id].append(time.perf_counter())
+        return await self._inject(
+            room_id,
+            {
+                "type": "m.reaction",
+                "sender": sender,
+                "content": {
+                    "m.relates_to": {
+                        "rel_type": "m.annotation",
+                        "event_id": event_id,
+                        "key": key,
+                    }
+                },
+            },
+        )
+
+    def bot_messages(self, room_id: str) -> List[str]:
+        """The IDs of the messages the bot has sent to a room"""
+        return self._bot_messages[room_id]
+
+    async def _inject(self, room_id: str, event: Dict[str, Any]) -> str:
+        event_id = self._add_event(room_id, event)
+        self._injected_at[event_id] = time.perf_counter()
+        async with self._new_events:
+            self._new_events.notify_all()
+        return event_id
+
+    def _add_event(self, room_id: str, event: Dict[str, Any]) -> str:
+        self._next_id += 1
+        event_id = f"$event{self._next_id}"
+        event = dict(
+            event,
+            event_id=event_id,
+            room_id=room_id,
+            origin_server_ts=int(time.time() * 1000),
+        )
+        self._events[event_id] = event
+        self._timeline.append((room_id, event))
+        return event_id
+
+    async def _versions(self, request: web.Request) -> web.Response:
+        return web.json_response({"versions": ["v1.1", "v1.8"]})
+
+    async def _sync(self, request: web.Request) -> web.Response:
+        self.syncs += 1
+        since = request.query.get("since")
+        if since is None:
+            return web.json_response(self._initial_sync())
+
+        position = int(since)
+        timeout = int(request.query.get("timeout", 0)) / 1000
+        if position >= len(self._timeline) and timeout:
+            async with self._new_events:
+                try:
+                    await asyncio.wait_for(
+                        self._new_events.wait_for(
+                            lambda: len(self._timeline) > position
+                        ),
+                        timeout,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+        join = {}  # type: Dict[str, Dict[str, Any]]
+        for room_id, event in self._timeline[position:]:
+            room = join.setdefault(room_id, _room(timeline=[]))
+            room["timeline"]["events"].append(event)
+        return web.json_response(_sync_response(len(self._timeline), join))
+
+    def _initial_sync(self) -> Dict[str, Any]:
+        join = {}
+        for room_id, members in self._rooms.items():
+            state = [
+                {
+                    "type": "m.room.create",
+                    "state_key": "",
+                    "sender": self.bot_user,
+                    "event_id": f"$create-{room_id}",
+                    "origin_server_ts": 0,
+                    "content": {"creator": self.bot_user},
+                }
+            ]
+            for user_id in members:
+                state.append(
+                    {
+                        "type": "m.room.member",
+                        "state_key": user_id,
+                        "sender": user_id,
+                        "event_id": f"$member-{room_id}-{user_id}",
+                        "origin_server_ts": 0,
+                        "content": {"membership": "join"},
+                    }
+                )
+            join[room_id] = _room(timeline=[], state=state)
+        return _sync_response(len(self._timeline), join)
+
+    async def _send(self, request: web.Request) -> web.Response:
+        now = time.perf_counter()
+        room_id = request.match_info["room_id"]
+        event_type = request.match_info["event_type"]
+        content = await request.json()
+        self.sent.append(SentEvent(now, room_id, event_type, content))
+        self._record_latency(now, content)
+
+        event = {"type": event_type, "sender": self.bot_user, "content": content}
+        if self.echo:
+            event_id = self._add_event(room_id, event)
+            async with self._new_events:
+                self._new_events.notify_all()
+        else:
+            self._next_id += 1
+            event_id = f"$event{self._next_id}"
+            self._events[event_id] = dict(event, event_id=event_id, room_id=room_id)
+        if event_type == "m.room.message":
+            self._bot_messages[room_id].append(event_id)
+        return web.json_response({"event_id": event_id})
+
+    def _record_latency(self, now: float, content: Dict[str, Any]) -> None:
+        reply_to = (
+            content.get("m.relates_to", {}).get("m.in_reply_to", {}).get("event_id")
+        )
+        if reply_to in self._injected_at:
+            self.latencies["command"].append(now - self._injected_at.pop(reply_to))
+        elif reply_to in self._reacted_at and self._reacted_at[reply_to]:
+            reacted_at = self._reacted_at[reply_to].popleft()
+            self.latencies["reaction"].append(now - reacted_at)
+
+        for user_id in content.get("m.mentions", {}).get("user_ids", []):
+            if user_id in self._joined_at:
+                self.latencies["welcome"].append(now - self._joined_at.pop(user_id))
+
+    async def _typing(self, request: web.Request) -> web.Response:
+        room_id = request.match_info["room_id"]
+        if (await request.json()).get("typing"):
+            self.typing.add(room_id)
+        else:
+            self.typing.discard(room_id)
+        return web.json_response({})
+
+    async def _event(self, request: web.Request) -> web.Response:
+        event = self._events.get(request.match_info["event_id"])
+        if event is None:
+            return web.json_response(
+                {"errcode": "M_NOT_FOUND", "error": "Event not found"}, status=404
+            )
+        return web.json_response(event)
+
+
+def _room(timeline: List[Dict[str, Any]], state: List[Dict[str, Any]] = ()):
+    return {
+        "state": {"events": list(state)},
+        "timeline": {"events": timeline, "limited": False},
+        "ephemeral": {"events": []},
+        "account_data": {"events": []},
+    }
+
+
+def _sync_response(next_batch: int, join: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "next_batch": str(next_batch),
+        "rooms": {"join": join, "invite": {}, "leave": {}},
+        "presence": {"events": []},
+        "account_data": {"events": []},
+        "to_device": {"events": []},
+        "device_lists": {"changed": [], "left": []},
+        "device_one_time_keys_count": {},
+    }
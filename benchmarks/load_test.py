@@ -0,0 +1,248 @@
+"""Load test the bot against a fake homeserver.
+
+Runs the bot's real callbacks, commands, storage and send queue against the
+in-process homeserver from `benchmarks.homeserver`, replays synthetic traffic at
+fixed rates across many rooms, then reports throughput, how long replies took, and
+event loop lag. Run it before and after a change to compare.
+
+Usage: python -m benchmarks.load_test [--rooms 20] [--duration 10]
+    [--command-rate 50] [--join-rate 5] [--reaction-rate 10]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import yaml
+from nio import (
+    AsyncClient,
+    AsyncClientConfig,
+    PowerLevelsEvent,
+    RoomMemberEvent,
+    RoomMessageText,
+    UnknownEvent,
+)
+
+from bangalore_bot.admin_roster import AdminRoster
+from bangalore_bot.callbacks import Callbacks, timed
+from bangalore_bot.config import Config
+from bangalore_bot.executor import CommandExecutor
+from bangalore_bot.rate_limit import RateLimiter
+from bangalore_bot.send_queue import SendQueue, set_send_queue
+from bangalore_bot.storage import Storage
+from bangalore_bot.trace_summary import percentile
+
+from benchmarks.homeserver import BOT_USER, FakeHomeserver
+
+# Commands that reply to the message they were sent in
+COMMANDS = ("!8ball will it be fast?", "!help", "!help commands", "!rules")
+
+
+def write_config(directory: str, homeserver_url: str, args) -> str:
+    """Write a config for the bot to talk to the fake homeserver"""
+    config = {
+        "command_prefix": "!",
+        "matrix": {
+            "user_id": BOT_USER,
+            "user_token": "token",
+            "device_id": "BENCHMARK",
+            "homeserver_url": homeserver_url,
+        },
+        "storage": {
+            "database": f"sqlite://{os.path.join(directory, 'bot.db')}",
+            "store_path": os.path.join(directory, "store"),
+        },
+        "messages": {"typing_delay_min": 0, "typing_delay_max": 0},
+        "commands": {"concurrency": args.concurrency, "max_queue": args.max_queue},
+        "logging": {
+            "level": "WARNING",
+            "file_logging": {"enabled": False},
+            "console_logging": {"enabled": False},
+        },
+    }
+    path = os.path.join(directory, "config.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+async def run_at_rate(rate: float, duration: float, inject: Callable) -> int:
+    """Call `inject` `rate` times a second for `duration` seconds, catching up if
+    the loop falls behind. Returns the number of calls."""
+    if rate <= 0:
+        return 0
+    start = time.perf_counter()
+    count = 0
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return count
+        while count < elapsed * rate:
+            await inject()
+            count += 1
+        await asyncio.sleep(1 / rate)
+
+
+async def measure_loop_lag(lags: List[float], interval: float = 0.01) -> None:
+    """Record how late the loop wakes up from sleeps, until cancelled"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+def describe(values: List[float]) -> str:
+    if not values:
+        return "none"
+    values = sorted(values)
+    p50, p95, p99 = (percentile(values, f) * 1000 for f in (0.5, 0.95, 0.99))
+    return f"p50 {p50:7.1f} ms, p95 {p95:7.1f} ms, p99 {p99:7.1f} ms"
+
+
+async def run(args) -> None:
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp()
+    server = FakeHomeserver()
+    await server.start()
+
+    rooms = [f"!room{i}:example.com" for i in range(args.rooms)]
+    users = [f"@user{i}:example.com" for i in range(args.users)]
+    for room_id in rooms:
+        server.add_room(room_id, users)
+    # Welcome messages are only sent in the main room
+    os.environ["MAIN_ROOM"] = rooms[0]
+
+    config = Config(write_config(directory, server.url, args))
+    store = Storage(config.database)
+    client = AsyncClient(
+        config.homeserver_url,
+        config.user_id,
+        device_id=config.device_id,
+        config=AsyncClientConfig(encryption_enabled=False, store_sync_tokens=False),
+    )
+    client.access_token = config.user_token
+    client.user_id = config.user_id
+
+    # Wire the bot up the same way as `main`
+    set_send_queue(client, SendQueue(client, config.typing_delay))
+    executor = CommandExecutor(config.command_concurrency, config.command_max_queue)
+    callbacks = Callbacks(
+        client,
+        store,
+        config,
+        admin_roster=AdminRoster(
+            config.admin_power_level, config.admin_exclude_pattern
+        ),
+        rate_limiter=RateLimiter(config.rate_limits),
+        executor=executor,
+    )
+    client.add_event_callback(timed(callbacks.message), (RoomMessageText,))
+    client.add_event_callback(timed(callbacks.user_invited), (RoomMemberEvent,))
+    client.add_event_callback(timed(callbacks.power_levels), (PowerLevelsEvent,))
+    client.add_event_callback(timed(callbacks.unknown), (UnknownEvent,))
+
+    sync_task = asyncio.ensure_future(client.sync_forever(timeout=30000))
+    while server.syncs < 2:
+        await asyncio.sleep(0.01)
+
+    async def command():
+        await server.inject_message(
+            rng.choice(rooms), rng.choice(users), rng.choice(COMMANDS)
+        )
+
+    joined = 0
+
+    async def join():
+        nonlocal joined
+        joined += 1
+        await server.inject_join(rooms[0], f"@newcomer{joined}:example.com")
+
+    async def reaction():
+        room_id = rng.choice(rooms)
+        targets = server.bot_messages(room_id)
+        if targets:
+            await server.inject_reaction(
+                room_id, rng.choice(users), rng.choice(targets), "👍"
+            )
+
+    lags = []  # type: List[float]
+    lag_task = asyncio.ensure_future(measure_loop_lag(lags))
+
+    start = time.perf_counter()
+    injected = dict(
+        zip(
+            ("commands", "joins", "reactions"),
+            await asyncio.gather(
+                run_at_rate(args.command_rate, args.duration, command),
+                run_at_rate(args.join_rate, args.duration, join),
+                run_at_rate(args.reaction_rate, args.duration, reaction),
+            ),
+        )
+    )
+
+    # Let the bot catch up on what's outstanding
+    expected = injected["commands"] + injected["joins"]
+    deadline = time.perf_counter() + args.drain
+    while time.perf_counter() < deadline:
+        replied = len(server.latencies["command"]) + len(server.latencies["welcome"])
+        if replied >= expected and executor.depth == 0:
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    lag_task.cancel()
+    sync_task.cancel()
+    await asyncio.gather(lag_task, sync_task, return_exceptions=True)
+    await executor.close()
+    await client.close()
+    await server.close()
+    store.close()
+    shutil.rmtree(directory)
+
+    report(args, injected, server, executor.stats(), lags, elapsed)
+
+
+def report(
+    args,
+    injected: Dict[str, int],
+    server: FakeHomeserver,
+    executor_stats: Dict[str, float],
+    lags: List[float],
+    elapsed: float,
+) -> None:
+    handled = sum(len(values) for values in server.latencies.values())
+    print(
+        f"{args.rooms} rooms, {args.duration}s of traffic: "
+        f"{injected['commands']} commands, {injected['joins']} joins, "
+        f"{injected['reactions']} reactions"
+    )
+    print(f"Handled:     {handled / elapsed:8.1f} events/s ({handled} replied to)")
+    print(f"Sent:        {len(server.sent) / elapsed:8.1f} events/s")
+    print(f"Rejected:    {executor_stats['rejected']} commands (executor full)")
+    for kind in ("command", "welcome", "reaction"):
+        print(f"{kind + ' latency:':<21}{describe(server.latencies[kind])}")
+    print(f"{'Loop lag:':<21}{describe(lags)}, max {max(lags or [0]) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--users", type=int, default=50, help="Members per room")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds")
+    parser.add_argument("--command-rate", type=float, default=50, help="Per second")
+    parser.add_argument("--join-rate", type=float, default=5, help="Per second")
+    parser.add_argument("--reaction-rate", type=float, default=10, help="Per second")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=100)
+    parser.add_argument(
+        "--drain", type=float, default=10, help="Seconds to wait for replies after"
+    )
+    asyncio.get_event_loop().run_until_complete(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Measure the overhead of recording metrics on hot paths.
+
+Times incrementing a labelled counter, observing a labelled histogram, and timing a
+block with `Histogram.time`, which is how commands, sends and queries are
+instrumented.
+
+Usage: python -m benchmarks.metrics
+"""
+import time
+
+from bangalore_bot.metrics import Counter, Histogram, Registry
+
+ITERATIONS = 200000
+
+
+def per_call(func) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        func()
+    return (time.perf_counter() - start) / ITERATIONS
+
+
+def main():
+    registry = Registry()
+    counter = Counter("total", "", ("command", "outcome"), registry=registry)
+    histogram = Histogram("seconds", "", ("command",), registry=registry)
+
+    def timed():
+        with histogram.time("spotify"):
+            pass
+
+    baseline = per_call(lambda: None)
+    results = (
+        ("Counter.inc", per_call(lambda: counter.inc("spotify", "ok"))),
+        ("Histogram.observe", per_call(lambda: histogram.observe(0.02, "spotify"))),
+        ("Histogram.time", per_call(timed)),
+    )
+    for name, seconds in results:
+        print(f"{name:>18}: {(seconds - baseline) * 1e6:6.2f} us per call")
+
+
+if __name__ == "__main__":
+    main()
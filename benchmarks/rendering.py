@@ -0,0 +1,53 @@
+"""Measure the CPU time spent rendering outgoing messages.
+
+Replays a mix of the bot's typical replies: static responses (the help texts),
+plain one-line replies like Spotify links, and occasional markdown,
+comparing `markdown.markdown` as send_text_to_room used to call it with
+`render_markdown`.
+
+Usage: python -m benchmarks.rendering
+"""
+import random
+import time
+
+from markdown import markdown
+
+from bangalore_bot.bot_commands import static_responses
+from bangalore_bot.rendering import prerender, render_markdown
+
+
+def make_messages(count: int):
+    rng = random.Random(0)
+    static = static_responses("!")
+    messages = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.5:
+            messages.append(rng.choice(static))
+        elif kind < 0.9:
+            messages.append(f"https://open.spotify.com/track/{rng.getrandbits(64):x}")
+        else:
+            messages.append(f"Unknown command '*{i}*'. Try the 'help' command.")
+    return messages
+
+
+def main():
+    messages = make_messages(20000)
+    prerender(static_responses("!"))
+
+    start = time.process_time()
+    for message in messages:
+        markdown(message)
+    before = (time.process_time() - start) / len(messages)
+
+    start = time.process_time()
+    for message in messages:
+        render_markdown(message)
+    after = (time.process_time() - start) / len(messages)
+
+    print(f"markdown():        {before * 1e6:8.1f} us CPU per send")
+    print(f"render_markdown(): {after * 1e6:8.1f} us CPU per send")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Measure searching the message archive.
+
+Builds an sqlite archive of synthetic chat, with words drawn from a Zipf
+distribution so some are in most messages and others in very few, then times
+`Storage.search_messages` for common, uncommon and rare words, on the first page
+of results and a later one. Searching with LIKE is timed once for comparison.
+
+Building a million messages takes a while, so the database can be kept and reused
+with --database.
+
+Usage: python -m benchmarks.search [--messages 1000000] [--database PATH]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import List, Sequence
+
+from bangalore_bot.bot_commands import SEARCH_PAGE_SIZE
+from bangalore_bot.storage import Storage
+
+from benchmarks.load_test import describe
+
+ROOMS = 20
+VOCABULARY = 20000
+BATCH_SIZE = 10000
+REPEATS = 20
+
+
+def word(rank: int) -> str:
+    """The word of a given rank in the vocabulary, most common first"""
+    return f"word{rank}"
+
+
+async def build(store: Storage, count: int) -> None:
+    rng = random.Random(0)
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, VOCABULARY + 1)))
+    ranks = range(1, VOCABULARY + 1)
+
+    start = time.perf_counter()
+    for offset in range(0, count, BATCH_SIZE):
+        batch = []
+        for i in range(offset, min(count, offset + BATCH_SIZE)):
+            words = rng.choices(ranks, cum_weights=weights, k=rng.randint(3, 15))
+            batch.append(
+                (
+                    f"$event{i}",
+                    f"!room{i % ROOMS}:example.com",
+                    f"@user{i % 100}:example.com",
+                    " ".join(word(rank) for rank in words),
+                    1700000000000 + i * 1000,
+                )
+            )
+        await store.insert_messages(batch)
+    elapsed = time.perf_counter() - start
+    print(f"Archived {count} messages in {elapsed:.1f} s ({count / elapsed:.0f}/s)")
+
+
+async def time_search(store: Storage, words: Sequence[str], page: int) -> List[float]:
+    times = []
+    for i in range(REPEATS):
+        room_id = f"!room{i % ROOMS}:example.com"
+        start = time.perf_counter()
+        await store.search_messages(
+            room_id, words, SEARCH_PAGE_SIZE + 1, (page - 1) * SEARCH_PAGE_SIZE
+        )
+        times.append(time.perf_counter() - start)
+    return times
+
+
+async def main(args) -> None:
+    directory = None
+    path = args.database
+    if path is None:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "bot.db")
+    store = Storage({"type": "sqlite", "connection_string": path})
+
+    (count,) = await store.fetchone("SELECT COUNT(*) FROM messages")
+    if count < args.messages:
+        await build(store, args.messages)
+        count = args.messages
+    print(f"{count} messages across {ROOMS} rooms")
+
+    queries = [
+        ("common", [word(1)]),
+        ("uncommon", [word(200)]),
+        ("rare", [word(15000)]),
+        ("two words", [word(2), word(50)]),
+    ]
+    for name, words in queries:
+        for page in (1, 10):
+            times = await time_search(store, words, page)
+            print(f"{name:>10}, page {page:>2}: {describe(times)}")
+
+    start = time.perf_counter()
+    await store.fetchall(
+        "SELECT event_id FROM messages WHERE room_id = ? AND message LIKE ? LIMIT ?",
+        ("!room0:example.com", f"%{word(15000)} %", SEARCH_PAGE_SIZE + 1),
+    )
+    print(f"{'LIKE, rare':>19}: {(time.perf_counter() - start) * 1000:7.1f} ms")
+
+    store.close()
+    if directory is not None:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--database", help="An sqlite database to keep the archive in")
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
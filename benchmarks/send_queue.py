@@ -0,0 +1,58 @@
+"""Compare sending replies with a blocking typing delay against the send queue.
+
+N commands are spread across M rooms and answered concurrently, each with a fixed
+typing delay. The blocking version (as send_text_to_room used to do with
+`time.sleep`) takes the sum of all delays; the queue takes roughly one delay.
+
+Usage: python -m benchmarks.send_queue [commands] [rooms] [delay]
+"""
+import asyncio
+import sys
+import time
+from typing import Any
+
+from bangalore_bot.send_queue import SendQueue
+
+
+class FakeClient:
+    async def room_send(self, room_id: str, message_type: str, content: Any, **kwargs):
+        return None
+
+    async def room_typing(self, room_id: str, typing_state: bool = True):
+        return None
+
+
+async def blocking_send(client: FakeClient, room_id: str, delay: float) -> None:
+    await client.room_typing(room_id, typing_state=True)
+    time.sleep(delay)
+    await client.room_send(room_id, "m.room.message", {"body": "hi"})
+    await client.room_typing(room_id, typing_state=False)
+
+
+async def run(commands: int, rooms: int, delay: float) -> None:
+    client = FakeClient()
+    room_ids = [f"!room{i % rooms}:example.com" for i in range(commands)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(blocking_send(client, r, delay) for r in room_ids))
+    blocking = time.perf_counter() - start
+
+    queue = SendQueue(client, typing_delay=(delay, delay))
+    start = time.perf_counter()
+    await asyncio.gather(*(queue.send(r, {"body": "hi"}) for r in room_ids))
+    queued = time.perf_counter() - start
+
+    print(f"{commands} commands across {rooms} rooms, {delay}s typing delay")
+    print(f"  blocking sleep: {blocking:.3f}s")
+    print(f"  send queue:     {queued:.3f}s")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.get_event_loop().run_until_complete(
+        run(
+            int(args[0]) if len(args) > 0 else 20,
+            int(args[1]) if len(args) > 1 else 5,
+            float(args[2]) if len(args) > 2 else 0.1,
+        )
+    )
@@ -0,0 +1,175 @@
+"""Compare startup with and without the sync filter.
+
+Feeds an initial /sync response through a nio client with the bot's callbacks
+registered, and measures the time until the first command is handled and the peak
+memory used. The filtered response is derived from the unfiltered one the way a
+homeserver applies the filter from `build_sync_filter`: only state events of the
+allowed types, only the membership of users active in the timeline, and at most
+`timeline_limit` timeline events.
+
+By default a synthetic response is generated. A recorded one (the JSON body of a
+full-state /sync) can be given instead.
+
+Usage: python -m benchmarks.sync_filter [recorded_sync.json]
+"""
+import asyncio
+import copy
+import json
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict
+from unittest.mock import patch
+
+from nio import (
+    AsyncClient,
+    AsyncClientConfig,
+    RoomMemberEvent,
+    RoomMessageText,
+    SyncResponse,
+)
+
+from bangalore_bot.callbacks import Callbacks
+from bangalore_bot.config import Config
+from bangalore_bot.sync_filter import build_sync_filter
+
+BOT_USER = "@bot:example.com"
+
+
+def make_sync(rooms: int, members: int, messages: int) -> Dict[str, Any]:
+    """Generate a full-state initial sync response"""
+    join = {}
+    for r in range(rooms):
+        room_id = f"!room{r}:example.com"
+        state = [
+            {
+                "type": "m.room.create",
+                "state_key": "",
+                "sender": BOT_USER,
+                "event_id": f"$create{r}",
+                "origin_server_ts": 0,
+                "content": {"creator": BOT_USER},
+            }
+        ]
+        for m in range(members):
+            user = f"@user{m}:example.com"
+            state.append(
+                {
+                    "type": "m.room.member",
+                    "state_key": user,
+                    "sender": user,
+                    "event_id": f"$member{r}_{m}",
+                    "origin_server_ts": 0,
+                    "content": {"membership": "join", "displayname": f"User {m}"},
+                }
+            )
+        timeline = [
+            {
+                "type": "m.room.message",
+                "sender": f"@user{m % members}:example.com",
+                "event_id": f"$message{r}_{m}",
+                "origin_server_ts": m,
+                "content": {"msgtype": "m.text", "body": f"message {m}"},
+            }
+            for m in range(messages)
+        ]
+        timeline[-1]["content"]["body"] = "!unknowncommand"
+        join[room_id] = {
+            "state": {"events": state},
+            "timeline": {"events": timeline, "limited": False},
+            "ephemeral": {"events": []},
+            "account_data": {"events": []},
+            "summary": {"m.joined_member_count": members},
+        }
+    return {
+        "next_batch": "s1",
+        "rooms": {"join": join, "invite": {}, "leave": {}},
+        "presence": {"events": []},
+        "account_data": {"events": []},
+        "to_device": {"events": []},
+        "device_lists": {"changed": [], "left": []},
+        "device_one_time_keys_count": {},
+    }
+
+
+def apply_filter(sync: Dict[str, Any], sync_filter: Dict[str, Any]) -> Dict[str, Any]:
+    """Emulate a homeserver applying a sync filter to a response"""
+    sync = copy.deepcopy(sync)
+    state_filter = sync_filter["room"]["state"]
+    timeline_filter = sync_filter["room"]["timeline"]
+    for room in sync["rooms"]["join"].values():
+        timeline = [
+            e
+            for e in room["timeline"]["events"]
+            if e["type"] in timeline_filter["types"]
+        ][-timeline_filter["limit"]:]
+        room["timeline"]["events"] = timeline
+
+        active = {e["sender"] for e in timeline}
+        room["state"]["events"] = [
+            e
+            for e in room["state"]["events"]
+            if e["type"] in state_filter["types"]
+            and not (
+                state_filter["lazy_load_members"]
+                and e["type"] == "m.room.member"
+                and e["state_key"] not in active
+            )
+        ]
+    return sync
+
+
+async def time_to_first_command(sync: Dict[str, Any]):
+    client = AsyncClient(
+        "https://example.com",
+        BOT_USER,
+        config=AsyncClientConfig(encryption_enabled=False, store_sync_tokens=False),
+    )
+    config = Config.__new__(Config)
+    config.command_prefix = "!"
+    callbacks = Callbacks(client, None, config)
+
+    handled = asyncio.Event()
+
+    async def command_process(command):
+        handled.set()
+
+    client.add_event_callback(callbacks.message, (RoomMessageText,))
+    client.add_event_callback(callbacks.user_invited, (RoomMemberEvent,))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with patch("bangalore_bot.callbacks.Command.process", command_process), patch(
+        "bangalore_bot.callbacks.Message.process", lambda message: asyncio.sleep(0)
+    ):
+        response = SyncResponse.from_dict(json.loads(json.dumps(sync)))
+        await client.receive_response(response)
+        await handled.wait()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await client.close()
+    return elapsed, peak
+
+
+async def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            sync = json.load(f)
+    else:
+        sync = make_sync(rooms=10, members=1000, messages=50)
+
+    sync_filter = build_sync_filter(lazy_load_members=True, timeline_limit=10)
+    filtered = apply_filter(sync, sync_filter)
+
+    for name, response in (("no filter", sync), ("sync filter", filtered)):
+        size = len(json.dumps(response))
+        elapsed, peak = await time_to_first_command(response)
+        print(
+            f"{name:>12}: {size / 1e6:6.2f} MB response, "
+            f"{elapsed * 1000:8.1f} ms to first command, {peak / 1e6:6.1f} MB peak"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
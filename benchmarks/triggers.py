@@ -0,0 +1,57 @@
+"""Measure message throughput of the trigger engine as the number of triggers grows.
+
+Compares searching each trigger's regex one by one with a TriggerEngine, which
+finds every keyword with a single combined regex and searches the regex triggers
+one by one. One in ten triggers is a regex, the rest are keywords.
+
+Usage: python -m benchmarks.triggers
+"""
+import random
+import re
+import string
+import time
+
+from bangalore_bot.triggers import TriggerEngine
+
+
+def make_messages(count: int):
+    rng = random.Random(0)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 8))) for _ in range(2000)]
+    return [" ".join(rng.choices(words, k=rng.randint(3, 30))) for _ in range(count)]
+
+
+def main():
+    messages = make_messages(5000)
+    print(f"{'triggers':>8} {'one by one':>16} {'engine':>16}")
+    for count in (1, 10, 50, 100, 500):
+        # Mostly keywords, with one regex trigger in ten
+        config = [
+            {"regex": rf"\bpattern{i}\w*", "response": str(i)}
+            if i % 10 == 0
+            else {"keyword": f"keyword {i}", "response": str(i)}
+            for i in range(count)
+        ]
+        engine = TriggerEngine.from_config(config)
+        separate = [
+            re.compile(
+                rf"(?<!\w){re.escape(t.keyword)}(?!\w)" if t.keyword else t.pattern,
+                re.IGNORECASE,
+            )
+            for t in engine.triggers
+        ]
+
+        start = time.perf_counter()
+        for message in messages:
+            [regex for regex in separate if regex.search(message)]
+        one_by_one = len(messages) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for message in messages:
+            engine.match(message)
+        engine = len(messages) / (time.perf_counter() - start)
+
+        print(f"{count:>8} {one_by_one:>11.0f} msg/s {engine:>11.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
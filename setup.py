@@ -29,7 +29,8 @@ setup(
     version=version,
     url="https://github.com/anoadragon453/nio-template",
     description="A matrix bot to do amazing things!",
-    packages=find_packages(exclude=["tests", "tests.*"]),
+    packages=find_packages(exclude=["tests", "tests.*", "benchmarks", "benchmarks.*"]),
+    package_data={"bangalore_bot": ["responses.yaml"]},
     install_requires=[
         "matrix-nio[e2e]>=0.10.0",
         "Markdown>=3.1.1",
@@ -0,0 +1,50 @@
+import unittest
+from unittest.mock import Mock
+
+import nio
+
+from bangalore_bot.admin_roster import AdminRoster
+
+
+class AdminRosterTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.fake_room = Mock(spec=nio.MatrixRoom)
+        self.fake_room.room_id = "!abcdefg:example.com"
+        self.fake_room.power_levels = Mock()
+        self.fake_room.power_levels.users = {
+            "@admin:example.com": 100,
+            "@mod:example.com": 50,
+            "@user:example.com": 0,
+            "@whatsappbot:example.com": 100,
+        }
+
+    def test_admins(self):
+        """Tests that admins are found by power level, excluding bridge bots"""
+        admins = AdminRoster().get(self.fake_room)
+
+        self.assertEqual(admins.user_ids, ("@admin:example.com", "@mod:example.com"))
+        self.assertIn('href="https://matrix.to/#/@mod:example.com"', admins.pills)
+
+        admins = AdminRoster(min_power_level=100, exclude_pattern="").get(
+            self.fake_room
+        )
+        self.assertEqual(
+            admins.user_ids, ("@admin:example.com", "@whatsappbot:example.com")
+        )
+
+    def test_invalidate(self):
+        """Tests that admins are cached until the room is invalidated"""
+        roster = AdminRoster()
+        roster.get(self.fake_room)
+
+        self.fake_room.power_levels.users = {"@new_admin:example.com": 100}
+        self.assertEqual(len(roster.get(self.fake_room).user_ids), 2)
+
+        roster.invalidate(self.fake_room.room_id)
+        self.assertEqual(
+            roster.get(self.fake_room).user_ids, ("@new_admin:example.com",)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import asyncio
+import unittest
+from unittest.mock import Mock, patch
+
+import nio
+
+from bangalore_bot.announcements import announce_birthdays, birthday_message
+
+from tests.utils import make_awaitable, run_coroutine
+
+
+class AnnouncementsTestCase(unittest.TestCase):
+    def test_birthday_message(self):
+        """Tests wishing one or several users"""
+        plain, html = birthday_message(["@a:example.com"])
+        self.assertEqual(plain, "@a:example.com's birthday is today🎉")
+        self.assertIn('href="https://matrix.to/#/@a:example.com"', html)
+
+        plain, _ = birthday_message(["@a:x", "@b:x", "@c:x"])
+        self.assertEqual(plain, "@a:x, @b:x and @c:x have their birthday today🎉")
+
+    @patch("bangalore_bot.announcements.send_text_with_mentions", new_callable=Mock)
+    def test_one_message_per_room(self, fake_send):
+        """Tests that each room gets one message mentioning everyone, and that a
+        failure in one room doesn't stop the others"""
+        failure = asyncio.Future()
+        failure.set_exception(RuntimeError("oops"))
+        fake_send.side_effect = [make_awaitable(None), failure, make_awaitable(None)]
+        client = Mock(spec=nio.AsyncClient)
+        users = ["@a:x", "@b:x"]
+
+        with self.assertLogs("bangalore_bot.announcements", level="ERROR"):
+            run_coroutine(announce_birthdays(client, ["!1", "!2", "!3"], users))
+
+        self.assertEqual(
+            [call[0][1] for call in fake_send.call_args_list], ["!1", "!2", "!3"]
+        )
+        for call in fake_send.call_args_list:
+            self.assertEqual(call[0][4], users)
+
+
+if __name__ == "__main__":
+    unittest.main()
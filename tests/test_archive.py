@@ -0,0 +1,93 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from nio import RoomMessageText
+
+from bangalore_bot.archive import MessageArchiver
+from bangalore_bot.storage import Storage
+
+from tests.utils import run_coroutine
+
+
+def make_message(number: int) -> RoomMessageText:
+    return RoomMessageText.from_dict(
+        {
+            "type": "m.room.message",
+            "event_id": f"$event{number}",
+            "sender": "@user:example.com",
+            "origin_server_ts": 1000 + number,
+            "content": {"msgtype": "m.text", "body": f"message {number}"},
+        }
+    )
+
+
+class MessageArchiverTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.database_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(self.database_path)
+        self.store = Storage(
+            {"type": "sqlite", "connection_string": self.database_path}
+        )
+
+    def tearDown(self) -> None:
+        self.store.close()
+        os.remove(self.database_path)
+
+    def _archived(self):
+        return run_coroutine(
+            self.store.fetchall(
+                "SELECT event_id, room_id, sender, message, timestamp FROM messages "
+                "ORDER BY timestamp"
+            )
+        )
+
+    def test_flush_thresholds(self):
+        """Tests that messages are written once a batch is full, or after the flush
+        interval"""
+
+        async def archive(batch_size, flush_interval, count):
+            archiver = MessageArchiver(
+                self.store, batch_size=batch_size, flush_interval=flush_interval
+            )
+            archiver.start()
+            for number in range(count):
+                archiver.add("!room:example.com", make_message(number))
+            await asyncio.sleep(0.05)
+            written = len(await self.store.fetchall("SELECT * FROM messages"))
+            await archiver.close()
+            return written
+
+        self.assertEqual(run_coroutine(archive(3, 60, 3)), 3)
+        self.assertEqual(run_coroutine(archive(100, 0.01, 5)), 5)
+
+        self.assertEqual(
+            self._archived()[0],
+            ("$event0", "!room:example.com", "@user:example.com", "message 0", 1000),
+        )
+
+    def test_ring_buffer(self):
+        """Tests that the oldest messages are dropped once the buffer is full, and
+        that messages already archived are skipped"""
+        archiver = MessageArchiver(self.store, capacity=2)
+        for number in range(3):
+            archiver.add("!room:example.com", make_message(number))
+        self.assertEqual(len(archiver), 2)
+
+        run_coroutine(archiver.close())
+        self.assertEqual(
+            [row[0] for row in self._archived()], ["$event1", "$event2"]
+        )
+
+        archiver.add("!room:example.com", make_message(2))
+        archiver.add("!room:example.com", make_message(3))
+        run_coroutine(archiver.flush())
+        self.assertEqual(
+            [row[0] for row in self._archived()], ["$event1", "$event2", "$event3"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
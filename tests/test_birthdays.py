@@ -0,0 +1,30 @@
+import unittest
+
+from bangalore_bot.birthdays import BirthdayIndex
+
+
+class BirthdayIndexTestCase(unittest.TestCase):
+    def test_lookups(self):
+        """Tests listing birthdays by month and by day"""
+        index = BirthdayIndex(
+            [("@a:example.com", 2, 29), ("@b:example.com", 2, 1), ("@c:example.com", 12, 31)]
+        )
+
+        self.assertEqual(
+            index.in_month(2), [("@b:example.com", 1), ("@a:example.com", 29)]
+        )
+        self.assertEqual(index.on(12, 31), ["@c:example.com"])
+        self.assertEqual(index.on(1, 1), [])
+
+    def test_update_moves_birthday(self):
+        """Tests that updating a birthday removes it from its old date"""
+        index = BirthdayIndex([("@a:example.com", 5, 5)])
+        index.set("@a:example.com", 6, 6)
+
+        self.assertEqual(index.on(5, 5), [])
+        self.assertEqual(index.on(6, 6), ["@a:example.com"])
+        self.assertEqual(len(index), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
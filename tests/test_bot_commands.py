@@ -0,0 +1,217 @@
+import unittest
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+import nio
+
+from bangalore_bot.bot_commands import COMMANDS, Command
+from bangalore_bot.rate_limit import RateLimiter
+from bangalore_bot.spotify import SpotifyClient
+from bangalore_bot.stats import Retention, RoomReport, RoomStats
+from bangalore_bot.storage import Storage
+
+from tests.utils import make_awaitable, run_coroutine
+
+
+class CommandTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.fake_client = Mock(spec=nio.AsyncClient)
+        self.fake_storage = Mock(spec=Storage)
+        self.fake_config = Mock()
+        self.fake_config.command_prefix = "!"
+
+        self.fake_room = Mock(spec=nio.MatrixRoom)
+        self.fake_room.room_id = "!abcdefg:example.com"
+        self.fake_event = Mock(spec=nio.RoomMessageText)
+        self.fake_event.event_id = "$event"
+        self.fake_event.sender = "@user:example.com"
+
+    def _process(
+        self,
+        command: str,
+        rate_limiter: RateLimiter = None,
+        stats: RoomStats = None,
+        spotify: SpotifyClient = None,
+    ) -> None:
+        run_coroutine(
+            Command(
+                self.fake_client,
+                self.fake_storage,
+                self.fake_config,
+                command,
+                self.fake_room,
+                self.fake_event,
+                rate_limiter=rate_limiter,
+                stats=stats,
+                spotify=spotify,
+            ).process()
+        )
+
+    def test_dispatch(self):
+        """Tests that commands are dispatched on their exact name or alias"""
+        handler = Mock(return_value=make_awaitable(None))
+        with patch.object(COMMANDS.get("admin"), "handler", handler):
+            self._process("admins please look")
+            handler.assert_called_once()
+
+            with patch("bangalore_bot.bot_commands.send_text_to_room") as fake_send:
+                fake_send.return_value = make_awaitable(None)
+                self._process("adminsomething")
+            handler.assert_called_once()
+            self.assertIn("Unknown command", fake_send.call_args[0][2])
+
+    @patch("bangalore_bot.bot_commands.send_text_to_room")
+    def test_spotify_without_query(self, fake_send):
+        """Tests that a Spotify search without a query replies with how to use it"""
+        fake_send.return_value = make_awaitable(None)
+        fake_spotify = Mock(spec=SpotifyClient)
+
+        self._process("spotify", spotify=fake_spotify)
+        fake_spotify.search.assert_not_called()
+        self.assertEqual(
+            fake_send.call_args[0][2],
+            "!spotify <search terms> - Get a Spotify link for the best matching song",
+        )
+
+    @patch("bangalore_bot.bot_commands.send_text_to_room")
+    def test_help_is_generated(self, fake_send):
+        """Tests that help text comes from the command registry"""
+        fake_send.return_value = make_awaitable(None)
+
+        self._process("help commands")
+        text = fake_send.call_args[0][2]
+        for spec in COMMANDS:
+            self.assertIn(spec.name, text)
+
+    @patch("bangalore_bot.bot_commands.send_text_to_room")
+    def test_help_for_alias(self, fake_send):
+        """Tests that help about an alias describes the command it belongs to"""
+        fake_send.return_value = make_awaitable(None)
+
+        self._process("help birthdays")
+        self.assertIn("!birthday list (1-12)", fake_send.call_args[0][2])
+
+    @patch("bangalore_bot.bot_commands.react_to_event")
+    def test_rate_limited(self, fake_react):
+        """Tests that a throttled command gets one reaction instead of running"""
+        fake_react.return_value = make_awaitable(None)
+        handler = Mock(return_value=make_awaitable(None))
+        rate_limiter = RateLimiter({"admin": (1, 60)})
+
+        with patch.object(COMMANDS.get("admin"), "handler", handler):
+            for _ in range(3):
+                handler.return_value = make_awaitable(None)
+                self._process("admin", rate_limiter)
+
+        handler.assert_called_once()
+        fake_react.assert_called_once_with(
+            self.fake_client, "!abcdefg:example.com", "$event", "⏳"
+        )
+
+
+    @patch("bangalore_bot.bot_commands.send_text_to_room")
+    def test_search(self, fake_send):
+        """Tests that search results are paged and link to the messages"""
+        fake_send.return_value = make_awaitable(None)
+        self.fake_config.archive_enabled = True
+        self.fake_room.user_name.return_value = "User"
+        rows = [
+            (f"$event{i}", "!abcdefg:example.com", "@user:example.com", "<b>hi</b>", 0)
+            for i in range(6)
+        ]
+        self.fake_storage.search_messages = Mock(return_value=make_awaitable(rows))
+
+        self._process("search hi, there page 2")
+        self.fake_storage.search_messages.assert_called_once_with(
+            "!abcdefg:example.com", ["hi", "there"], 6, 5
+        )
+        message = fake_send.call_args[0][2]
+        formatted_message = fake_send.call_args[1]["formatted_body"]
+        self.assertIn(
+            "https://matrix.to/#/%21abcdefg%3Aexample.com/%24event0", message
+        )
+        self.assertNotIn("$event5", message)
+        self.assertIn("!search hi there page 3", message)
+        self.assertIn('<ol start="6">', formatted_message)
+        self.assertIn("&lt;b&gt;hi&lt;/b&gt;", formatted_message)
+
+    @patch("bangalore_bot.bot_commands.send_text_to_room")
+    def test_search_without_archive(self, fake_send):
+        """Tests that searching says so when history isn't kept"""
+        fake_send.return_value = make_awaitable(None)
+        self.fake_config.archive_enabled = False
+
+        self._process("search hi")
+        self.fake_storage.search_messages.assert_not_called()
+        self.assertIn("doesn't keep", fake_send.call_args[0][2])
+
+    @patch("bangalore_bot.bot_commands.send_text_to_room")
+    def test_birthday(self, fake_send):
+        """Tests that a birthday is stored, and that anything else gets a reply"""
+        fake_send.return_value = make_awaitable(None)
+        self.fake_storage.set_birthday = Mock(return_value=make_awaitable(None))
+
+        self._process("birthday 14-03-1990")
+        self.fake_storage.set_birthday.assert_called_once_with(
+            "@user:example.com", "", 3, 14, 1990
+        )
+        self.assertIn("Stored", fake_send.call_args[0][2])
+
+        self._process("birthday someday")
+        self.fake_storage.set_birthday.assert_called_once()
+        self.assertIn("DD-MM-YYYY", fake_send.call_args[0][2])
+
+    @patch("bangalore_bot.bot_commands.send_text_to_room")
+    def test_rejected_birthday(self, fake_send):
+        """Tests that a date rejected as a birthday gets only the reply saying why"""
+        fake_send.return_value = make_awaitable(None)
+        self.fake_storage.set_birthday = Mock(return_value=make_awaitable(None))
+        today = datetime.now()
+
+        for date, reply in (
+            (today.replace(year=today.year + 1, day=1), "Time traveller"),
+            (today.replace(year=today.year - 10, day=1), "Underage"),
+        ):
+            with self.subTest(reply=reply):
+                fake_send.reset_mock()
+                self._process("birthday " + date.strftime("%d-%m-%Y"))
+                fake_send.assert_called_once()
+                self.assertIn(reply, fake_send.call_args[0][2])
+        self.fake_storage.set_birthday.assert_not_called()
+
+    @patch("bangalore_bot.bot_commands.send_text_to_room")
+    def test_stats(self, fake_send):
+        """Tests that the stats command reports on the room over the given days"""
+        fake_send.return_value = make_awaitable(None)
+        self.fake_room.user_name.return_value = "<User>"
+        heatmap = [[0] * 24 for _ in range(7)]
+        heatmap[2][18] = 4
+        heatmap[0][9] = 1
+        fake_stats = Mock(spec=RoomStats)
+        fake_stats.report = Mock(
+            return_value=make_awaitable(
+                RoomReport(5, [("@user:example.com", 5)], heatmap, Retention(2, 1, 0))
+            )
+        )
+
+        self._process("stats 7", stats=fake_stats)
+        fake_stats.report.assert_called_once_with("!abcdefg:example.com", 7)
+        message = fake_send.call_args[0][2]
+        formatted_message = fake_send.call_args[1]["formatted_body"]
+        self.assertIn("5 messages in the last 7 days", message)
+        self.assertIn("1. <User>: 5", message)
+        self.assertIn("Mon          ░", message)
+        self.assertIn("Wed                   █", message)
+        self.assertIn("Busiest on Wednesdays around 18:00", message)
+        self.assertIn("2 joined, 1 posted", message)
+        self.assertIn("<li>&lt;User&gt;: 5</li>", formatted_message)
+
+        self._process("stats 1000", stats=fake_stats)
+        fake_stats.report.assert_called_with("!abcdefg:example.com", 365)
+
+        self._process("stats")
+        self.assertIn("doesn't keep", fake_send.call_args[0][2])
+
+
+if __name__ == "__main__":
+    unittest.main()
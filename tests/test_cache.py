@@ -0,0 +1,37 @@
+import unittest
+
+from bangalore_bot.cache import MISSING, TTLCache
+
+
+class TTLCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 1000.0
+        self.cache = TTLCache(max_size=2, ttl=10, clock=lambda: self.now)
+
+    def test_expiry(self):
+        """Tests that entries are only returned until their TTL is up"""
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+
+        self.now += 10
+        self.assertIs(self.cache.get("a"), MISSING)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_least_recently_used_is_evicted(self):
+        """Tests that the least recently used entry is evicted when the cache is full"""
+        self.cache.set("a", 1)
+        self.cache.set("b", None)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIs(self.cache.get("b"), MISSING)
+        # None is a cacheable value
+        self.cache.set("c", None)
+        self.assertIsNone(self.cache.get("c"))
+        self.assertEqual(self.cache.evictions, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
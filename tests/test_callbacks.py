@@ -1,9 +1,11 @@
+import os
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 import nio
 
 from bangalore_bot.callbacks import Callbacks
+from bangalore_bot.stats import RoomStats
 from bangalore_bot.storage import Storage
 
 from tests.utils import make_awaitable, run_coroutine
@@ -45,6 +47,83 @@ class CallbacksTestCase(unittest.TestCase):
         # Check that we attempted to join the room
         self.fake_client.join.assert_called_once_with(fake_room_id)
 
+    def _member_event(self, membership: str, prev_membership: str) -> Mock:
+        fake_member_event = Mock(spec=nio.RoomMemberEvent)
+        fake_member_event.membership = membership
+        fake_member_event.state_key = "@new_user:example.com"
+        fake_member_event.content = {"membership": membership, "displayname": "New"}
+        fake_member_event.prev_content = {"membership": prev_membership}
+        fake_member_event.server_timestamp = 1000
+        return fake_member_event
+
+    @patch.dict(os.environ, {"MAIN_ROOM": "!abcdefg:example.com"})
+    @patch("bangalore_bot.callbacks.send_text_with_mention")
+    def test_user_invited(self, fake_send):
+        """Tests that users joining after an invite are welcomed exactly once"""
+        fake_send.return_value = make_awaitable(None)
+        fake_room = Mock(spec=nio.MatrixRoom)
+        fake_room.room_id = "!abcdefg:example.com"
+
+        welcomed = set()
+        self.fake_storage.is_welcomed.side_effect = (
+            lambda room_id, user_id: (room_id, user_id) in welcomed
+        )
+        self.fake_storage.mark_welcomed = Mock(
+            side_effect=lambda room_id, user_id: make_awaitable(
+                welcomed.add((room_id, user_id))
+            )
+        )
+
+        # A display name change doesn't look anything up
+        run_coroutine(
+            self.callbacks.user_invited(fake_room, self._member_event("join", "join"))
+        )
+        self.fake_storage.is_welcomed.assert_not_called()
+
+        # The first join after an invite is welcomed, any following ones are not
+        for _ in range(2):
+            run_coroutine(
+                self.callbacks.user_invited(
+                    fake_room, self._member_event("join", "invite")
+                )
+            )
+        fake_send.assert_called_once()
+        self.fake_storage.mark_welcomed.assert_called_once_with(
+            "!abcdefg:example.com", "@new_user:example.com"
+        )
+
+    def test_stats(self):
+        """Tests that messages and joins are counted, but not display name changes"""
+        fake_stats = Mock(spec=RoomStats)
+        self.fake_config.command_prefix = "!"
+        callbacks = Callbacks(
+            self.fake_client, self.fake_storage, self.fake_config, stats=fake_stats
+        )
+        fake_room = Mock(spec=nio.MatrixRoom)
+        fake_room.room_id = "!other:example.com"
+
+        for prev_membership in ("join", "leave"):
+            run_coroutine(
+                callbacks.user_invited(
+                    fake_room, self._member_event("join", prev_membership)
+                )
+            )
+        fake_stats.record_join.assert_called_once_with(
+            "!other:example.com", "@new_user:example.com", 1000
+        )
+
+        fake_event = Mock(spec=nio.RoomMessageText)
+        fake_event.sender = "@user:example.com"
+        fake_event.body = "hello"
+        fake_event.server_timestamp = 2000
+        fake_room.member_count = 3
+        with patch("bangalore_bot.callbacks.Message") as fake_message:
+            fake_message.return_value.process.return_value = make_awaitable(None)
+            run_coroutine(callbacks.message(fake_room, fake_event))
+        fake_stats.record_message.assert_called_once_with(
+            "!other:example.com", "@user:example.com", 2000
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
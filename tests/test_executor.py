@@ -0,0 +1,80 @@
+import asyncio
+import unittest
+
+from bangalore_bot.executor import CommandExecutor
+
+from tests.utils import run_coroutine
+
+
+class CommandExecutorTestCase(unittest.TestCase):
+    def test_ordering_and_concurrency(self):
+        """Tests that commands in a room run in order, and rooms run concurrently
+        up to the concurrency limit"""
+        executor = CommandExecutor(concurrency=2)
+        log = []
+        running = 0
+        most_running = 0
+
+        def job(room_id, n):
+            async def run():
+                nonlocal running, most_running
+                running += 1
+                most_running = max(most_running, running)
+                await asyncio.sleep(0.01)
+                log.append((room_id, n))
+                running -= 1
+
+            return run
+
+        async def submit_all():
+            for n in range(3):
+                for room_id in ("!a", "!b", "!c"):
+                    self.assertTrue(executor.submit(room_id, job(room_id, n)))
+            while executor.completed < 9:
+                await asyncio.sleep(0.01)
+            stats = executor.stats()
+            await executor.close()
+            return stats
+
+        stats = run_coroutine(submit_all())
+
+        self.assertEqual(most_running, 2)
+        for room_id in ("!a", "!b", "!c"):
+            self.assertEqual([n for r, n in log if r == room_id], [0, 1, 2])
+        self.assertEqual(stats["depth"], 0)
+        self.assertEqual(stats["max_depth"], 9)
+        self.assertGreater(stats["max_wait"], 0)
+
+    def test_backpressure(self):
+        """Tests that commands are refused once too many are waiting, and that a
+        failing command doesn't stop the next one"""
+        executor = CommandExecutor(concurrency=1, max_queue=2)
+        ran = []
+
+        async def fail():
+            raise RuntimeError("oops")
+
+        async def succeed():
+            ran.append(True)
+
+        async def submit_all():
+            accepted = [
+                executor.submit("!a", fail),
+                executor.submit("!a", succeed),
+                executor.submit("!a", succeed),
+            ]
+            while executor.completed + executor.failed < 2:
+                await asyncio.sleep(0)
+            await executor.close()
+            return accepted
+
+        with self.assertLogs("bangalore_bot.executor", level="ERROR"):
+            accepted = run_coroutine(submit_all())
+
+        self.assertEqual(accepted, [True, True, False])
+        self.assertEqual(ran, [True])
+        self.assertEqual((executor.failed, executor.rejected), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+
+from aiohttp import ClientSession
+
+from bangalore_bot.metrics import Counter, Gauge, Histogram, MetricsServer, Registry
+
+from tests.utils import run_coroutine
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = Registry()
+
+    def test_render(self):
+        """Tests that metrics are rendered in the Prometheus text format"""
+        counter = Counter(
+            "commands_total", "Commands run", ("command",), registry=self.registry
+        )
+        gauge = Gauge("depth", "Queue depth", registry=self.registry)
+        histogram = Histogram(
+            "duration_seconds", "Durations", buckets=(0.1, 1), registry=self.registry
+        )
+
+        counter.inc("help")
+        counter.inc("help")
+        counter.inc('say "hi"')
+        gauge.set_function(lambda: 3)
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value)
+
+        self.assertEqual(
+            self.registry.render(),
+            "\n".join(
+                [
+                    "# HELP commands_total Commands run",
+                    "# TYPE commands_total counter",
+                    'commands_total{command="help"} 2',
+                    'commands_total{command="say \\"hi\\""} 1',
+                    "# HELP depth Queue depth",
+                    "# TYPE depth gauge",
+                    "depth 3",
+                    "# HELP duration_seconds Durations",
+                    "# TYPE duration_seconds histogram",
+                    'duration_seconds_bucket{le="0.1"} 2',
+                    'duration_seconds_bucket{le="1"} 3',
+                    'duration_seconds_bucket{le="+Inf"} 4',
+                    "duration_seconds_sum 5.65",
+                    "duration_seconds_count 4",
+                    "",
+                ]
+            ),
+        )
+
+    def test_duplicate_name(self):
+        """Tests that two metrics can't share a name"""
+        Counter("things_total", "Things", registry=self.registry)
+        with self.assertRaises(ValueError):
+            Gauge("things_total", "Things", registry=self.registry)
+
+    def test_timer(self):
+        """Tests that timing a block observes it, even if it raises"""
+        histogram = Histogram("seconds", "Time", ("name",), registry=self.registry)
+        with histogram.time("ok"):
+            pass
+        with self.assertRaises(RuntimeError), histogram.time("error"):
+            raise RuntimeError()
+        self.assertEqual((histogram.count("ok"), histogram.count("error")), (1, 1))
+
+    def test_server(self):
+        """Tests that the server serves the registry's metrics"""
+        Counter("served_total", "Served", registry=self.registry).inc()
+        server = MetricsServer(self.registry, port=0)
+
+        async def scrape():
+            await server.start()
+            try:
+                port = server._runner.addresses[0][1]
+                async with ClientSession() as session:
+                    async with session.get(f"http://127.0.0.1:{port}/metrics") as resp:
+                        return await resp.text()
+            finally:
+                await server.close()
+
+        self.assertIn("served_total 1", run_coroutine(scrape()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+from bangalore_bot.command_registry import CommandSpec
+from bangalore_bot.config import Config
+from bangalore_bot.errors import ConfigError
+from bangalore_bot.rate_limit import ALLOW, IGNORE, THROTTLE, RateLimiter
+
+
+async def handler(command):
+    pass
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.spotify = CommandSpec("spotify", handler, rate_limit=(2, 60))
+        self.help = CommandSpec("help", handler)
+
+    def _limiter(self, **kwargs) -> RateLimiter:
+        return RateLimiter(clock=lambda: self.now, **kwargs)
+
+    def test_bucket(self):
+        """Tests that uses are refused over the limit and allowed as tokens refill"""
+        limiter = self._limiter()
+        check = lambda: limiter.check("!room", "@user", self.spotify)
+
+        self.assertEqual([check(), check()], [ALLOW, ALLOW])
+        # The user is told they're throttled once
+        self.assertEqual([check(), check()], [THROTTLE, IGNORE])
+
+        # One token refills every 30 seconds
+        self.now = 30
+        self.assertEqual([check(), check()], [ALLOW, THROTTLE])
+
+        # Other users, rooms and unlimited commands are unaffected
+        self.assertEqual(limiter.check("!room", "@other", self.spotify), ALLOW)
+        self.assertEqual(limiter.check("!other", "@user", self.spotify), ALLOW)
+        for _ in range(10):
+            self.assertEqual(limiter.check("!room", "@user", self.help), ALLOW)
+
+    def test_overrides(self):
+        """Tests that configured limits replace the commands' defaults"""
+        limiter = self._limiter(limits={"spotify": None, "help": (1, 10)})
+        for _ in range(10):
+            self.assertEqual(limiter.check("!room", "@user", self.spotify), ALLOW)
+        self.assertEqual(limiter.check("!room", "@user", self.help), ALLOW)
+        self.assertEqual(limiter.check("!room", "@user", self.help), THROTTLE)
+
+    def test_eviction(self):
+        """Tests that idle buckets are dropped, and the number kept is bounded"""
+        limiter = self._limiter(max_keys=3)
+        for i in range(5):
+            limiter.check("!room", f"@user{i}", self.spotify)
+        self.assertEqual(len(limiter), 3)
+
+        # Buckets that have had time to refill are dropped on the next check
+        self.now = 60
+        limiter.check("!room", "@user0", self.spotify)
+        self.assertEqual(len(limiter), 1)
+
+    def test_config(self):
+        """Tests parsing the rate_limits option"""
+        limits = Config._parse_rate_limits(
+            None, {"spotify": {"uses": 3, "per": 10}, "admin": None}
+        )
+        self.assertEqual(limits, {"spotify": (3, 10.0), "admin": None})
+
+        for invalid in ([], {"spotify": {"uses": 3}}, {"spotify": {"uses": 0, "per": 1}}):
+            with self.subTest(invalid=invalid), self.assertRaises(ConfigError):
+                Config._parse_rate_limits(None, invalid)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import patch
+
+from bangalore_bot.reconnect import Backoff, ReconnectSupervisor
+
+from tests.utils import make_awaitable, run_coroutine
+
+
+class BackoffTestCase(unittest.TestCase):
+    def test_delays(self):
+        """Tests that delays grow exponentially up to the cap, and reset"""
+        backoff = Backoff(initial_delay=1, max_delay=10, jitter=0)
+        self.assertEqual([backoff.next_delay() for _ in range(6)], [1, 2, 4, 8, 10, 10])
+
+        backoff.reset()
+        self.assertEqual(backoff.next_delay(), 1)
+
+    def test_jitter(self):
+        """Tests that jitter only ever shortens a delay by up to its fraction"""
+        backoff = Backoff(initial_delay=8, jitter=0.5, rng=lambda: 0.999)
+        self.assertAlmostEqual(backoff.next_delay(), 4, places=2)
+
+
+class ReconnectSupervisorTestCase(unittest.TestCase):
+    @patch("bangalore_bot.reconnect.asyncio.sleep")
+    def test_outage(self, fake_sleep):
+        """Tests that an outage is counted once and its downtime recorded"""
+        fake_sleep.side_effect = lambda delay: make_awaitable(None)
+        now = [100.0]
+        supervisor = ReconnectSupervisor(
+            Backoff(initial_delay=1, jitter=0), clock=lambda: now[0]
+        )
+
+        # Syncing while connected changes nothing
+        supervisor.connected()
+        self.assertEqual(supervisor.disconnects, 0)
+
+        run_coroutine(supervisor.disconnected())
+        now[0] += 3
+        run_coroutine(supervisor.disconnected())
+        self.assertEqual(fake_sleep.call_args_list[-1][0][0], 2)
+        self.assertEqual(supervisor.current_downtime(), 3)
+
+        now[0] += 2
+        supervisor.connected()
+        self.assertEqual(supervisor.disconnects, 1)
+        self.assertEqual(supervisor.reconnect_attempts, 2)
+        self.assertEqual(supervisor.downtime, 5)
+        self.assertEqual(supervisor.backoff.attempts, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from markdown import markdown
+
+from bangalore_bot.bot_commands import static_responses
+from bangalore_bot.rendering import is_plain_text, prerender, render_markdown
+
+
+class RenderingTestCase(unittest.TestCase):
+    def test_same_as_markdown(self):
+        """Tests that rendering gives the same result as the markdown library"""
+        texts = [
+            "Hello, world!",
+            "Yes - definitely.",
+            "https://open.spotify.com/track/abc?si=1",
+            "No song found for this search 🥹",
+            "1. a list",
+            "2) another",
+            "- an item",
+            "# a header",
+            "> a quote",
+            "    indented code",
+            "trailing space ",
+            "a *bold* _move_",
+            "`code` and [a link](https://example.com)",
+            "AT&T <b>html</b>",
+            "Line one\n\nLine two",
+            "Stored the birthday!",
+            "a\tb",
+            "a\rb",
+            "a\x02b\x03",
+        ]
+        texts.extend(static_responses("!"))
+
+        for text in texts:
+            with self.subTest(text=text):
+                self.assertEqual(render_markdown(text), markdown(text))
+
+    def test_fast_path(self):
+        """Tests which texts skip the markdown parser"""
+        self.assertTrue(is_plain_text("It is certain."))
+        self.assertFalse(is_plain_text("It is *certain*."))
+        self.assertFalse(is_plain_text("1. It is certain."))
+        self.assertFalse(is_plain_text(""))
+        # Tabs are expanded and carriage returns become newlines
+        self.assertFalse(is_plain_text("a\tb"))
+        self.assertFalse(is_plain_text("a\rb"))
+
+    def test_prerender(self):
+        """Tests that prerendered responses are looked up rather than rendered"""
+        text = "The rules of this chat:\n\n- Be *nice*"
+        prerender([text])
+        self.assertEqual(render_markdown(text), markdown(text))
+
+
+if __name__ == "__main__":
+    unittest.main()
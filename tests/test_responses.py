@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from markdown import markdown
+
+from bangalore_bot.errors import ConfigError
+from bangalore_bot.responses import DEFAULT_PATH, ResponseCatalog, load_catalog
+
+
+class ResponseCatalogTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "responses.yaml")
+        shutil.copy(DEFAULT_PATH, self.path)
+
+        self.now = 0.0
+        self.catalog = ResponseCatalog(
+            self.path, check_interval=5, clock=lambda: self.now
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir)
+
+    def _rewrite(self, text: str) -> None:
+        with open(self.path, "w") as f:
+            f.write(text)
+        # Make sure the change is visible even on filesystems with coarse mtimes
+        mtime = os.stat(self.path).st_mtime + 10
+        os.utime(self.path, (mtime, mtime))
+
+    def test_load(self):
+        """Tests that the shipped responses load, with HTML rendered up front"""
+        responses = self.catalog.current
+        self.assertEqual(len(responses.eight_ball), 20)
+        self.assertEqual(responses.rules.html, markdown(responses.rules.plain))
+        self.assertIn("{name}", responses.welcome.html)
+
+        # The catalog can't be changed in place
+        with self.assertRaises(AttributeError):
+            responses.rules = responses.help_intro
+        self.assertIsInstance(responses.eight_ball, tuple)
+
+    def test_hot_reload(self):
+        """Tests that changes to the file are picked up once the interval passes"""
+        with open(self.path) as f:
+            original = f.read()
+        self._rewrite(original.replace("The rules of this chat:", "New rules:"))
+
+        self.now = 4
+        self.assertTrue(self.catalog.current.rules.plain.startswith("The rules"))
+
+        self.now = 5
+        self.assertTrue(self.catalog.current.rules.plain.startswith("New rules:"))
+
+    def test_broken_reload(self):
+        """Tests that the previous responses are kept if the file becomes invalid"""
+        previous = self.catalog.current
+        self._rewrite("rules: [unclosed")
+
+        self.now = 10
+        self.assertIs(self.catalog.current, previous)
+
+    def test_missing_response(self):
+        """Tests that a file missing a response is rejected"""
+        self._rewrite("rules: Be nice\n")
+        with self.assertRaises(ConfigError):
+            load_catalog(self.path)
+
+    def test_invalid_welcome_template(self):
+        """Tests that a welcome that can't be filled in is rejected on reload,
+        keeping the previous responses"""
+        with open(DEFAULT_PATH) as f:
+            original = f.read()
+        previous = self.catalog.current
+
+        for template in ("Hi {name}, {nickname}", "Hi {name} :-{", "Hi {0}"):
+            with self.subTest(template=template):
+                self._rewrite(
+                    original.replace("Hi {name}, welcome", template)
+                )
+                with self.assertRaises(ConfigError):
+                    load_catalog(self.path)
+
+                self.now += 10
+                self.assertIs(self.catalog.current, previous)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from bangalore_bot.scheduler import CronSchedule, Scheduler, ZoneInfo, get_timezone
+from bangalore_bot.storage import Storage
+
+from tests.utils import run_coroutine
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class CronScheduleTestCase(unittest.TestCase):
+    def test_invalid(self):
+        """Tests that invalid schedules and timezones are rejected"""
+        for expression in (
+            "0 0 * *",
+            "60 * * * *",
+            "* 24 * * *",
+            "0 0 0 * *",
+            "*/0 * * * *",
+            "5-1 * * * *",
+            "a * * * *",
+            "0 0 31 2 *",
+        ):
+            with self.subTest(expression=expression):
+                with self.assertRaises(ValueError):
+                    CronSchedule(expression, "UTC")
+
+    @unittest.skipIf(ZoneInfo is None, "needs zoneinfo")
+    def test_unknown_timezone(self):
+        """Tests that unknown timezones are rejected"""
+        with self.assertRaises(ValueError):
+            CronSchedule("0 0 * * *", "Mars/Olympus_Mons")
+
+    @patch("bangalore_bot.scheduler.ZoneInfo", None)
+    def test_timezone_fallback(self):
+        """Tests that without zoneinfo, UTC is still known and other timezones fall
+        back to the system's"""
+        self.assertEqual(get_timezone("UTC"), timezone.utc)
+        with self.assertLogs("bangalore_bot.scheduler", level="WARNING"):
+            self.assertIsNone(get_timezone("Asia/Kolkata"))
+
+    def test_next_after(self):
+        """Tests finding the next run of schedules"""
+        cases = [
+            # Every midnight in India, which is 18:30 UTC
+            (
+                "0 0 * * *",
+                "Asia/Kolkata",
+                utc(2026, 10, 17, 10),
+                utc(2026, 10, 17, 18, 30),
+            ),
+            # A run is never at the time given
+            ("0 0 * * *", "UTC", utc(2026, 10, 17), utc(2026, 10, 18)),
+            # Steps, ranges and weekdays. The 17th of October 2026 is a Saturday
+            (
+                "*/15 9-17 * * 1-5",
+                "UTC",
+                utc(2026, 10, 16, 17, 50),
+                utc(2026, 10, 19, 9),
+            ),
+            (
+                "*/15 9-17 * * 1-5",
+                "UTC",
+                utc(2026, 10, 19, 9, 1),
+                utc(2026, 10, 19, 9, 15),
+            ),
+            # The 1st of the month or any Sunday
+            ("0 12 1 * 0", "UTC", utc(2026, 10, 17), utc(2026, 10, 18, 12)),
+            ("0 12 1 * 7", "UTC", utc(2026, 10, 25, 13), utc(2026, 11, 1, 12)),
+            # Leap days
+            ("0 0 29 2 *", "UTC", utc(2026, 10, 17), utc(2028, 2, 29)),
+            # 02:30 doesn't exist in New York on the 8th of March, as the clocks go
+            # forward from 02:00 to 03:00. It runs at 03:30 (07:30 UTC) instead, once
+            (
+                "30 2 * * *",
+                "America/New_York",
+                utc(2026, 3, 8, 5),
+                utc(2026, 3, 8, 7, 30),
+            ),
+            (
+                "30 2 * * *",
+                "America/New_York",
+                utc(2026, 3, 8, 7, 30),
+                utc(2026, 3, 9, 6, 30),
+            ),
+            # 01:30 happens twice on the 1st of November, as the clocks go back from
+            # 02:00 to 01:00. It runs the first time only
+            (
+                "30 1 * * *",
+                "America/New_York",
+                utc(2026, 11, 1, 5),
+                utc(2026, 11, 1, 5, 30),
+            ),
+            (
+                "30 1 * * *",
+                "America/New_York",
+                utc(2026, 11, 1, 5, 30),
+                utc(2026, 11, 2, 6, 30),
+            ),
+        ]
+        for expression, tz, after, expected in cases:
+            with self.subTest(expression=expression, tz=tz, after=after):
+                when = CronSchedule(expression, tz).next_after(after)
+                # Compared as timestamps, as datetimes that are ambiguous in their
+                # own timezone never equal ones in another
+                self.assertEqual(when.timestamp(), expected.timestamp())
+                self.assertEqual(str(when.tzinfo), tz)
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.database_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(self.database_path)
+        self.store = Storage(
+            {"type": "sqlite", "connection_string": self.database_path}
+        )
+
+        self.now = utc(2026, 10, 17, 10).timestamp()
+        self.runs = []
+
+    def tearDown(self) -> None:
+        self.store.close()
+        os.remove(self.database_path)
+
+    async def job(self, when: datetime) -> None:
+        self.runs.append(when)
+
+    def _run_scheduler(self) -> None:
+        """Run a scheduler with a daily job at midnight UTC, until due runs start"""
+
+        async def run():
+            scheduler = Scheduler(self.store, clock=lambda: self.now)
+            await scheduler.add(
+                "birthdays", CronSchedule("0 0 * * *", "UTC"), self.job
+            )
+            scheduler.start()
+            await asyncio.sleep(0.05)
+            await scheduler.close()
+
+        run_coroutine(run())
+
+    def test_first_run(self):
+        """Tests that a new job waits for its first run"""
+        self._run_scheduler()
+        self.assertEqual(self.runs, [])
+        self.assertEqual(
+            run_coroutine(self.store.get_job_runs()),
+            {"birthdays": utc(2026, 10, 18).timestamp()}
+        )
+
+        self.now = utc(2026, 10, 18, 0, 0, 1).timestamp()
+        self._run_scheduler()
+        self.assertEqual(self.runs, [utc(2026, 10, 18)])
+
+    def test_catch_up(self):
+        """Tests that after being down for days, the run missed within the last day
+        is made up, exactly once"""
+        run_coroutine(
+            self.store.set_job_next_run("birthdays", utc(2026, 10, 15).timestamp())
+        )
+
+        with self.assertLogs("bangalore_bot.scheduler", level="WARNING"):
+            self._run_scheduler()
+        self.assertEqual(self.runs, [utc(2026, 10, 17)])
+        self.assertEqual(
+            run_coroutine(self.store.get_job_runs()),
+            {"birthdays": utc(2026, 10, 18).timestamp()}
+        )
+
+        # Restarting doesn't run it again
+        self._run_scheduler()
+        self.assertEqual(self.runs, [utc(2026, 10, 17)])
+
+    def test_store_failure(self):
+        """Tests that a run that can't be recorded is skipped, and following runs
+        still happen"""
+        set_job_next_run = self.store.set_job_next_run
+        failures = [RuntimeError("database is locked")]
+
+        async def fail_once(name: str, due: float) -> None:
+            if failures:
+                raise failures.pop()
+            await set_job_next_run(name, due)
+
+        async def run():
+            scheduler = Scheduler(self.store, max_sleep=0.01, clock=lambda: self.now)
+            await scheduler.add(
+                "birthdays", CronSchedule("0 0 * * *", "UTC"), self.job
+            )
+            self.store.set_job_next_run = fail_once
+            scheduler.start()
+
+            self.now = utc(2026, 10, 18, 0, 0, 1).timestamp()
+            await asyncio.sleep(0.05)
+            self.now = utc(2026, 10, 19, 0, 0, 1).timestamp()
+            await asyncio.sleep(0.05)
+            await scheduler.close()
+
+        with self.assertLogs("bangalore_bot.scheduler", level="ERROR"):
+            run_coroutine(run())
+        self.assertEqual(self.runs, [utc(2026, 10, 19)])
+        self.assertEqual(
+            run_coroutine(self.store.get_job_runs()),
+            {"birthdays": utc(2026, 10, 20).timestamp()}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
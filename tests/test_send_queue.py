@@ -0,0 +1,120 @@
+import asyncio
+import unittest
+from unittest.mock import Mock, patch
+
+import nio
+
+from bangalore_bot.send_queue import ROOM_SEND_ERRORS, SendQueue
+
+from tests.utils import run_coroutine
+
+
+class SendQueueTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sent = []
+
+        async def room_send(room_id, message_type, content, **kwargs):
+            self.sent.append((room_id, content["body"]))
+            return room_id
+
+        async def room_typing(room_id, typing_state=True):
+            return None
+
+        self.fake_client = Mock(spec=nio.AsyncClient)
+        self.fake_client.room_send.side_effect = room_send
+        self.fake_client.room_typing.side_effect = room_typing
+
+    def test_messages_in_a_room_keep_their_order(self):
+        """Tests that messages to the same room are sent in the order they were queued"""
+        queue = SendQueue(self.fake_client, typing_delay=(0, 0))
+
+        async def send_all():
+            await asyncio.gather(
+                *(queue.send("!room:example.com", {"body": str(i)}) for i in range(5))
+            )
+
+        run_coroutine(send_all())
+
+        self.assertEqual([body for _, body in self.sent], ["0", "1", "2", "3", "4"])
+        # Nothing is left behind once the room's queue has drained
+        self.assertEqual(queue._workers, {})
+        self.assertEqual(queue._queues, {})
+
+    def test_typing_delays_overlap(self):
+        """Tests that concurrent sends take roughly one delay rather than the sum"""
+        queue = SendQueue(self.fake_client, typing_delay=(0.1, 0.1))
+
+        async def send_all():
+            loop = asyncio.get_event_loop()
+            start = loop.time()
+            await asyncio.gather(
+                *(
+                    queue.send(f"!room{i % 3}:example.com", {"body": str(i)})
+                    for i in range(9)
+                )
+            )
+            return loop.time() - start
+
+        elapsed = run_coroutine(send_all())
+
+        self.assertEqual(len(self.sent), 9)
+        self.assertLess(elapsed, 0.5)
+        self.fake_client.room_typing.assert_any_call(
+            "!room0:example.com", typing_state=True
+        )
+        self.fake_client.room_typing.assert_any_call(
+            "!room0:example.com", typing_state=False
+        )
+
+    def test_typing_failure_still_sends(self):
+        """Tests that a message is sent even if the typing notification fails"""
+
+        async def room_typing(room_id, typing_state=True):
+            raise ConnectionError()
+
+        self.fake_client.room_typing.side_effect = room_typing
+        queue = SendQueue(self.fake_client, typing_delay=(0.01, 0.01))
+
+        async def send():
+            return await asyncio.wait_for(
+                queue.send("!room:example.com", {"body": "hi"}), 1
+            )
+
+        self.assertEqual(run_coroutine(send()), "!room:example.com")
+        self.assertEqual(self.sent, [("!room:example.com", "hi")])
+
+    def test_worker_failure_fails_queued_messages(self):
+        """Tests that an unexpected error fails every message waiting in the room,
+        instead of leaving them unresolved"""
+        queue = SendQueue(self.fake_client, typing_delay=(0, 0))
+
+        async def room_send(room_id, message_type, content, **kwargs):
+            if content["body"] == "1":
+                raise ConnectionError()
+            return room_id
+
+        self.fake_client.room_send.side_effect = room_send
+
+        async def send_all():
+            return await asyncio.wait_for(
+                asyncio.gather(
+                    *(
+                        queue.send("!room:example.com", {"body": str(i)})
+                        for i in range(3)
+                    ),
+                    return_exceptions=True,
+                ),
+                1,
+            )
+
+        # Counting the failed send goes wrong, outside of the send's own handling
+        with patch.object(ROOM_SEND_ERRORS, "inc", side_effect=RuntimeError):
+            results = run_coroutine(send_all())
+        self.assertEqual(results[0], "!room:example.com")
+        self.assertIsInstance(results[1], RuntimeError)
+        self.assertIsInstance(results[2], RuntimeError)
+        self.assertEqual(queue._workers, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
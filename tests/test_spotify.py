@@ -0,0 +1,157 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import Mock
+
+from bangalore_bot.cache import TTLCache
+from bangalore_bot.errors import SpotifyError
+from bangalore_bot.spotify import SpotifyClient
+from bangalore_bot.storage import Storage
+
+from tests.utils import make_awaitable, run_coroutine
+
+
+class FakeResponse:
+    def __init__(self, data, status=200):
+        self.data = data
+        self.status = status
+
+    async def json(self):
+        # Give other coroutines a chance to run, like a real request would
+        await asyncio.sleep(0)
+        return self.data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+
+class FakeSession:
+    def __init__(self):
+        self.token_requests = 0
+        self.search_requests = 0
+
+    def post(self, url, **kwargs):
+        self.token_requests += 1
+        return FakeResponse({"access_token": "token", "expires_in": 3600})
+
+    def get(self, url, params=None, **kwargs):
+        self.search_requests += 1
+        return FakeResponse(
+            {"tracks": {"items": [{"uri": f"spotify:track:{params['q']}"}]}}
+        )
+
+
+class SpotifyClientTestCase(unittest.TestCase):
+    def test_access_token_is_cached(self):
+        """Tests that concurrent searches share one token request"""
+        session = FakeSession()
+        spotify = SpotifyClient(session, "id", "secret")
+
+        async def search_all():
+            return await asyncio.gather(
+                *(spotify.search(f"song{i}") for i in range(5))
+            )
+
+        urls = run_coroutine(search_all())
+
+        self.assertEqual(urls[0], "https://open.spotify.com/track/song0")
+        self.assertEqual(session.token_requests, 1)
+        self.assertEqual(session.search_requests, 5)
+
+    def test_identical_searches_are_shared(self):
+        """Tests that identical searches are coalesced and then served from the cache"""
+        session = FakeSession()
+        cache = TTLCache(max_size=10, ttl=60)
+        spotify = SpotifyClient(session, "id", "secret", cache=cache)
+
+        async def search_all():
+            urls = await asyncio.gather(
+                spotify.search("Song"), spotify.search("  song "), spotify.search("song")
+            )
+            urls.append(await spotify.search("SONG"))
+            return urls
+
+        urls = run_coroutine(search_all())
+
+        self.assertEqual(set(urls), {"https://open.spotify.com/track/song"})
+        self.assertEqual(session.search_requests, 1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_no_results(self):
+        """Tests that a search without results returns None"""
+        session = FakeSession()
+        session.get = lambda url, **kwargs: FakeResponse({"tracks": {"items": []}})
+        spotify = SpotifyClient(session, "id", "secret")
+
+        self.assertIsNone(run_coroutine(spotify.search("nothing")))
+
+    def test_failed_search_is_not_cached(self):
+        """Tests that an error from Spotify raises rather than being cached as no
+        results"""
+        session = FakeSession()
+        statuses = [429, 401, 401, 200]
+        responses = []
+
+        def get(url, params=None, **kwargs):
+            status = statuses.pop(0)
+            responses.append(status)
+            items = [{"uri": "spotify:track:found"}] if status == 200 else []
+            return FakeResponse({"tracks": {"items": items}}, status)
+
+        session.get = get
+        cache = TTLCache(max_size=10, ttl=60)
+        spotify = SpotifyClient(session, "id", "secret", cache=cache)
+
+        # Rate limited, then rejected even with a fresh token
+        for _ in range(2):
+            with self.assertRaises(SpotifyError):
+                run_coroutine(spotify.search("song"))
+        url = run_coroutine(spotify.search("song"))
+        self.assertEqual(url, "https://open.spotify.com/track/found")
+        self.assertEqual(responses, [429, 401, 401, 200])
+
+    def test_failed_token_request(self):
+        """Tests that a search fails if Spotify doesn't give an access token"""
+        session = FakeSession()
+        session.post = lambda url, **kwargs: FakeResponse({"error": "bad"}, 400)
+        spotify = SpotifyClient(session, "id", "secret")
+
+        with self.assertRaises(SpotifyError):
+            run_coroutine(spotify.search("song"))
+        self.assertEqual(session.search_requests, 0)
+
+    def test_load(self):
+        """Tests that persisted results are loaded into the cache"""
+        store = Mock(spec=Storage)
+        rows = [("song", "track", "https://open.spotify.com/track/x", time.time() + 60)]
+        store.get_spotify_results = Mock(return_value=make_awaitable(rows))
+        session = FakeSession()
+        spotify = SpotifyClient(
+            session, "id", "secret", cache=TTLCache(max_size=10, ttl=60), store=store
+        )
+        run_coroutine(spotify.load())
+
+        url = run_coroutine(spotify.search("Song"))
+        self.assertEqual(url, "https://open.spotify.com/track/x")
+        self.assertEqual(session.search_requests, 0)
+
+    def test_failed_store(self):
+        """Tests that a search still succeeds if its result can't be persisted"""
+        store = Mock(spec=Storage)
+        failure = asyncio.Future()  # type: asyncio.Future
+        failure.set_exception(RuntimeError("database is locked"))
+        store.store_spotify_result = Mock(return_value=failure)
+        cache = TTLCache(max_size=10, ttl=60)
+        spotify = SpotifyClient(FakeSession(), "id", "secret", cache=cache, store=store)
+
+        with self.assertLogs("bangalore_bot.spotify", level="ERROR"):
+            url = run_coroutine(spotify.search("song"))
+        self.assertEqual(url, "https://open.spotify.com/track/song")
+        store.store_spotify_result.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from bangalore_bot.stats import DAY_MS, HOUR_MS, Retention, RoomStats
+from bangalore_bot.storage import Storage
+
+from tests.utils import run_coroutine
+
+ROOM = "!room:example.com"
+# A Monday, at midnight UTC
+START = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class RoomStatsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.database_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        os.remove(self.database_path)
+        self.store = Storage(
+            {"type": "sqlite", "connection_string": self.database_path}
+        )
+        self.now = START / 1000
+        self.stats = RoomStats(
+            self.store, timezone=timezone.utc, clock=lambda: self.now
+        )
+
+    def tearDown(self) -> None:
+        self.store.close()
+        os.remove(self.database_path)
+
+    def test_flush_adds_to_rollups(self):
+        """Tests that counts are added to the ones already written, and kept if they
+        can't be written"""
+        for _ in range(2):
+            self.stats.record_message(ROOM, "@a:example.com", START + 1)
+        run_coroutine(self.stats.flush())
+        self.stats.record_message(ROOM, "@a:example.com", START + 2)
+        self.stats.record_message(ROOM, "@a:example.com", START + HOUR_MS)
+
+        with patch.object(self.store, "add_activity", side_effect=OSError):
+            run_coroutine(self.stats.flush())
+        run_coroutine(self.stats.flush())
+
+        self.assertEqual(
+            run_coroutine(
+                self.store.fetchall(
+                    "SELECT hour, count FROM message_counts ORDER BY hour"
+                )
+            ),
+            [(START // HOUR_MS, 3), (START // HOUR_MS + 1, 1)],
+        )
+
+    def test_report(self):
+        """Tests the top posters, heatmap and retention of a report"""
+        # One joiner posts straight away, one after a fortnight and one never
+        self.stats.record_join(ROOM, "@a:example.com", START - 20 * DAY_MS)
+        self.stats.record_join(ROOM, "@b:example.com", START - 20 * DAY_MS)
+        self.stats.record_join(ROOM, "@d:example.com", START - 20 * DAY_MS)
+
+        # Monday 00:00 and Tuesday 13:00
+        for _ in range(3):
+            self.stats.record_message(ROOM, "@a:example.com", START)
+        self.stats.record_message(
+            ROOM, "@b:example.com", START + DAY_MS + 13 * HOUR_MS
+        )
+        self.stats.record_message("!other:example.com", "@c:example.com", START)
+        # Too long ago to be included
+        self.stats.record_message(ROOM, "@c:example.com", START - 40 * DAY_MS)
+
+        self.stats.record_message(ROOM, "@a:example.com", START - 20 * DAY_MS)
+        run_coroutine(self.stats.flush())
+        # Written separately, and out of order
+        self.stats.record_message(ROOM, "@b:example.com", START - 6 * DAY_MS)
+        self.stats.record_message(ROOM, "@a:example.com", START - 30 * DAY_MS)
+        run_coroutine(self.stats.flush())
+        # A later join is ignored
+        self.stats.record_join(ROOM, "@d:example.com", START - DAY_MS)
+
+        self.now = (START + 2 * DAY_MS) / 1000
+        report = run_coroutine(self.stats.report(ROOM, 30, top=2))
+
+        self.assertEqual(report.messages, 6)
+        self.assertEqual(
+            report.top_posters, [("@a:example.com", 4), ("@b:example.com", 2)]
+        )
+        self.assertEqual(report.heatmap[0][0], 3)
+        self.assertEqual(report.heatmap[1][13], 1)
+        self.assertEqual(report.retention, Retention(joined=3, posted=1, active=2))
+
+        # Another instance updates the joiners that are already tracked, and only
+        # them, without loading them
+        stats = RoomStats(self.store)
+        stats.record_message(ROOM, "@d:example.com", START)
+        run_coroutine(stats.flush())
+        self.assertEqual(
+            run_coroutine(
+                self.store.fetchall(
+                    "SELECT user_id, first_message_at FROM room_joins "
+                    "WHERE user_id IN ('@c:example.com', '@d:example.com')"
+                )
+            ),
+            [("@d:example.com", START)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
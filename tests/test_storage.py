@@ -0,0 +1,233 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from bangalore_bot.storage import Storage, _translate, latest_migration_version
+
+from tests.utils import run_coroutine
+
+
+class StorageTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.database_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+
+        # Start from a database at migration version 0
+        conn = sqlite3.connect(self.database_path)
+        conn.execute("CREATE TABLE migration_version (version INTEGER PRIMARY KEY)")
+        conn.execute("INSERT INTO migration_version (version) VALUES (0)")
+        # A birthdays table as created by hand for older versions
+        conn.execute(
+            "CREATE TABLE birthdays (sender, sender_name, birth_month, birth_day, birth_year)"
+        )
+        conn.execute(
+            "INSERT INTO birthdays VALUES ('@old:example.com', '', 3, 14, 1990)"
+        )
+        conn.commit()
+        conn.close()
+
+        self.store = Storage(
+            {"type": "sqlite", "connection_string": self.database_path}
+        )
+
+    def tearDown(self) -> None:
+        self.store.close()
+        os.remove(self.database_path)
+
+    def test_concurrent_queries(self):
+        """Tests that concurrent queries each get their own results"""
+
+        async def query_all():
+            await asyncio.gather(
+                *(
+                    self.store.execute(
+                        "INSERT INTO welcomed_users (room_id, user_id) VALUES (?, ?)",
+                        (f"!room{i % 2}:example.com", f"@user{i}:example.com"),
+                    )
+                    for i in range(10)
+                )
+            )
+            return await asyncio.gather(
+                self.store.fetchall(
+                    "SELECT user_id FROM welcomed_users WHERE room_id = ?",
+                    ("!room0:example.com",),
+                ),
+                self.store.fetchall(
+                    "SELECT user_id FROM welcomed_users WHERE room_id = ?",
+                    ("!room1:example.com",),
+                ),
+                self.store.fetchone("SELECT COUNT(*) FROM welcomed_users"),
+            )
+
+        room0, room1, count = run_coroutine(query_all())
+
+        self.assertEqual(len(room0), 5)
+        self.assertEqual(len(room1), 5)
+        self.assertEqual(count, (10,))
+
+    def test_mark_welcomed(self):
+        """Tests that welcomed users are written through and loaded on startup"""
+        run_coroutine(self.store.mark_welcomed("!room:example.com", "@a:example.com"))
+        self.assertTrue(self.store.is_welcomed("!room:example.com", "@a:example.com"))
+        self.store.close()
+
+        self.store = Storage(
+            {"type": "sqlite", "connection_string": self.database_path}
+        )
+        self.assertTrue(self.store.is_welcomed("!room:example.com", "@a:example.com"))
+        self.assertFalse(self.store.is_welcomed("!other:example.com", "@a:example.com"))
+
+    def test_birthdays(self):
+        """Tests that birthdays are migrated, upserted and queried by date"""
+        run_coroutine(
+            self.store.set_birthday("@a:example.com", "", 3, 20, 1995)
+        )
+        # Updating a birthday replaces the old one
+        run_coroutine(
+            self.store.set_birthday("@b:example.com", "", 4, 1, 1990)
+        )
+        run_coroutine(
+            self.store.set_birthday("@b:example.com", "", 3, 2, 1990)
+        )
+
+        self.assertEqual(
+            run_coroutine(self.store.get_birthdays_in_month(3)),
+            [("@b:example.com", 2), ("@old:example.com", 14), ("@a:example.com", 20)],
+        )
+        self.assertEqual(run_coroutine(self.store.get_birthdays_in_month(4)), [])
+        self.assertEqual(
+            run_coroutine(self.store.get_birthdays_on(3, 14)), ["@old:example.com"]
+        )
+
+        # The month/day index is used
+        plan = run_coroutine(
+            self.store.fetchall(
+                "EXPLAIN QUERY PLAN SELECT sender FROM birthdays "
+                "WHERE birth_month = ? AND birth_day = ?",
+                (3, 14),
+            )
+        )
+        self.assertIn("birthdays_month_day", str(plan))
+
+    def test_birthday_index_matches_table(self):
+        """Tests that the birthday index agrees with the table after concurrent writes"""
+
+        async def write_all():
+            await asyncio.gather(
+                *(
+                    self.store.set_birthday(
+                        f"@user{i % 7}:example.com", "", i % 12 + 1, i % 28 + 1, 1990
+                    )
+                    for i in range(100)
+                )
+            )
+
+        run_coroutine(write_all())
+
+        for month in range(1, 13):
+            from_table = run_coroutine(self.store.get_birthdays_in_month(month))
+            self.assertEqual(
+                sorted(self.store.birthdays.in_month(month)), sorted(from_table)
+            )
+        self.assertEqual(len(self.store.birthdays), 8)
+
+        # The index is loaded from the table on startup
+        self.store.close()
+        self.store = Storage(
+            {"type": "sqlite", "connection_string": self.database_path}
+        )
+        self.assertEqual(len(self.store.birthdays), 8)
+
+    def test_search_messages(self):
+        """Tests that archived messages are searched within a room, ranked and
+        paged"""
+        run_coroutine(
+            self.store.insert_messages(
+                [
+                    ("$1", "!a:example.com", "@u:example.com", "Running the tests", 1),
+                    ("$2", "!a:example.com", "@u:example.com", "pizza pizza pizza", 2),
+                    (
+                        "$3",
+                        "!a:example.com",
+                        "@u:example.com",
+                        "I had pizza yesterday with a few of my friends",
+                        3,
+                    ),
+                    ("$4", "!b:example.com", "@u:example.com", "pizza elsewhere", 4),
+                    ("$5", "!a:example.com", "@u:example.com", "NOT a pizza", 5),
+                ]
+            )
+        )
+
+        def search(words, limit=10, offset=0, window=1000):
+            rows = run_coroutine(
+                self.store.search_messages(
+                    "!a:example.com", words, limit, offset, window
+                )
+            )
+            return [row[0] for row in rows]
+
+        # Words are matched by their stems
+        self.assertEqual(search(["run", "TEST"]), ["$1"])
+        self.assertEqual(search(["pizza"]), ["$2", "$5", "$3"])
+        self.assertEqual(search(["pizza"], limit=1, offset=1), ["$5"])
+        # Only the newest matches are ranked
+        self.assertEqual(search(["pizza"], window=2), ["$5", "$3"])
+        self.assertEqual(search(["pizza", "friends"]), ["$3"])
+        # Words that are FTS5 operators are searched for like any other
+        self.assertEqual(search(["NOT"]), ["$5"])
+        self.assertEqual(search(["missing"]), [])
+
+    def test_initial_setup(self):
+        """Tests that a new database is set up and migrated to the latest version"""
+        self.store.close()
+        os.remove(self.database_path)
+
+        self.store = Storage(
+            {"type": "sqlite", "connection_string": self.database_path}
+        )
+        self.assertEqual(
+            run_coroutine(self.store.fetchone("SELECT version FROM migration_version")),
+            (latest_migration_version,),
+        )
+
+    def test_import_visited_json(self):
+        """Tests that users welcomed before welcomes were kept in the database are
+        imported, so they aren't welcomed again"""
+        self.store.close()
+        os.remove(self.database_path)
+
+        with tempfile.TemporaryDirectory() as directory:
+            visited_path = os.path.join(directory, "visited.json")
+            with open(visited_path, "w") as f:
+                json.dump({"@old:example.com": True}, f)
+            with patch("bangalore_bot.storage.VISITED_PATH", visited_path), patch.dict(
+                os.environ, {"MAIN_ROOM": "!main:example.com"}
+            ):
+                self.store = Storage(
+                    {"type": "sqlite", "connection_string": self.database_path}
+                )
+
+        self.assertTrue(self.store.is_welcomed("!main:example.com", "@old:example.com"))
+        self.assertFalse(self.store.is_welcomed("!main:example.com", "@new:example.com"))
+
+    def test_translate(self):
+        """Tests that placeholders are rewritten for postgres once per statement"""
+        _translate.cache_clear()
+        sql = "SELECT user_id FROM welcomed_users WHERE room_id = ? AND user_id = ?"
+
+        self.assertEqual(_translate(sql, "sqlite"), sql)
+        for _ in range(3):
+            self.assertEqual(
+                _translate(sql, "postgres"),
+                "SELECT user_id FROM welcomed_users WHERE room_id = %s AND user_id = %s",
+            )
+        self.assertEqual(_translate.cache_info().hits, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
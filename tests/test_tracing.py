@@ -0,0 +1,146 @@
+import asyncio
+import io
+import json
+import unittest
+from unittest.mock import patch
+
+from bangalore_bot import tracing
+from bangalore_bot.executor import CommandExecutor
+from bangalore_bot.trace_summary import percentile, stage_durations, summarise
+
+from tests.utils import run_coroutine
+
+
+class TracingTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.output = io.StringIO()
+        self.sample = True
+        tracing.configure(
+            tracing.Tracer(self.output, rng=lambda: 0 if self.sample else 1)
+        )
+
+    def tearDown(self) -> None:
+        tracing.configure(None)
+
+    def _traces(self):
+        return [json.loads(line) for line in self.output.getvalue().splitlines()]
+
+    def test_nested_spans(self):
+        """Tests that spans are nested under the event's trace"""
+
+        @tracing.traced("lookup")
+        async def lookup():
+            with tracing.span("query"):
+                await asyncio.sleep(0)
+
+        async def handle():
+            with tracing.trace("message", "$event", "!room"):
+                await lookup()
+                with tracing.span("reply"):
+                    pass
+
+        run_coroutine(handle())
+
+        [trace] = self._traces()
+        self.assertEqual(
+            (trace["handler"], trace["event_id"], trace["room_id"]),
+            ("message", "$event", "!room"),
+        )
+        self.assertEqual([span["name"] for span in trace["spans"]], ["lookup", "reply"])
+        self.assertEqual(trace["spans"][0]["spans"][0]["name"], "query")
+        self.assertGreaterEqual(trace["duration"], trace["spans"][0]["duration"])
+
+    def test_sampling(self):
+        """Tests that unsampled events record nothing"""
+        self.sample = False
+        with tracing.trace("message"), tracing.span("reply"):
+            tracing.record("send", 0, 1)
+        self.assertEqual(self._traces(), [])
+
+    def test_carry(self):
+        """Tests that work run later by a worker is part of the trace it came from,
+        and that the trace is only written once that work finishes"""
+        executor = CommandExecutor(concurrency=1)
+
+        async def command():
+            with tracing.span("command.help"):
+                await asyncio.sleep(0.01)
+
+        async def handle():
+            with tracing.trace("message", "$traced"):
+                executor.submit("!room", tracing.carry(command))
+            self.assertEqual(self._traces(), [])
+
+            # Work that isn't traced doesn't end up in a trace the worker saw before
+            self.sample = False
+            with tracing.trace("message", "$untraced"):
+                executor.submit("!room", tracing.carry(command))
+
+            while executor.completed < 2:
+                await asyncio.sleep(0.01)
+            await executor.close()
+
+        run_coroutine(handle())
+
+        [trace] = self._traces()
+        self.assertEqual(trace["event_id"], "$traced")
+        self.assertEqual(
+            [span["name"] for span in trace["spans"]], ["queued", "command.help"]
+        )
+
+    def test_discarded_carry(self):
+        """Tests that a trace is still written when the work carried from it is
+        rejected rather than run"""
+        executor = CommandExecutor(concurrency=1, max_queue=0)
+
+        async def command():
+            pass
+
+        with tracing.trace("message", "$rejected"):
+            job = tracing.carry(command)
+            self.assertFalse(executor.submit("!room", job))
+            job.discard()
+
+        [trace] = self._traces()
+        self.assertEqual(trace["event_id"], "$rejected")
+        self.assertEqual([span["name"] for span in trace["spans"]], ["discarded"])
+
+    def test_configure_without_contextvars(self):
+        """Tests that tracing stays off where contextvars isn't available"""
+        tracing.configure(None)
+        with patch.object(tracing, "ContextVar", None), self.assertLogs(
+            "bangalore_bot.tracing", level="WARNING"
+        ):
+            tracing.configure(tracing.Tracer(self.output))
+        with tracing.trace("message"):
+            pass
+        self.assertEqual(self._traces(), [])
+
+    def test_summary(self):
+        """Tests summarising traces into per-stage percentiles"""
+        lines = [
+            json.dumps(
+                {
+                    "handler": "message",
+                    "duration": i / 1000,
+                    "spans": [{"name": "send", "duration": i / 2000}],
+                }
+            )
+            for i in range(1, 101)
+        ]
+        lines.append("not json")
+
+        with self.assertLogs("bangalore_bot.trace_summary", level="WARNING"):
+            durations = stage_durations(lines)
+        self.assertEqual(len(durations["message"]), 100)
+        self.assertEqual(percentile(sorted(durations["message"]), 0.95), 0.095)
+
+        output = io.StringIO()
+        summarise(durations, output)
+        header, message, send = output.getvalue().splitlines()
+        self.assertEqual(message.split(), ["message", "100", "50.0", "95.0", "99.0"])
+        self.assertEqual(send.split()[0], "send")
+
+
+if __name__ == "__main__":
+    unittest.main()
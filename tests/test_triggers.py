@@ -0,0 +1,75 @@
+import unittest
+
+from bangalore_bot.errors import ConfigError
+from bangalore_bot.triggers import TriggerEngine
+
+
+class TriggerEngineTestCase(unittest.TestCase):
+    def test_match(self):
+        """Tests that every matching trigger is found in one pass, once each"""
+        engine = TriggerEngine.from_config(
+            [
+                {"keyword": "rules", "response": "Send !rules"},
+                {"regex": r"\bmods?\b", "action": "tag_admins"},
+                {"keyword": "c++", "response": "Not again"},
+            ]
+        )
+
+        matched = engine.match("Mods, where are the RULES? The rules, mods!")
+        self.assertEqual(
+            [(t.response, t.action) for t in matched],
+            [(None, "tag_admins"), ("Send !rules", None)],
+        )
+
+        # Keywords only match whole words, and are matched literally
+        self.assertEqual(engine.match("no misrules or c"), [])
+        self.assertEqual(len(engine.match("I like c++ a lot")), 1)
+
+    def test_overlapping_matches(self):
+        """Tests that a regex matching a long stretch of text doesn't hide the
+        triggers inside it"""
+        engine = TriggerEngine.from_config(
+            [
+                {"regex": r"help.*", "response": "help"},
+                {"keyword": "rules", "response": "rules"},
+                {"regex": r"please", "response": "please"},
+            ]
+        )
+        matched = engine.match("Help me with the rules please")
+        self.assertEqual([t.response for t in matched], ["help", "rules", "please"])
+
+    def test_keyword_case(self):
+        """Tests that keywords whose case-insensitive matches don't lower to the
+        keyword are still found"""
+        engine = TriggerEngine.from_config(
+            [
+                {"keyword": "kelvin", "response": "k"},
+                {"keyword": "straße", "response": "street"},
+            ]
+        )
+        # A Kelvin sign, which lowers to a plain k
+        self.assertEqual(len(engine.match("\u212aELVIN")), 1)
+        # A capital sharp s, which lowers to a different character than it
+        # casefolds to
+        self.assertEqual(len(engine.match("STRA\u1e9eE")), 1)
+
+    def test_empty(self):
+        """Tests that an engine without triggers matches nothing"""
+        self.assertEqual(TriggerEngine.from_config(None).match("anything"), [])
+
+    def test_invalid_config(self):
+        """Tests that invalid triggers are rejected"""
+        for entry in (
+            {"regex": "(", "response": "x"},
+            {"regex": "a(?i)b", "response": "x"},
+            {"keyword": "x"},
+            {"keyword": "x", "response": "x", "action": "tag_admins"},
+            {"keyword": "x", "action": "explode"},
+            {"response": "x"},
+        ):
+            with self.assertRaises(ConfigError):
+                TriggerEngine.from_config([entry])
+
+
+if __name__ == "__main__":
+    unittest.main()
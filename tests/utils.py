@@ -8,6 +8,9 @@ def run_coroutine(result: Awaitable[Any]) -> Any:
     loop = asyncio.get_event_loop()
     result = loop.run_until_complete(result)
     loop.close()
+
+    # Give following tests a fresh loop to run on
+    asyncio.set_event_loop(asyncio.new_event_loop())
     return result
 
 